@@ -3,12 +3,22 @@ import re
 import json
 import os
 import io
+import gzip
+import hashlib
 import shutil
+import time
+import threading
 import traceback
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from PIL import Image, ImageOps, ImageFilter
 import pytesseract
+from pytesseract import Output
 from pdf2image import convert_from_bytes
+try:
+    import pypdfium2 as pdfium  # opcional: renderiza no próprio processo (sem pdftoppm/PNG)
+except ImportError:
+    pdfium = None
 
 # Selenium
 from selenium import webdriver
@@ -73,11 +83,138 @@ PRESET_BY_LABEL = {p["label"]: p for p in IOL_PRESETS}
 def _to_f(s: str) -> float:
     return float(str(s).replace(",", ".").strip())
 
-def ocr_top_header_get_text(imagem_pil, top_ratio: float = 0.22, lang: str = "por+eng") -> str:
-    w, h = imagem_pil.size
-    top_h = int(h * top_ratio)
-    header = imagem_pil.crop((0, 0, w, top_h))
-    return pytesseract.image_to_string(header, lang=lang, config="--psm 6")
+# Palavras do OCR (image_to_data) guardadas por página + região + parâmetros: trocar o modo de
+# extração ou as regras de leitura relê as palavras guardadas, sem rodar o Tesseract de novo.
+# Cada região continua sendo uma passada própria, como antes: cabeçalho (topo, PSM 6), metades
+# esquerda/direita e página inteira (PSM da barra lateral).
+OCR_STORE_DIR = os.environ.get(
+    "BARRETT_OCR_STORE", os.path.join(os.path.expanduser("~"), ".barrett_autofill", "ocr")
+)
+# retenção: palavras trazem nome e biometria do paciente; 0 dia = não grava em disco (só na sessão)
+OCR_STORE_DAYS = float(os.environ.get("BARRETT_OCR_STORE_DAYS", "30"))
+OCR_STORE_MAX_MB = float(os.environ.get("BARRETT_OCR_STORE_MB", "200"))
+OCR_SESSION_MAX = 16   # passadas mantidas na memória da sessão
+OCR_WORD_FIELDS = ["text", "left", "top", "width", "height", "conf", "block", "par", "line"]
+OCR_REGIONS = {"header": (0, 0, 1, 0.22), "left": (0, 0, 0.5, 1), "right": (0.5, 0, 1, 1), "full": (0, 0, 1, 1)}
+HEADER_PSM = "6"
+
+def _ocr_store_path(page_key: str, params: dict) -> str:
+    tag = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(OCR_STORE_DIR, f"{page_key}_{tag}.json.gz")
+
+def _load_ocr_record(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+@st.cache_data(max_entries=2000, show_spinner=False)
+def _load_ocr_record_cached(path: str, size: int) -> dict:
+    # arquivos do acervo nunca são reescritos (nome = página + parâmetros): caminho + tamanho bastam
+    return _load_ocr_record(path)
+
+def _ocr_store_evict():
+    """Apaga passadas mais velhas que OCR_STORE_DAYS e, acima de OCR_STORE_MAX_MB, as menos usadas."""
+    now = time.time()
+    files = []
+    for fn in os.listdir(OCR_STORE_DIR):
+        fp = os.path.join(OCR_STORE_DIR, fn)
+        try:
+            files.append((os.path.getmtime(fp), os.path.getsize(fp), fp))
+        except OSError:
+            continue
+    total = sum(f[1] for f in files)
+    for mtime, size, fp in sorted(files):
+        if now - mtime > OCR_STORE_DAYS * 86400 or total > OCR_STORE_MAX_MB * 1024 * 1024:
+            try:
+                os.remove(fp)
+                total -= size
+            except OSError:
+                pass
+
+def _ocr_session_put(path: str, rec: dict):
+    mem = st.session_state.setdefault("ocr_words_mem", {})
+    mem.pop(path, None)
+    mem[path] = rec
+    while len(mem) > OCR_SESSION_MAX:
+        mem.pop(next(iter(mem)))
+
+def ocr_region(pagina, region: str, page_key: str, params: dict, preprocess=None, meta: dict = None) -> dict:
+    """Passada de OCR numa região da página (recortada e pré-processada só se não estiver guardada).
+       Retorna {"size": [w, h], "words": [[texto, x, y, larg, alt, conf, bloco, parágrafo, linha], ...],
+       "cached": bool}."""
+    params = {**params, "region": region}
+    path = _ocr_store_path(page_key, params)
+    mem = st.session_state.get("ocr_words_mem", {})
+    if path in mem:
+        return {**mem[path], "cached": True}
+    if OCR_STORE_DAYS > 0:
+        try:
+            rec = _load_ocr_record(path)
+            os.utime(path)   # uso recente: fica por último na fila de despejo
+            _ocr_session_put(path, rec)
+            return {**rec, "cached": True}
+        except (OSError, ValueError):
+            pass
+    w, h = pagina.size
+    x0, y0, x1, y1 = OCR_REGIONS[region]
+    im = pagina.crop((int(x0 * w), int(y0 * h), int(x1 * w), int(y1 * h)))
+    if preprocess:
+        im = preprocess(im)
+    psm = HEADER_PSM if region == "header" else params["psm"]
+    data = pytesseract.image_to_data(im, lang=params["lang"], config=f"--psm {psm}", output_type=Output.DICT)
+    words = [
+        [txt.strip(), data["left"][i], data["top"][i], data["width"][i], data["height"][i],
+         round(float(data["conf"][i]), 1), data["block_num"][i], data["par_num"][i], data["line_num"][i]]
+        for i, txt in enumerate(data["text"]) if txt and txt.strip()
+    ]
+    rec = {**(meta or {}), "page_key": page_key, "params": params, "size": list(im.size),
+           "fields": OCR_WORD_FIELDS, "words": words}
+    _ocr_session_put(path, rec)
+    if OCR_STORE_DAYS > 0:
+        try:
+            os.makedirs(OCR_STORE_DIR, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump(rec, f, ensure_ascii=False)
+            os.replace(tmp, path)
+            _ocr_store_evict()
+        except OSError:
+            pass
+    return {**rec, "cached": False}
+
+def words_to_text(words: list) -> str:
+    """Texto na ordem de leitura do Tesseract: uma linha por (bloco, parágrafo, linha)."""
+    linhas, atual = [], None
+    for wd in words:
+        chave = (wd[6], wd[7], wd[8])
+        if chave != atual:
+            linhas.append([])
+            atual = chave
+        linhas[-1].append(wd[0])
+    return "\n".join(" ".join(ln) for ln in linhas)
+
+def _region_text(fonte, region: str):
+    """`fonte(região)` devolve o registro de OCR (rodando o Tesseract se preciso) ou None."""
+    rec = fonte(region)
+    return None if rec is None else words_to_text(rec["words"])
+
+def ocr_top_header_get_text(fonte) -> str:
+    return _region_text(fonte, "header") or ""
+
+def extrair_patient_name_do_header(texto_header: str):
+    blacklist = [
+        "report date","biometria","cálculo iol","page","id:","dob:","gender:",
+        "r. ","av. ","rua ","tel","cep","http","www","e-mail","email",
+        "printing images","admin/","instituto","hospital"
+    ]
+    linhas = [ln.strip() for ln in texto_header.splitlines() if ln.strip()]
+    for ln in linhas:
+        low = ln.lower()
+        if any(b in low for b in blacklist):
+            continue
+        candidato = re.sub(r"[^A-Za-zÀ-ÖØ-öø-ÿ' \-\.]", "", ln).strip()
+        if len(candidato.split()) >= 2 and 2 <= len(candidato) <= 80:
+            return candidato
+    return ""
 
 def _normalize(txt: str) -> str:
     return re.sub(r"[ \t]", " ", txt).replace(",", ".")  # normaliza vírgula decimal e NBSP
@@ -120,35 +257,23 @@ def _parse_eye_text(txt: str) -> dict:
 
     return {"AL": al, "K1": k1, "K2": k2, "ACD": acd}
 
-def extrair_biometria_dupla_por_metades(paginas, lang: str = "por+eng", preprocess=None, psm="6"):
-    """1ª página em duas metades: esq=OD, dir=OS."""
-    if not paginas:
-        return {}, "", "", None, None
-    img = paginas[0]
-    w, h = img.size
-    mid = w // 2
-    left = img.crop((0, 0, mid, h))
-    right = img.crop((mid, 0, w, h))
-    if preprocess:
-        left_pp = preprocess(left)
-        right_pp = preprocess(right)
-    else:
-        left_pp, right_pp = left, right
-    txt_left = pytesseract.image_to_string(left_pp, lang=lang, config=f"--psm {psm}")
-    txt_right = pytesseract.image_to_string(right_pp, lang=lang, config=f"--psm {psm}")
+def extrair_biometria_dupla_por_metades(fonte):
+    """Metade esquerda = OD, direita = OS; cada metade é uma passada de OCR própria."""
+    txt_left = _region_text(fonte, "left")
+    txt_right = _region_text(fonte, "right")
+    if txt_left is None or txt_right is None:
+        return {}, txt_left or "", txt_right or ""
     od = _parse_eye_text(txt_left)
     os_ = _parse_eye_text(txt_right)
     ok = all(v is not None for v in [od["AL"], od["K1"], od["K2"], od["ACD"],
                                      os_["AL"], os_["K1"], os_["K2"], os_["ACD"]])
-    return ({"OD": od, "OS": os_} if ok else {}), txt_left, txt_right, left_pp, right_pp
+    return ({"OD": od, "OS": os_} if ok else {}), txt_left, txt_right
 
-def extrair_biometria_regex_global(paginas, lang: str = "por+eng", preprocess=None, psm="6"):
-    """OCR da página inteira e separa por marcadores OD/OS (O.D./O.S./Right/Left)."""
-    if not paginas:
+def extrair_biometria_regex_global(fonte):
+    """Página inteira, separada por marcadores OD/OS (O.D./O.S./Right/Left)."""
+    full_txt = _region_text(fonte, "full")
+    if full_txt is None:
         return {}, ""
-    img = paginas[0]
-    img_pp = preprocess(img) if preprocess else img
-    full_txt = pytesseract.image_to_string(img_pp, lang=lang, config=f"--psm {psm}")
     T = _normalize(full_txt)
 
     # Quebra bruto em trechos próximos de OD/OS
@@ -170,15 +295,65 @@ def extrair_biometria_regex_global(paginas, lang: str = "por+eng", preprocess=No
                                      os_["AL"], os_["K1"], os_["K2"], os_["ACD"]])
     return ({"OD": od, "OS": os_} if ok else {}), full_txt
 
+def extrair_biometria(fonte, modo: str) -> tuple:
+    """Modo escolhido com o outro como alternativa. Retorna (dados, txt_esq, txt_dir, txt_total)."""
+    txt_left = txt_right = full_txt = ""
+    if modo.startswith("Metades"):
+        dados, txt_left, txt_right = extrair_biometria_dupla_por_metades(fonte)
+        if not dados:
+            dados, full_txt = extrair_biometria_regex_global(fonte)
+    else:
+        dados, full_txt = extrair_biometria_regex_global(fonte)
+        if not dados:
+            dados, txt_left, txt_right = extrair_biometria_dupla_por_metades(fonte)
+    return dados, txt_left, txt_right, full_txt
+
 # =========================
 # Sidebar: diagnóstico e parâmetros
 # =========================
+def _rss_mb(campo: str = "VmRSS"):
+    """RSS atual (VmRSS) em MB, via /proc (Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            for ln in f:
+                if ln.startswith(campo + ":"):
+                    return int(ln.split()[1]) / 1024
+    except Exception:
+        pass
+    return None
+
+def _amostrar_rss(intervalo_s: float = 0.05, max_s: float = 600.0):
+    """Amostra o RSS numa thread a partir de agora; a função devolvida encerra a amostragem e
+       retorna o pico (MB) dessa janela. O VmHWM não serve: é o pico da vida inteira do processo.
+       A thread se encerra sozinha após `max_s` (se a execução for interrompida antes de parar)."""
+    inicio = _rss_mb()
+    if inicio is None:
+        return lambda: None
+    box = {"pico": inicio}
+    fim = threading.Event()
+    limite = time.monotonic() + max_s
+
+    def amostra():
+        while not fim.wait(intervalo_s) and time.monotonic() < limite:
+            atual = _rss_mb()
+            if atual and atual > box["pico"]:
+                box["pico"] = atual
+    th = threading.Thread(target=amostra, daemon=True, name="barret-rss")
+    th.start()
+
+    def parar():
+        fim.set()
+        th.join()
+        return max(box["pico"], _rss_mb() or 0.0)
+    return parar
+
 def _env_diag():
     try:
         pdftoppm = shutil.which("pdftoppm")
         tesseract_bin = shutil.which("tesseract")
         st.sidebar.markdown("### Diagnóstico do ambiente")
         st.sidebar.write(f"pdftoppm: {'OK' if pdftoppm else 'NÃO ENCONTRADO'}")
+        st.sidebar.write(f"pdfium (pypdfium2): {'OK' if pdfium is not None else 'não instalado (usa pdftoppm)'}")
         st.sidebar.write(f"tesseract: {'OK' if tesseract_bin else 'NÃO ENCONTRADO'}")
         st.sidebar.caption("Se aparecer 'NÃO ENCONTRADO', inclua em packages.txt: `poppler-utils` e `tesseract-ocr`.")
     except Exception:
@@ -195,12 +370,39 @@ layout_mode = st.sidebar.radio("Modo de extração", ["Metades (OD esquerda / OS
 
 def preprocess_for_ocr(img: Image.Image) -> Image.Image:
     if not use_grayscale:
-        return img.convert("RGB")
-    im = img.convert("L")
+        return img if img.mode == "RGB" else img.convert("RGB")
+    im = img if img.mode == "L" else img.convert("L")
     im = ImageOps.autocontrast(im, cutoff=2)
     im = im.filter(ImageFilter.UnsharpMask(radius=1.4, percent=150, threshold=3))
     return im
 
+_PDFIUM_LOCK = threading.Lock()   # pdfium não é thread-safe (sessões rodam em threads)
+
+def render_first_page(pdf_bytes: bytes, dpi: int, grayscale: bool) -> list:
+    """1ª página direto em memória pelo pdfium; sem ele (ou se recusar o PDF), pdftoppm via pdf2image."""
+    if pdfium is not None:
+        try:
+            with _PDFIUM_LOCK:
+                doc = pdfium.PdfDocument(pdf_bytes)
+                try:
+                    page = doc[0]
+                    img = page.render(scale=dpi / 72, grayscale=grayscale).to_pil()
+                    page.close()
+                finally:
+                    doc.close()
+            return [img if grayscale or img.mode == "RGB" else img.convert("RGB")]
+        except Exception:
+            pass
+    # fmt='png' evita algumas falhas de renderização em PPM
+    return convert_from_bytes(
+        pdf_bytes,
+        dpi=dpi,
+        first_page=1,
+        last_page=1,
+        fmt="png",
+        grayscale=grayscale,   # 8 bits por pixel em vez de RGB quando o OCR usa tons de cinza
+    )
+
 # =========================
 # Upload do PDF
 # =========================
@@ -211,10 +413,8 @@ if "pdf_bytes" not in st.session_state:
     st.session_state.pdf_bytes = None
 if "pdf_name" not in st.session_state:
     st.session_state.pdf_name = None
-
-texto_topo = ""
-paginas = []
-img_preview = None
+if "pdf_sha" not in st.session_state:
+    st.session_state.pdf_sha = None
 
 if arquivo is not None:
     st.caption(f"📄 Arquivo: **{arquivo.name}** | MIME: `{arquivo.type}` | Tamanho: {arquivo.size/1_048_576:.2f} MB")
@@ -224,97 +424,108 @@ if arquivo is not None:
     if arquivo.size > MAX_MB * 1024 * 1024:
         st.error(f"PDF maior que {MAX_MB} MB. Envie um arquivo menor.")
         st.stop()
-    try:
-        pdf_bytes = arquivo.getvalue()
-        if not pdf_bytes:
-            st.error("Não consegui ler os bytes do PDF (arquivo vazio?).")
+    # lê e hasheia só quando chega um arquivo novo: reruns (qualquer widget) reaproveitam bytes e hash da sessão
+    file_id = getattr(arquivo, "file_id", None) or f"{arquivo.name}:{arquivo.size}"
+    if file_id != st.session_state.get("pdf_file_id"):
+        try:
+            pdf_bytes = arquivo.getvalue()
+            if not pdf_bytes:
+                st.error("Não consegui ler os bytes do PDF (arquivo vazio?).")
+                st.stop()
+            st.session_state.pdf_bytes = pdf_bytes
+            st.session_state.pdf_name = arquivo.name
+            st.session_state.pdf_sha = hashlib.sha256(pdf_bytes).hexdigest()[:16]
+            st.session_state.pdf_file_id = file_id
+        except Exception as e:
+            st.error("Falha ao carregar bytes do PDF.")
+            st.code(''.join(traceback.format_exception(None, e, e.__traceback__)))
             st.stop()
-        st.session_state.pdf_bytes = pdf_bytes
-        st.session_state.pdf_name = arquivo.name
-    except Exception as e:
-        st.error("Falha ao carregar bytes do PDF.")
-        st.code(''.join(traceback.format_exception(None, e, e.__traceback__)))
-        st.stop()
 
-# Converte só a 1ª página e força RGB/PNG
-if st.session_state.pdf_bytes:
+# =========================
+# Renderização + OCR & Extrações
+# =========================
+def _extrair_documento() -> dict:
+    """Renderiza a 1ª página (pdfium em memória ou pdftoppm) e faz o OCR por região.
+       Só a prévia, os textos e a biometria saem daqui; a página em tamanho cheio é descartada."""
+    res = {"erros": [], "preview": None, "dados": {}, "texto_topo": "", "txt_left": "", "txt_right": "",
+           "full_txt": "", "passadas": {}, "left_pp": None, "right_pp": None, "tem_pagina": False}
+    # pico de memória só da janela renderização + OCR deste documento
+    res["rss_inicio"] = _rss_mb()
+    parar_rss = _amostrar_rss()
     try:
-        # fmt='png' evita algumas falhas de renderização em PPM
-        paginas = convert_from_bytes(
-            st.session_state.pdf_bytes,
-            dpi=int(dpi),
-            first_page=1,
-            last_page=1,
-            fmt="png"
-        )
+        paginas = render_first_page(st.session_state.pdf_bytes, int(dpi), use_grayscale)
     except Exception as e:
-        st.error("Erro ao converter PDF em imagem (precisa de 'poppler-utils').")
-        st.code(''.join(traceback.format_exception(None, e, e.__traceback__)))
+        res["erros"].append(("error", "Erro ao converter PDF em imagem (precisa de 'poppler-utils').", e))
         paginas = []
 
     if paginas:
         try:
-            base = paginas[0].convert("RGB")
-            img_preview = base.copy()
-            img_preview.thumbnail((1100, 1100))
+            # reamostra direto para a prévia (sem cópia da página em tamanho cheio)
+            res["preview"] = ImageOps.contain(paginas[0], (1100, 1100), method=Image.BOX)
         except Exception as e:
-            img_preview = None
-            st.warning("Falha ao preparar a prévia da imagem.")
-            st.code(''.join(traceback.format_exception(None, e, e.__traceback__)))
+            res["erros"].append(("warning", "Falha ao preparar a prévia da imagem.", e))
 
-# =========================
-# OCR & Extrações
-# =========================
-dados = {}
-txt_left = txt_right = full_txt = ""
-left_pp = right_pp = None
+        # passadas por região sob demanda: o que já foi lido (nesta ou noutra execução) vem do acervo
+        ocr_params = {"lang": "por+eng", "psm": psm, "dpi": int(dpi), "grayscale": use_grayscale}
+        ocr_passes = {}
+        ocr_erro = []
 
-if paginas:
-    # Header para nome do paciente (usa página sem cortes)
-    try:
-        texto_topo = ocr_top_header_get_text(preprocess_for_ocr(paginas[0]), top_ratio=0.22, lang="por+eng")
-    except Exception:
-        texto_topo = ""
+        def fonte_ocr(region: str):
+            if region not in ocr_passes:
+                try:
+                    ocr_passes[region] = ocr_region(
+                        paginas[0], region, f"{st.session_state.pdf_sha}_p1", ocr_params, preprocess=preprocess_for_ocr,
+                        meta={"doc": st.session_state.pdf_name, "page": 1},
+                    )
+                except Exception as e:
+                    ocr_passes[region] = None
+                    ocr_erro.append(e)
+            return ocr_passes[region]
+
+        res["texto_topo"] = ocr_top_header_get_text(fonte_ocr)
+        res["dados"], res["txt_left"], res["txt_right"], res["full_txt"] = extrair_biometria(fonte_ocr, layout_mode)
+        if ocr_erro:
+            res["erros"].append(("error", "Erro no OCR (precisa de 'tesseract-ocr').", ocr_erro[0]))
+        res["passadas"] = {r: (len(rec["words"]), rec["cached"]) for r, rec in ocr_passes.items() if rec}
+        if show_debug:
+            # mesmos recortes pré-processados que o OCR das metades usa (refeitos só para visualização)
+            w, h = paginas[0].size
+            res["left_pp"] = preprocess_for_ocr(paginas[0].crop((0, 0, w // 2, h)))
+            res["right_pp"] = preprocess_for_ocr(paginas[0].crop((w // 2, 0, w, h)))
+
+    res["tem_pagina"] = bool(paginas)
+    paginas = []
+    res["rss_pico"] = parar_rss()
+    return res
+
+def extracao_para(chave: tuple) -> dict:
+    """Resultado da extração guardado na sessão por documento + DPI/tons de cinza/PSM/modo/debug:
+       reruns causados pelo formulário não renderizam nem fazem OCR de novo."""
+    cache = st.session_state.get("extracao")
+    if cache and cache["chave"] == chave:
+        return cache
+    cache = {"chave": chave, **_extrair_documento()}
+    st.session_state.extracao = cache
+    return cache
+
+ext = {}
+if st.session_state.pdf_bytes:
+    ext = extracao_para((st.session_state.pdf_sha, int(dpi), use_grayscale, psm, layout_mode, show_debug))
+    for nivel, msg, e in ext["erros"]:
+        (st.error if nivel == "error" else st.warning)(msg)
+        st.code(''.join(traceback.format_exception(None, e, e.__traceback__)))
 
-    # Modo 1: metades
-    if layout_mode.startswith("Metades"):
-        dados, txt_left, txt_right, left_pp, right_pp = extrair_biometria_dupla_por_metades(
-            paginas, lang="por+eng", preprocess=preprocess_for_ocr, psm=psm
-        )
-        # Fallback automático para modo global se falhar algo
-        if not dados:
-            dados, full_txt = extrair_biometria_regex_global(
-                paginas, lang="por+eng", preprocess=preprocess_for_ocr, psm=psm
-            )
-    # Modo 2: global direto
-    else:
-        dados, full_txt = extrair_biometria_regex_global(
-            paginas, lang="por+eng", preprocess=preprocess_for_ocr, psm=psm
-        )
-        # Fallback para metades
-        if not dados:
-            dados, txt_left, txt_right, left_pp, right_pp = extrair_biometria_dupla_por_metades(
-                paginas, lang="por+eng", preprocess=preprocess_for_ocr, psm=psm
-            )
+img_preview = ext.get("preview")
+dados = ext.get("dados") or {}
+texto_topo = ext.get("texto_topo", "")
+txt_left, txt_right, full_txt = ext.get("txt_left", ""), ext.get("txt_right", ""), ext.get("full_txt", "")
+left_pp, right_pp = ext.get("left_pp"), ext.get("right_pp")
+tem_pagina = ext.get("tem_pagina", False)
+rss_inicio, rss_pico = ext.get("rss_inicio"), ext.get("rss_pico")
 
 patient_detected = ""
 if texto_topo:
     try:
-        def extrair_patient_name_do_header(texto_header: str):
-            blacklist = [
-                "report date","biometria","cálculo iol","page","id:","dob:","gender:",
-                "r. ","av. ","rua ","tel","cep","http","www","e-mail","email",
-                "printing images","admin/","instituto","hospital"
-            ]
-            linhas = [ln.strip() for ln in texto_header.splitlines() if ln.strip()]
-            for ln in linhas:
-                low = ln.lower()
-                if any(b in low for b in blacklist):
-                    continue
-                candidato = re.sub(r"[^A-Za-zÀ-ÖØ-öø-ÿ' \-\.]", "", ln).strip()
-                if len(candidato.split()) >= 2 and 2 <= len(candidato) <= 80:
-                    return candidato
-            return ""
         patient_detected = extrair_patient_name_do_header(texto_topo)
     except Exception:
         patient_detected = ""
@@ -322,10 +533,20 @@ if texto_topo:
 st.divider()
 
 # Debug opcional
-if show_debug and paginas:
+if show_debug and tem_pagina:
     st.subheader("Debug OCR")
     if img_preview is not None:
         st.text(f"Prévia: {img_preview.size} | mode={img_preview.mode} | DPI={dpi}")
+    if rss_inicio is not None and rss_pico is not None:
+        st.text(f"Memória: RSS no início {rss_inicio:.0f} MB | pico em renderização+OCR {rss_pico:.0f} MB "
+                f"(+{max(0.0, rss_pico - rss_inicio):.0f} MB)")
+    for region, (n_palavras, cached) in ext["passadas"].items():
+        st.text(f"OCR {region}: {n_palavras} palavras | "
+                f"{'reaproveitado do acervo (sem Tesseract)' if cached else 'novo, guardado no acervo'}")
+    if left_pp is not None and right_pp is not None:
+        c_l, c_r = st.columns(2)
+        c_l.image(left_pp, caption="Metade esquerda pré-processada (OD)", use_column_width=True)
+        c_r.image(right_pp, caption="Metade direita pré-processada (OS)", use_column_width=True)
     if txt_left:
         st.text_area("OCR (metade esquerda / OD)", txt_left, height=150)
     if txt_right:
@@ -333,6 +554,54 @@ if show_debug and paginas:
     if full_txt:
         st.text_area("OCR (página inteira)", full_txt, height=200)
 
+# Acervo de OCR: reaplica o modo de extração/regras atuais a todas as páginas já lidas, sem Tesseract
+def reprocessar_acervo(modo: str) -> list:
+    # agrupa as passadas (cabeçalho/metades/página inteira) de cada página + parâmetros de OCR
+    grupos = {}
+    for fn in sorted(os.listdir(OCR_STORE_DIR)) if os.path.isdir(OCR_STORE_DIR) else []:
+        if not fn.endswith(".json.gz"):
+            continue
+        fp = os.path.join(OCR_STORE_DIR, fn)
+        try:
+            rec = _load_ocr_record_cached(fp, os.path.getsize(fp))
+        except (OSError, ValueError):
+            continue
+        base = {k: v for k, v in rec["params"].items() if k != "region"}
+        chave = (rec["page_key"], json.dumps(base, sort_keys=True))
+        grupos.setdefault(chave, {})[rec["params"]["region"]] = rec
+    linhas = []
+    for passadas in grupos.values():
+        rec = next(iter(passadas.values()))
+        try:
+            dados_rec = extrair_biometria(passadas.get, modo)[0]
+            paciente = extrair_patient_name_do_header(ocr_top_header_get_text(passadas.get))
+        except Exception:
+            continue
+        linha = {"documento": rec.get("doc") or rec["page_key"], "PSM": rec["params"]["psm"],
+                 "DPI": rec["params"]["dpi"], "passadas": ", ".join(sorted(passadas)),
+                 "paciente": paciente, "extraído": bool(dados_rec)}
+        for olho in ("OD", "OS"):
+            for campo in ("AL", "K1", "K2", "ACD"):
+                linha[f"{olho} {campo}"] = dados_rec.get(olho, {}).get(campo)
+        linhas.append(linha)
+    return linhas
+
+with st.expander("Acervo de OCR (reprocessar sem OCR)"):
+    st.caption(f"Palavras do OCR guardadas em `{OCR_STORE_DIR}`. Reaplica o modo de extração "
+               f"selecionado na barra lateral (\"{layout_mode}\") a todas as páginas já lidas; "
+               f"páginas sem a passada que o modo precisa (metades ou página inteira) ficam sem extração.")
+    if OCR_STORE_DAYS <= 0:
+        st.info("Acervo desativado (BARRETT_OCR_STORE_DAYS=0): as palavras do OCR ficam só na sessão.")
+    else:
+        st.caption(f"Retenção: {OCR_STORE_DAYS:g} dias, até {OCR_STORE_MAX_MB:g} MB (menos usados saem primeiro).")
+    if OCR_STORE_DAYS > 0 and st.button("Reprocessar acervo"):
+        acervo = reprocessar_acervo(layout_mode)
+        if acervo:
+            st.write(f"{sum(r['extraído'] for r in acervo)}/{len(acervo)} páginas com biometria completa.")
+            st.dataframe(acervo, use_container_width=True)
+        else:
+            st.info("Nenhuma página no acervo ainda.")
+
 # =============== Estado global (para auto-execução) ===============
 if "selected_iol" not in st.session_state:
     st.session_state.selected_iol = "— selecionar —"
@@ -365,6 +634,89 @@ def on_lf_input_change():
         st.session_state.selected_iol = st.session_state.selected_iol or "— selecionar —"
         st.session_state.auto_run = True
 
+def _fragment_only_run() -> bool:
+    # o Streamlit marca a execução que roda só fragmentos (fragment_ids_this_run)
+    ctx = get_script_run_ctx()
+    return bool(ctx and ctx.fragment_ids_this_run)
+
+# =========================
+# Fragmentos: cada bloco reexecuta sozinho quando seus widgets mudam
+# (dependências só via session_state: bio_vals, doctor_name_val, patient_name_val, const_tipo_radio, auto_run)
+# =========================
+@st.fragment
+def form_biometria(dados: dict, patient_detected: str):
+    st.subheader("Verifique e edite os dados")
+    vals = {"OD": {}, "OS": {}}
+    c1, c2 = st.columns(2)
+    for col, eye, titulo in ((c1, "OD", "OD (Right)"), (c2, "OS", "OS (Left)")):
+        with col:
+            st.markdown(titulo)
+            for k, unidade in (("AL", "mm"), ("K1", "D"), ("K2", "D"), ("ACD", "mm")):
+                vals[eye][k] = st.number_input(f"{k} ({eye}, {unidade})", value=float(dados[eye][k]), format="%.2f")
+    st.session_state.bio_vals = vals
+
+    st.subheader("Identificação")
+    colid1, colid2 = st.columns(2)
+    with colid1:
+        st.session_state.doctor_name_val = st.text_input("Doctor Name", value="Luis")
+    with colid2:
+        st.session_state.patient_name_val = st.text_input("Patient Name (obrigatório)", value=patient_detected or "AutoFill")
+
+@st.fragment
+def painel_constante():
+    st.subheader("Constante da Lente")
+    const_tipo = st.radio(
+        "Escolha como quer preencher",
+        ["Lens Factor", "A-constant"],
+        index=1,
+        horizontal=True,
+        key="const_tipo_radio",
+    )
+
+    labels = [p["label"] for p in IOL_PRESETS]
+    st.selectbox(
+        "Modelo de LIO (opcional)",
+        labels,
+        index=labels.index(st.session_state.selected_iol) if st.session_state.selected_iol in labels else 0,
+        help="Se escolher um modelo, aplico a constante correspondente e executo a calculadora.",
+        key="selected_iol",
+        on_change=on_iol_change,
+    )
+
+    if const_tipo == "Lens Factor":
+        st.text_input(
+            "Lens Factor (ex.: 2.00; -2.0 a 5.0)",
+            value=st.session_state.lens_factor_val,
+            key="lf_input",
+            on_change=on_lf_input_change,
+        )
+        st.text_input(
+            "A-constant (ex.: 119.0; 112 a 124.7)",
+            value=st.session_state.a_constant_val,
+            key="ac_input_disabled",
+            disabled=True
+        )
+    else:
+        st.text_input(
+            "A-constant (ex.: 119.0; 112 a 124.7)",
+            value=st.session_state.a_constant_val,
+            key="ac_input",
+            on_change=on_ac_input_change,
+        )
+        st.text_input(
+            "Lens Factor (ex.: 2.00; -2.0 a 5.0)",
+            value=st.session_state.lens_factor_val,
+            key="lf_input_disabled",
+            disabled=True
+        )
+
+    st.markdown("[Abrir calculadora Barrett](https://calc.apacrs.org/barrett_universal2105/)", unsafe_allow_html=True)
+
+    # A calculadora roda no fluxo principal (usa navegador/headless da seção Execução):
+    # se esta foi uma reexecução só do fragmento, pede uma execução completa.
+    if st.session_state.get("auto_run") and _fragment_only_run():
+        st.rerun()
+
 # =========================
 # UI principal
 # =========================
@@ -376,7 +728,7 @@ else:
     with col_preview:
         if img_preview is not None:
             try:
-                st.image(img_preview, caption="Prévia da 1ª página do PDF", use_container_width=True)
+                st.image(img_preview, caption="Prévia da 1ª página do PDF", use_column_width=True)
             except Exception as e:
                 st.warning("Não consegui renderizar a prévia da imagem.")
                 st.code(''.join(traceback.format_exception(None, e, e.__traceback__)))
@@ -388,76 +740,8 @@ else:
             st.warning("Não consegui extrair automaticamente. Ajuste o DPI/PSM ou troque o modo de extração (barra lateral).")
             dados = {"OD": {"AL": 23.50, "K1": 43.50, "K2": 44.00, "ACD": 3.20},
                      "OS": {"AL": 23.60, "K1": 43.80, "K2": 44.05, "ACD": 3.30}}
-
-        st.subheader("Verifique e edite os dados")
-        c1, c2 = st.columns(2)
-        with c1:
-            st.markdown("OD (Right)")
-            al_od = st.number_input("AL (OD, mm)", value=float(dados["OD"]["AL"]), format="%.2f")
-            k1_od = st.number_input("K1 (OD, D)", value=float(dados["OD"]["K1"]), format="%.2f")
-            k2_od = st.number_input("K2 (OD, D)", value=float(dados["OD"]["K2"]), format="%.2f")
-            acd_od = st.number_input("ACD (OD, mm)", value=float(dados["OD"]["ACD"]), format="%.2f")
-        with c2:
-            st.markdown("OS (Left)")
-            al_os = st.number_input("AL (OS, mm)", value=float(dados["OS"]["AL"]), format="%.2f")
-            k1_os = st.number_input("K1 (OS, D)", value=float(dados["OS"]["K1"]), format="%.2f")
-            k2_os = st.number_input("K2 (OS, D)", value=float(dados["OS"]["K2"]), format="%.2f")
-            acd_os = st.number_input("ACD (OS, mm)", value=float(dados["OS"]["ACD"]), format="%.2f")
-
-        st.subheader("Identificação")
-        colid1, colid2 = st.columns(2)
-        with colid1:
-            doctor_name = st.text_input("Doctor Name", value="Luis")
-        with colid2:
-            patient_name = st.text_input("Patient Name (obrigatório)", value=patient_detected or "AutoFill")
-
-        st.subheader("Constante da Lente")
-        const_tipo = st.radio(
-            "Escolha como quer preencher",
-            ["Lens Factor", "A-constant"],
-            index=1,
-            horizontal=True,
-            key="const_tipo_radio",
-        )
-
-        labels = [p["label"] for p in IOL_PRESETS]
-        st.selectbox(
-            "Modelo de LIO (opcional)",
-            labels,
-            index=labels.index(st.session_state.selected_iol) if st.session_state.selected_iol in labels else 0,
-            help="Se escolher um modelo, aplico a constante correspondente e executo a calculadora.",
-            key="selected_iol",
-            on_change=on_iol_change,
-        )
-
-        if const_tipo == "Lens Factor":
-            lens_factor = st.text_input(
-                "Lens Factor (ex.: 2.00; -2.0 a 5.0)",
-                value=st.session_state.lens_factor_val,
-                key="lf_input",
-                on_change=on_lf_input_change,
-            )
-            a_constant = st.text_input(
-                "A-constant (ex.: 119.0; 112 a 124.7)",
-                value=st.session_state.a_constant_val,
-                key="ac_input_disabled",
-                disabled=True
-            )
-        else:
-            a_constant = st.text_input(
-                "A-constant (ex.: 119.0; 112 a 124.7)",
-                value=st.session_state.a_constant_val,
-                key="ac_input",
-                on_change=on_ac_input_change,
-            )
-            lens_factor = st.text_input(
-                "Lens Factor (ex.: 2.00; -2.0 a 5.0)",
-                value=st.session_state.lens_factor_val,
-                key="lf_input_disabled",
-                disabled=True
-            )
-
-        st.markdown("[Abrir calculadora Barrett](https://calc.apacrs.org/barrett_universal2105/)", unsafe_allow_html=True)
+        form_biometria(dados, patient_detected)
+        painel_constante()
 
 st.divider()
 
@@ -519,6 +803,10 @@ def build_chrome(headless_flag: bool):
         os.environ["PATH"] = old_path
 
 def run_selenium_and_fetch(preferred: str):
+    bio = st.session_state.get("bio_vals")
+    if not bio:
+        raise RuntimeError("Sem dados de biometria: faça o upload do PDF.")
+    const_tipo = st.session_state.get("const_tipo_radio", "A-constant")
     last_error = None
     order = [preferred] + (["Firefox", "Chrome"] if preferred == "Chrome" else ["Chrome"])
     for choice in order:
@@ -538,16 +826,16 @@ def run_selenium_and_fetch(preferred: str):
             fill_by_id("MainContent_PatientName", st.session_state.get("patient_name_val", "AutoFill"))
 
             # OD
-            fill_by_id("MainContent_Axlength", al_od)
-            fill_by_id("MainContent_MeasuredK1", k1_od)
-            fill_by_id("MainContent_MeasuredK2", k2_od)
-            fill_by_id("MainContent_OpticalACD", acd_od)
+            fill_by_id("MainContent_Axlength", bio["OD"]["AL"])
+            fill_by_id("MainContent_MeasuredK1", bio["OD"]["K1"])
+            fill_by_id("MainContent_MeasuredK2", bio["OD"]["K2"])
+            fill_by_id("MainContent_OpticalACD", bio["OD"]["ACD"])
 
             # OS
-            fill_by_id("MainContent_Axlength0", al_os)
-            fill_by_id("MainContent_MeasuredK10", k1_os)
-            fill_by_id("MainContent_MeasuredK20", k2_os)
-            fill_by_id("MainContent_OpticalACD0", acd_os)
+            fill_by_id("MainContent_Axlength0", bio["OS"]["AL"])
+            fill_by_id("MainContent_MeasuredK10", bio["OS"]["K1"])
+            fill_by_id("MainContent_MeasuredK20", bio["OS"]["K2"])
+            fill_by_id("MainContent_OpticalACD0", bio["OS"]["ACD"])
 
             # Modelo de LIO (se houver)
             if st.session_state.get("selected_iol") and st.session_state["selected_iol"] != "— selecionar —":
@@ -603,10 +891,6 @@ if st.session_state.get("auto_run"):
             st.error(f"Erro ao executar Selenium: {e}")
             st.code(''.join(traceback.format_exception(None, e, e.__traceback__)))
 
-# Persistir nomes
-st.session_state["doctor_name_val"] = locals().get("doctor_name", st.session_state.get("doctor_name_val", "Luis"))
-st.session_state["patient_name_val"] = locals().get("patient_name", st.session_state.get("patient_name_val", "AutoFill"))
-
 # Botão Recalcular
 if st.button("Recalcular"):
     with st.status("Executando calculadora...", expanded=False):
@@ -619,7 +903,10 @@ if st.button("Recalcular"):
             st.code(''.join(traceback.format_exception(None, e, e.__traceback__)))
 
 # Exibição das tabelas importadas
-if st.session_state.get("tables"):
+@st.fragment
+def mostrar_resultados():
+    if not st.session_state.get("tables"):
+        return
     st.success(f"Tabelas importadas com sucesso (navegador: {st.session_state.get('used_browser')}).")
     colod, colos = st.columns(2)
     with colod:
@@ -634,3 +921,5 @@ if st.session_state.get("tables"):
             st.dataframe(st.session_state.tables["OS"], use_container_width=True)
         else:
             st.info("Sem linhas em OS.")
+
+mostrar_resultados()
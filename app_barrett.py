@@ -1,193 +1,152 @@
 # app_barrett.py
-import re
 import json
 import os
 import io
-import shutil
-import traceback
+import threading
+import time
 import streamlit as st
-from PIL import Image, ImageOps, ImageFilter
-import pytesseract
-from pdf2image import convert_from_bytes
-
-# Selenium
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait, Select
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.firefox.service import Service as FirefoxService
-from selenium.webdriver.chrome.service import Service as ChromeService
+from PIL import Image
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# pipeline sem interface (compartilhado com o modo serviço, barrett_service.py)
+from barrett_core import (
+    CALC_URL, IOL_PLACEHOLDER, STRUCTURED_EXT,
+    CalculatorUnavailable, progress_local,
+    iol_catalog, search_iol, warmup_state,
+    spool_registry, spool_path, spool_put, spool_touch,
+    history_search, history_save_calculation,
+    extract_document, ocr_gate_stats,
+    calc_breaker, calc_cache_get, calc_cache_same_biometry,
+    preferred_browser, startup_summary, live_close, live_info,
+    run_selenium_and_fetch, spec_pool, speculate_likely_lenses, rank_lenses,
+)
 
 # =========================
 # Config & título
 # =========================
 st.set_page_config(page_title="Barrett AutoFill (PDF → OCR → Selenium)", layout="wide")
+_run_t0 = time.perf_counter()
 st.title("Barrett AutoFill: OCR do exame + Preenchimento Automático")
 st.write("1) Faça upload do PDF da biometria. 2) Confira/edite os campos. 3) Ao escolher uma LIO ou alterar a constante, a calculadora roda automaticamente (ou use Recalcular).")
 
-# =========================
-# IOL PRESETS
-# =========================
-IOL_PRESETS = [
-    {"label": "— selecionar —", "a_constant": "", "lens_factor": ""},
-    {"label": "Alcon SN60WF", "a_constant": "118.99", "lens_factor": "1.88"},
-    {"label": "Alcon SN6AD", "a_constant": "119.01", "lens_factor": "1.89"},
-    {"label": "Alcon SN6ATx", "a_constant": "119.26", "lens_factor": "2.02"},
-    {"label": "Alcon SND1Tx", "a_constant": "119.36", "lens_factor": "2.07"},
-    {"label": "Alcon SV25Tx", "a_constant": "119.51", "lens_factor": "2.15"},
-    {"label": "Alcon TFNTx", "a_constant": "119.26", "lens_factor": "2.02"},
-    {"label": "Alcon DFTx", "a_constant": "119.15", "lens_factor": "1.96"},
-    {"label": "Alcon SA60AT", "a_constant": "118.53", "lens_factor": "1.64"},
-    {"label": "Alcon MN60MA", "a_constant": "119.2", "lens_factor": "1.99"},
-    {"label": "Rayner RayOne EMV", "a_constant": "118.29", "lens_factor": "1.51"},
-    {"label": "J&J ZCB00", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J ZCT", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J ZCT(USA)", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J ZCU", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J DIU", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J ZKU", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J ZLU", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J AR40e", "a_constant": "118.71", "lens_factor": "1.73"},
-    {"label": "J&J AR40M", "a_constant": "118.71", "lens_factor": "1.73"},
-    {"label": "J&J ZXR00", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J ZXT", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J ZHR00V", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "J&J ZHW", "a_constant": "119.39", "lens_factor": "2.09"},
-    {"label": "Zeiss 409M", "a_constant": "118.32", "lens_factor": "1.53"},
-    {"label": "Zeiss 709M", "a_constant": "118.5", "lens_factor": "1.62"},
-    {"label": "Hoya iSert 251", "a_constant": "118.48", "lens_factor": "1.61"},
-    {"label": "Hoya iSert 351", "a_constant": "118.48", "lens_factor": "1.61"},
-    {"label": "Bausch & Lomb MX60", "a_constant": "119.15", "lens_factor": "1.96"},
-    {"label": "Bausch & Lomb MX60T", "a_constant": "119.15", "lens_factor": "1.96"},
-    {"label": "Bausch & Lomb MX60ET", "a_constant": "119.15", "lens_factor": "1.96"},
-    {"label": "Bausch & Lomb MX60ET(USA)", "a_constant": "119.15", "lens_factor": "1.96"},
-    {"label": "Bausch & Lomb BL1UT", "a_constant": "119.2", "lens_factor": "1.99"},
-    {"label": "Bausch & Lomb LI60AO", "a_constant": "118.57", "lens_factor": "1.66"},
-    {"label": "MBI T302A", "a_constant": "118.65", "lens_factor": "1.7"},
-    {"label": "Lenstec SBL-3", "a_constant": "117.77", "lens_factor": "1.24"},
-    {"label": "SIFI Mini WELL", "a_constant": "118.74", "lens_factor": "1.75"},
-    {"label": "Ophtec 565", "a_constant": "118.48", "lens_factor": "1.61"},
-]
-PRESET_BY_LABEL = {p["label"]: p for p in IOL_PRESETS}
+# catálogo relido a cada execução só se o arquivo mudou (cache por mtime no barrett_core)
+IOL_CATALOG = iol_catalog()
+IOL_PRESETS = IOL_CATALOG["presets"]
+PRESET_BY_LABEL = IOL_CATALOG["by_label"]
+
+def _env_diag():
+    state = warmup_state()
+    st.sidebar.markdown("### Diagnóstico do ambiente")
+    if not state["ready"]:
+        st.sidebar.write("Aquecendo dependências (OCR/navegadores)...")
+        return
+    for b, path in state["bins"].items():
+        st.sidebar.write(f"{b}: {'OK' if path else 'NÃO ENCONTRADO'}")
+    for name in ["Firefox", "Chrome"]:
+        st.sidebar.write(f"{name}: {'OK' if name in state['drivers'] else 'NÃO ENCONTRADO'}")
+    st.sidebar.caption(f"Aquecimento concluído em {state['elapsed_s']:.1f} s.")
+    if not all(state["bins"].values()):
+        st.sidebar.caption("Se aparecer 'NÃO ENCONTRADO', inclua em packages.txt: `poppler-utils` e `tesseract-ocr`.")
+
+_env_diag()
+
+def _current_session_id() -> str:
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
+
+def _fragment_only_run() -> bool:
+    # o próprio Streamlit marca a execução que roda só fragmentos (fragment_ids_this_run); nada fica
+    # gravado na sessão, então st.stop()/exceção no meio do script não deixa estado velho para trás
+    ctx = get_script_run_ctx()
+    return bool(ctx and ctx.fragment_ids_this_run)
+
+def _status_reporter(status):
+    """Callback que atualiza a caixa de status de qualquer thread (as do barrett_core também):
+       leva junto o contexto desta execução, sem o qual o Streamlit descarta a atualização."""
+    ctx = get_script_run_ctx()
+
+    def report(label: str):
+        if ctx is not None and get_script_run_ctx() is None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        status.update(label=label)
+    return report
 
 # =========================
-# Utilitários OCR
+# Histórico de casos (barra lateral)
 # =========================
-def _to_f(s: str) -> float:
-    return float(str(s).replace(",", ".").strip())
-
-def preprocess_for_ocr(img: Image.Image) -> Image.Image:
-    # super-amostra antes do OCR (ajuda dígitos pequenos/borrados)
-    w, h = img.size
-    img = img.resize((int(w * 1.8), int(h * 1.8)), Image.BICUBIC)
-    # grayscale + contraste + sharpen
-    img = img.convert("L")
-    img = ImageOps.autocontrast(img, cutoff=2)
-    img = img.filter(ImageFilter.UnsharpMask(radius=1.6, percent=180, threshold=2))
-    # binarização suave para destacar números
-    img = img.point(lambda p: 255 if p > 180 else 0)
-    return img
-
-def ocr_text(img: Image.Image, psm: str = "6") -> str:
-    # psm 6 = parágrafos; 11 = linha única (fallback)
-    return pytesseract.image_to_string(img, lang="por+eng", config=f"--psm {psm}")
-
-def ocr_top_header_get_text(img: Image.Image, top_ratio: float = 0.22) -> str:
-    w, h = img.size
-    top_h = int(h * top_ratio)
-    header = img.crop((0, 0, w, top_h))
-    # header usa OCR "texto" (sem binarizar forte) para pegar nome
-    txt = pytesseract.image_to_string(header, lang="por+eng", config="--psm 6")
-    return txt
-
-def extrair_patient_name_do_header(texto_header: str) -> str:
-    blacklist = [
-        "report date","biometria","cálculo iol","page","id:","dob:","gender:",
-        "r. ","av. ","rua ","tel","cep","http","www","e-mail","email",
-        "printing images","admin/","instituto","hospital"
-    ]
-    linhas = [ln.strip() for ln in texto_header.splitlines() if ln.strip()]
-    for ln in linhas:
-        low = ln.lower()
-        if any(b in low for b in blacklist):
-            continue
-        candidato = re.sub(r"[^A-Za-zÀ-ÖØ-öø-ÿ' \-\.]", "", ln).strip()
-        if len(candidato.split()) >= 2 and 2 <= len(candidato) <= 80:
-            return candidato
-    return ""
-
-def _parse_eye_text(txt: str) -> dict:
-    """Extrai estritamente:
-       Comp. AL: <num>
-       MV: <K1> / <K2>
-       ACD: <num>
-    """
-    t = txt.replace(",", ".")
-    # AL
-    m_al = re.search(r"Comp\.?\s*AL\s*[:=]\s*([0-9]+(?:\.[0-9]+)?)", t, re.IGNORECASE)
-    al = _to_f(m_al.group(1)) if m_al else None
-    # MV → K1 / K2
-    m_mv = re.search(r"\bMV\b\s*[:=]\s*([0-9]+(?:\.[0-9]+)?)\s*/\s*([0-9]+(?:\.[0-9]+)?)", t, re.IGNORECASE)
-    k1 = _to_f(m_mv.group(1)) if m_mv else None
-    k2 = _to_f(m_mv.group(2)) if m_mv else None
-    # ACD
-    m_acd = re.search(r"\bACD\b\s*[:=]\s*([0-9]+(?:\.[0-9]+)?)", t, re.IGNORECASE)
-    acd = _to_f(m_acd.group(1)) if m_acd else None
-    return {"AL": al, "K1": k1, "K2": k2, "ACD": acd}
-
-def extrair_biometria_dupla_por_metades(pil_page: Image.Image) -> dict:
-    """Corta a 1ª página em duas metades (esq=OD, dir=OS), pré-processa e faz OCR+parse.
-       Tenta PSM 6; se faltar algo, tenta PSM 11.
-    """
-    w, h = pil_page.size
-    mid = w // 2
-    left = pil_page.crop((0, 0, mid, h))
-    right = pil_page.crop((mid, 0, w, h))
-
-    # 1ª passada (psm 6)
-    ltxt = ocr_text(preprocess_for_ocr(left), psm="6")
-    rtxt = ocr_text(preprocess_for_ocr(right), psm="6")
-    od = _parse_eye_text(ltxt)
-    os_ = _parse_eye_text(rtxt)
-
-    # fallback se faltou algo
-    if not all(v is not None for v in [od["AL"], od["K1"], od["K2"], od["ACD"]]):
-        ltxt2 = ocr_text(preprocess_for_ocr(left), psm="11")
-        od = _parse_eye_text(ltxt2)
-    if not all(v is not None for v in [os_["AL"], os_["K1"], os_["K2"], os_["ACD"]]):
-        rtxt2 = ocr_text(preprocess_for_ocr(right), psm="11")
-        os_ = _parse_eye_text(rtxt2)
-
-    ok = all(v is not None for v in [od["AL"], od["K1"], od["K2"], od["ACD"],
-                                     os_["AL"], os_["K1"], os_["K2"], os_["ACD"]])
-    return {"OD": od, "OS": os_} if ok else {}
+def on_history_restore():
+    case = st.session_state.get("history_pick")
+    if not case:
+        return
+    st.session_state.restored_case = {
+        "id": case["id"],
+        "dados": json.loads(case["biometry"]),
+        "patient": case["patient"] or "",
+    }
+    st.session_state.tables = json.loads(case["tables"])
+    st.session_state.used_browser = f"histórico · {case['created_at']}"
+    st.session_state.selected_iol = case["iol"] or "— selecionar —"
+    st.session_state.const_tipo_radio = case["const_tipo"] or "A-constant"
+    st.session_state.a_constant_val = case["a_constant"] or ""
+    st.session_state.lens_factor_val = case["lens_factor"] or ""
+    st.session_state.auto_run = False
+
+with st.sidebar.expander("Histórico de casos", expanded=False):
+    busca = st.text_input("Paciente", key="history_query", placeholder="Nome (início)")
+    casos = history_search(busca)
+    if casos:
+        st.selectbox(
+            "Cálculos anteriores",
+            casos,
+            format_func=lambda c: f"{c['created_at']} · {c['patient']} · {c['iol'] or 'manual'}",
+            key="history_pick",
+        )
+        st.button("Restaurar caso", on_click=on_history_restore)
+    else:
+        st.caption("Nenhum caso encontrado.")
 
 # =========================
 # Upload do PDF (simples, sem sliders/controles)
 # =========================
 MAX_MB = 80
-arquivo = st.file_uploader("Upload do PDF do exame", type=["pdf"], accept_multiple_files=False)
+arquivo = st.file_uploader(
+    "Upload do exame (PDF ou exportação do biômetro: XML/CSV/DICOM-SR)",
+    type=["pdf", *STRUCTURED_EXT], accept_multiple_files=False,
+)
 
-if "pdf_bytes" not in st.session_state:
-    st.session_state.pdf_bytes = None
+if "pdf_hash" not in st.session_state:
+    st.session_state.pdf_hash = None
 if "pdf_name" not in st.session_state:
     st.session_state.pdf_name = None
+if "restored_case" not in st.session_state:
+    st.session_state.restored_case = None
+if "doc_kind" not in st.session_state:
+    st.session_state.doc_kind = "pdf"
 
 if arquivo is not None:
     st.caption(f"📄 Arquivo: **{arquivo.name}** · {arquivo.size/1_048_576:.2f} MB")
-    if arquivo.type not in {"application/pdf", "application/x-pdf", "application/acrobat"}:
+    # roteamento por tipo: exportações estruturadas não passam pelo OCR
+    doc_kind = STRUCTURED_EXT.get(os.path.splitext(arquivo.name)[1].lower().lstrip("."), "pdf")
+    if doc_kind == "pdf" and arquivo.type not in {"application/pdf", "application/x-pdf", "application/acrobat"}:
         st.error("O arquivo não parece ser um PDF válido.")
         st.stop()
     if arquivo.size > MAX_MB * 1024 * 1024:
         st.error(f"PDF maior que {MAX_MB} MB. Envie um arquivo menor.")
         st.stop()
     try:
-        pdf_bytes = arquivo.getvalue()
-        if not pdf_bytes:
+        if not arquivo.size:
             st.error("Não consegui ler os bytes do PDF (arquivo vazio?).")
             st.stop()
-        st.session_state.pdf_bytes = pdf_bytes
-        st.session_state.pdf_name = arquivo.name
+        # mesmo upload da execução anterior: não re-hasheia/regrava
+        file_id = getattr(arquivo, "file_id", None) or f"{arquivo.name}:{arquivo.size}"
+        if file_id != st.session_state.get("pdf_file_id") or st.session_state.pdf_hash is None:
+            novo_hash = spool_put(arquivo, _current_session_id(), doc_kind)
+            if novo_hash != st.session_state.pdf_hash:
+                st.session_state.restored_case = None
+            st.session_state.pdf_hash = novo_hash
+            st.session_state.pdf_name = arquivo.name
+            st.session_state.pdf_file_id = file_id
+            st.session_state.doc_kind = doc_kind
     except Exception as e:
         st.error("Falha ao carregar bytes do PDF.")
         with st.expander("Detalhes técnicos (upload)"):
@@ -197,66 +156,241 @@ if arquivo is not None:
 # =========================
 # Renderização + OCR com fallbacks silenciosos
 # =========================
-pag_img = None
 dados = {}
 patient_detected = ""
 
-def try_render_and_extract(pdf_bytes: bytes):
-    """Tenta (p1@400) → (p2@400) → (p1@480). Retorna (pil_image, dados_dict, patient_name)."""
-    # tentativa 1: página 1 @400 dpi
-    for (first, last, dpi) in [(1,1,400), (2,2,400), (1,1,480)]:
-        try:
-            pages = convert_from_bytes(pdf_bytes, dpi=dpi, first_page=first, last_page=last, fmt="png")
-        except Exception as e:
-            continue
-        if not pages:
-            continue
-        page = pages[0].convert("RGB")
-        # extrai nome (topo) a partir da página sem binarização forte
-        try:
-            header_txt = ocr_top_header_get_text(page, top_ratio=0.22)
-            name_guess = extrair_patient_name_do_header(header_txt) if header_txt else ""
-        except Exception:
-            name_guess = ""
-        # extrai OD/OS por metades
-        try:
-            got = extrair_biometria_dupla_por_metades(page)
-        except Exception:
-            got = {}
-        if got:
-            return page, got, name_guess
-        # se não conseguiu, continua para próximo fallback
-    # nenhuma extração
-    try:
-        # ao menos devolve p1@400 para prévia
-        pages = convert_from_bytes(pdf_bytes, dpi=400, first_page=1, last_page=1, fmt="png")
-        page = pages[0].convert("RGB") if pages else None
-    except Exception:
-        page = None
-    return page, {}, ""
+PREVIEW_PX = 1100
+
+def _preview_jpeg(page: Image.Image) -> bytes:
+    prev = page.copy()
+    prev.thumbnail((PREVIEW_PX, PREVIEW_PX))
+    buf = io.BytesIO()
+    prev.convert("RGB").save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+def extraction_for(doc_hash: str, kind: str = "pdf") -> dict:
+    """Resultado da extração por documento, guardado na sessão: reruns não renderizam nem fazem OCR."""
+    cache = st.session_state.get("extraction")
+    if cache and cache["hash"] == doc_hash:
+        return cache
+    if kind == "pdf":
+        with st.status("Extraindo dados do PDF...", expanded=False) as status:
+            progress_local.report = _status_reporter(status)
+            try:
+                ext = extract_document(doc_hash, kind, st.session_state.pdf_name)
+            finally:
+                progress_local.report = None
+            if ext["from_history"]:
+                status.update(label="Biometria recuperada do histórico (sem OCR)", state="complete")
+            else:
+                status.update(label="Extração concluída", state="complete" if ext["dados"] else "error")
+    else:
+        # exportação estruturada: parse direto (milissegundos), sem OCR
+        ext = extract_document(doc_hash, kind, st.session_state.pdf_name)
+    page = ext.pop("page")
+    cache = {"hash": doc_hash, "preview": _preview_jpeg(page) if page is not None else None, **ext}
+    del page
+    st.session_state.extraction = cache
+    return cache
+
+preview_img = None
+extract_stats = {}
+from_history = False
+structured_records = None
+record_idx = 0
+if st.session_state.pdf_hash and not os.path.exists(spool_path(st.session_state.pdf_hash, st.session_state.doc_kind)):
+    # despejado do spool (sessão ociosa): pede novo upload
+    st.session_state.pdf_hash = None
+if st.session_state.pdf_hash:
+    with spool_registry()["lock"]:
+        spool_touch(st.session_state.pdf_hash, _current_session_id())
+    ext = extraction_for(st.session_state.pdf_hash, st.session_state.doc_kind)
+    preview_img, dados, patient_detected = ext["preview"], ext["dados"], ext["patient"]
+    extract_stats, from_history = ext["stats"], ext["from_history"]
+    structured_records = ext.get("records")
+if st.session_state.restored_case:
+    dados = st.session_state.restored_case["dados"]
+    patient_detected = st.session_state.restored_case["patient"]
+
+# =========================
+# Estado global + callbacks da constante da lente
+# =========================
+if "selected_iol" not in st.session_state:
+    st.session_state.selected_iol = "— selecionar —"
+if "a_constant_val" not in st.session_state:
+    st.session_state.a_constant_val = ""
+if "lens_factor_val" not in st.session_state:
+    st.session_state.lens_factor_val = ""
+if "tables" not in st.session_state:
+    st.session_state.tables = None
+if "used_browser" not in st.session_state:
+    st.session_state.used_browser = None
+if "auto_run" not in st.session_state:
+    st.session_state.auto_run = False
+
+def on_iol_change():
+    preset = PRESET_BY_LABEL.get(st.session_state.selected_iol, {"a_constant": "", "lens_factor": ""})
+    st.session_state.a_constant_val = preset.get("a_constant", "") or ""
+    st.session_state.lens_factor_val = preset.get("lens_factor", "") or ""
+    st.session_state.auto_run = (st.session_state.selected_iol != "— selecionar —")
 
-if st.session_state.pdf_bytes:
-    pag_img, dados, patient_detected = try_render_and_extract(st.session_state.pdf_bytes)
+def on_ac_input_change():
+    st.session_state.a_constant_val = st.session_state.get("ac_input", "").strip()
+    if st.session_state.a_constant_val:
+        st.session_state.selected_iol = st.session_state.selected_iol or "— selecionar —"
+        st.session_state.auto_run = True
+
+def on_lf_input_change():
+    st.session_state.lens_factor_val = st.session_state.get("lf_input", "").strip()
+    if st.session_state.lens_factor_val:
+        st.session_state.selected_iol = st.session_state.selected_iol or "— selecionar —"
+        st.session_state.auto_run = True
+
+# =========================
+# Fragmentos: cada bloco reexecuta sozinho quando seus widgets mudam
+# (dependências só via session_state: bio_vals, doctor_name_val, patient_name_val, auto_run)
+# =========================
+@st.fragment
+def form_biometria(dados: dict, patient_detected: str, tag: str):
+    st.subheader("Verifique e edite os dados")
+    vals = {"OD": {}, "OS": {}}
+    c1, c2 = st.columns(2)
+    for col, eye, titulo in ((c1, "OD", "**OD (Right)**"), (c2, "OS", "**OS (Left)**")):
+        with col:
+            st.markdown(titulo)
+            for k, unidade in (("AL", "mm"), ("K1", "D"), ("K2", "D"), ("ACD", "mm")):
+                # chave inclui o documento: novo PDF/caso restaurado reinicia os campos
+                vals[eye][k] = st.number_input(
+                    f"{k} ({eye}, {unidade})", value=float(dados[eye][k]), format="%.2f", key=f"bio_{tag}_{eye}_{k}"
+                )
+    st.session_state.bio_vals = vals
+
+    st.subheader("Identificação")
+    colid1, colid2 = st.columns(2)
+    with colid1:
+        st.session_state.doctor_name_val = st.text_input("Doctor Name", value="Luis", key=f"doctor_{tag}")
+    with colid2:
+        st.session_state.patient_name_val = st.text_input(
+            "Patient Name (obrigatório)", value=patient_detected or "AutoFill", key=f"patient_{tag}"
+        )
+
+@st.fragment
+def painel_constante():
+    st.subheader("Constante da Lente")
+    const_tipo = st.radio(
+        "Escolha como quer preencher",
+        ["Lens Factor", "A-constant"],
+        index=1,
+        horizontal=True,
+        key="const_tipo_radio",
+    )
+
+    busca_iol = st.text_input(
+        "Buscar LIO (fabricante, modelo ou constante)", key="iol_query", placeholder="ex.: sn60, zcb, 119.39"
+    )
+    if busca_iol.strip():
+        labels = [IOL_PLACEHOLDER["label"]] + search_iol(busca_iol)
+        if st.session_state.selected_iol not in labels:
+            labels.insert(1, st.session_state.selected_iol)
+        label_index = {lab: i for i, lab in enumerate(labels)}
+    else:
+        labels, label_index = IOL_CATALOG["labels"], IOL_CATALOG["label_index"]
+    st.selectbox(
+        "Modelo de LIO (opcional)",
+        labels,
+        index=label_index.get(st.session_state.selected_iol, 0),
+        help="Se escolher um modelo, aplico a constante correspondente e executo a calculadora.",
+        key="selected_iol",
+        on_change=on_iol_change,
+    )
+
+    if const_tipo == "Lens Factor":
+        st.text_input(
+            "Lens Factor (ex.: 2.00; -2.0 a 5.0)",
+            value=st.session_state.lens_factor_val,
+            key="lf_input",
+            on_change=on_lf_input_change,
+        )
+        st.text_input(
+            "A-constant (ex.: 119.0; 112 a 124.7)",
+            value=st.session_state.a_constant_val,
+            key="ac_input_disabled",
+            disabled=True
+        )
+    else:
+        st.text_input(
+            "A-constant (ex.: 119.0; 112 a 124.7)",
+            value=st.session_state.a_constant_val,
+            key="ac_input",
+            on_change=on_ac_input_change,
+        )
+        st.text_input(
+            "Lens Factor (ex.: 2.00; -2.0 a 5.0)",
+            value=st.session_state.lens_factor_val,
+            key="lf_input_disabled",
+            disabled=True
+        )
+
+    st.markdown(f"[Abrir calculadora Barrett]({CALC_URL})", unsafe_allow_html=True)
+
+    # A calculadora roda no fluxo principal (usa navegador/opções da seção Execução):
+    # se esta foi uma reexecução só do fragmento, pede uma execução completa.
+    if st.session_state.get("auto_run") and _fragment_only_run():
+        st.rerun()
 
 # =========================
 # Sessão principal (somente a UI “Verifique e edite os dados”)
 # =========================
 st.divider()
 
-if st.session_state.pdf_bytes is None:
-    st.info("Faça o upload do PDF para extrair os dados.")
+if st.session_state.pdf_hash is None and not st.session_state.restored_case:
+    st.info("Faça o upload do PDF (ou da exportação do biômetro) para extrair os dados (ou restaure um caso do histórico na barra lateral).")
 else:
     col_preview, col_form = st.columns([1, 1.2], gap="large")
 
     with col_preview:
-        if pag_img is not None:
+        if preview_img is not None:
             try:
                 # compatível com versões antigas do Streamlit Cloud:
-                st.image(pag_img, caption="Prévia da 1ª página do PDF", use_column_width=True)
+                st.image(preview_img, caption="Prévia da página de biometria", use_column_width=True)
+                gate = extract_stats.get("gate")
+                if gate:
+                    agg = ocr_gate_stats()
+                    st.caption(
+                        f"Orientação {gate['rotate']}° · inclinação {gate['skew']:+.1f}° ({gate['ms']:.0f} ms) · "
+                        f"{'imagem embutida (nativa)' if extract_stats.get('embedded') else 'rasterizada'} "
+                        f"({extract_stats.get('raster', '?')}, {extract_stats.get('render_ms', 0):.0f} ms) · "
+                        f"tentativas de OCR: {extract_stats['attempts']} · processo: {agg['attempts'] / max(agg['docs'], 1):.1f} "
+                        f"tentativas/doc, {agg['defaults']}/{agg['docs']} sem extração, {agg['corrected']} corrigidos"
+                    )
+                if extract_stats.get("rss_peak_mb"):
+                    st.caption(
+                        f"Memória na extração: pico {extract_stats['rss_peak_mb']:.0f} MB "
+                        f"(+{extract_stats['rss_peak_mb'] - extract_stats['rss_start_mb']:.0f} MB) · "
+                        f"maior pico do processo {ocr_gate_stats()['rss_peak_mb']:.0f} MB"
+                    )
             except Exception as e:
                 st.warning("Não consegui renderizar a prévia da imagem.")
                 with st.expander("Detalhes técnicos (st.image)"):
                     st.exception(e)
+        elif structured_records is not None and not st.session_state.restored_case:
+            st.success(
+                f"Exportação {extract_stats['kind'].upper()} lida sem OCR: {len(structured_records)} paciente(s) "
+                f"em {extract_stats['parse_ms']:.0f} ms."
+            )
+            if extract_stats.get("error"):
+                st.error(f"Falha ao ler o arquivo: {extract_stats['error']}")
+            if len(structured_records) > 1:
+                record_idx = st.selectbox(
+                    "Paciente do arquivo",
+                    range(len(structured_records)),
+                    format_func=lambda i: structured_records[i]["patient"] or f"Registro {i + 1}",
+                    key=f"record_pick_{st.session_state.pdf_hash[:12]}",
+                )
+                dados = structured_records[record_idx]["dados"]
+                patient_detected = structured_records[record_idx]["patient"]
+        elif from_history or st.session_state.restored_case:
+            st.info("Sem prévia: dados recuperados do histórico (sem novo OCR).")
         else:
             st.info("Sem prévia disponível.")
 
@@ -267,108 +401,12 @@ else:
                 "OD": {"AL": 23.50, "K1": 43.50, "K2": 44.00, "ACD": 3.20},
                 "OS": {"AL": 23.60, "K1": 43.80, "K2": 44.05, "ACD": 3.30},
             }
-
-        st.subheader("Verifique e edite os dados")
-        c1, c2 = st.columns(2)
-        with c1:
-            st.markdown("**OD (Right)**")
-            al_od = st.number_input("AL (OD, mm)", value=float(dados["OD"]["AL"]), format="%.2f")
-            k1_od = st.number_input("K1 (OD, D)", value=float(dados["OD"]["K1"]), format="%.2f")
-            k2_od = st.number_input("K2 (OD, D)", value=float(dados["OD"]["K2"]), format="%.2f")
-            acd_od = st.number_input("ACD (OD, mm)", value=float(dados["OD"]["ACD"]), format="%.2f")
-        with c2:
-            st.markdown("**OS (Left)**")
-            al_os = st.number_input("AL (OS, mm)", value=float(dados["OS"]["AL"]), format="%.2f")
-            k1_os = st.number_input("K1 (OS, D)", value=float(dados["OS"]["K1"]), format="%.2f")
-            k2_os = st.number_input("K2 (OS, D)", value=float(dados["OS"]["K2"]), format="%.2f")
-            acd_os = st.number_input("ACD (OS, mm)", value=float(dados["OS"]["ACD"]), format="%.2f")
-
-        st.subheader("Identificação")
-        colid1, colid2 = st.columns(2)
-        with colid1:
-            doctor_name = st.text_input("Doctor Name", value="Luis")
-        with colid2:
-            patient_name = st.text_input("Patient Name (obrigatório)", value=patient_detected or "AutoFill")
-
-        st.subheader("Constante da Lente")
-        # Estado global
-        if "selected_iol" not in st.session_state:
-            st.session_state.selected_iol = "— selecionar —"
-        if "a_constant_val" not in st.session_state:
-            st.session_state.a_constant_val = ""
-        if "lens_factor_val" not in st.session_state:
-            st.session_state.lens_factor_val = ""
-        if "tables" not in st.session_state:
-            st.session_state.tables = None
-        if "used_browser" not in st.session_state:
-            st.session_state.used_browser = None
-        if "auto_run" not in st.session_state:
-            st.session_state.auto_run = False
-
-        def on_iol_change():
-            preset = PRESET_BY_LABEL.get(st.session_state.selected_iol, {"a_constant": "", "lens_factor": ""})
-            st.session_state.a_constant_val = preset.get("a_constant", "") or ""
-            st.session_state.lens_factor_val = preset.get("lens_factor", "") or ""
-            st.session_state.auto_run = (st.session_state.selected_iol != "— selecionar —")
-
-        def on_ac_input_change():
-            st.session_state.a_constant_val = st.session_state.get("ac_input", "").strip()
-            if st.session_state.a_constant_val:
-                st.session_state.selected_iol = st.session_state.selected_iol or "— selecionar —"
-                st.session_state.auto_run = True
-
-        def on_lf_input_change():
-            st.session_state.lens_factor_val = st.session_state.get("lf_input", "").strip()
-            if st.session_state.lens_factor_val:
-                st.session_state.selected_iol = st.session_state.selected_iol or "— selecionar —"
-                st.session_state.auto_run = True
-
-        const_tipo = st.radio(
-            "Escolha como quer preencher",
-            ["Lens Factor", "A-constant"],
-            index=1,
-            horizontal=True,
-            key="const_tipo_radio",
-        )
-
-        labels = [p["label"] for p in IOL_PRESETS]
-        st.selectbox(
-            "Modelo de LIO (opcional)",
-            labels,
-            index=labels.index(st.session_state.selected_iol) if st.session_state.selected_iol in labels else 0,
-            help="Se escolher um modelo, aplico a constante correspondente e executo a calculadora.",
-            key="selected_iol",
-            on_change=on_iol_change,
-        )
-
-        if const_tipo == "Lens Factor":
-            lens_factor = st.text_input(
-                "Lens Factor (ex.: 2.00; -2.0 a 5.0)",
-                value=st.session_state.lens_factor_val,
-                key="lf_input",
-                on_change=on_lf_input_change,
-            )
-            a_constant = st.text_input(
-                "A-constant (ex.: 119.0; 112 a 124.7)",
-                value=st.session_state.a_constant_val,
-                key="ac_input_disabled",
-                disabled=True
-            )
+        if st.session_state.restored_case:
+            form_tag = f"r{st.session_state.restored_case.get('id', '')}"
         else:
-            a_constant = st.text_input(
-                "A-constant (ex.: 119.0; 112 a 124.7)",
-                value=st.session_state.a_constant_val,
-                key="ac_input",
-                on_change=on_ac_input_change,
-            )
-            lens_factor = st.text_input(
-                "Lens Factor (ex.: 2.00; -2.0 a 5.0)",
-                value=st.session_state.lens_factor_val,
-                key="lf_input_disabled",
-                disabled=True
-            )
-
-        st.markdown("[Abrir calculadora Barrett](https://calc.apacrs.org/barrett_universal2105/)", unsafe_allow_html=True)
+            form_tag = (st.session_state.pdf_hash or "manual")[:12] + (f"_{record_idx}" if record_idx else "")
+        form_biometria(dados, patient_detected, form_tag)
+        painel_constante()
 
 # =========================
 # Execução (Selenium)
@@ -376,168 +414,180 @@ else:
 st.divider()
 st.subheader("Execução")
 headless = st.checkbox("Executar em modo headless (sem abrir janela)", value=True)
-nav_choice = st.radio("Navegador", ["Firefox", "Chrome"], index=0, horizontal=True)
-
-def parse_table_rows(table_el):
-    rows = table_el.find_elements(By.TAG_NAME, "tr")
-    out = []
-    for r in rows[1:]:
-        tds = r.find_elements(By.TAG_NAME, "td")
-        if len(tds) >= 3:
-            out.append({
-                "IOL Power": tds[0].text.strip(),
-                "Optic": tds[1].text.strip(),
-                "Refraction": tds[2].text.strip()
-            })
-    return out
-
-def build_firefox(headless_flag: bool):
-    opts = webdriver.FirefoxOptions()
-    if headless_flag:
-        opts.add_argument("-headless")
-    service = FirefoxService()  # Selenium Manager resolve geckodriver
-    return webdriver.Firefox(service=service, options=opts)
-
-def build_chrome(headless_flag: bool):
-    opts = webdriver.ChromeOptions()
-    if headless_flag:
-        opts.add_argument("--headless=new")
-    opts.add_argument("--disable-gpu")
-    opts.add_argument("--no-sandbox")
-    opts.add_argument("--disable-dev-shm-usage")
-    opts.add_argument("--window-size=1280,1000")
-    opts.add_argument("--disable-software-rasterizer")
-    opts.add_argument("--no-first-run")
-    opts.add_argument("--no-default-browser-check")
-    opts.add_argument("--remote-allow-origins=*")
-    # limpar ENV que aponte para chromedriver antigo
-    for var in ["WEBDRIVER_CHROME_DRIVER", "webdriver.chrome.driver", "CHROMEDRIVER", "CHROMEWEBDRIVER"]:
-        if var in os.environ:
-            del os.environ[var]
-    # filtra PATH para não confundir o Selenium Manager
-    old_path = os.environ.get("PATH", "")
-    parts = old_path.split(os.pathsep)
-    filtered = []
-    for p in parts:
-        try:
-            found = shutil.which("chromedriver", path=p)
-        except Exception:
-            found = None
-        if not found:
-            filtered.append(p)
+lean_profile = st.checkbox(
+    "Perfil enxuto (sem imagens/fontes/sites de terceiros, carregamento 'eager')",
+    value=False,
+    help="Navegador com perfil temporário em memória (tmpfs), sem telemetria/extensões. Reduz tempo de carga e memória.",
+)
+speculative = st.checkbox(
+    "Pré-calcular em segundo plano as LIOs mais usadas",
+    value=False,
+    help="Depois da extração, calcula as lentes mais escolhidas para que apareçam na hora ao selecioná-las.",
+)
+hedge_launch = st.checkbox(
+    "Corrida entre navegadores",
+    value=False,
+    help="Se o navegador escolhido não carregar a calculadora em poucos segundos (ou falhar), o outro é aberto "
+         "em paralelo e vale o primeiro que ficar pronto. Só usa um 2º navegador se houver vaga livre no servidor.",
+)
+live_calc = st.checkbox(
+    "Manter a calculadora aberta nesta sessão (ao vivo)",
+    value=False,
+    help="A página preenchida fica aberta: trocar a LIO, o tipo ou o valor da constante reenvia só o que mudou, "
+         "sem abrir outro navegador. Fecha sozinha após alguns minutos sem uso (ou antes, se outro usuário "
+         "estiver esperando por um navegador).",
+)
+_live = live_info(_current_session_id())
+if not live_calc and _live:
+    live_close(_current_session_id())
+elif _live:
+    st.caption(f"Calculadora ao vivo: {_live['browser']} · {_live['runs']} recálculos incrementais · "
+               f"sem uso há {_live['idle_s']:.0f} s")
+# padrão da sessão: navegador com menor tempo/falha de abertura medido neste servidor
+if "nav_choice" not in st.session_state:
+    st.session_state.nav_choice = preferred_browser()
+nav_choice = st.radio("Navegador", ["Firefox", "Chrome"], horizontal=True, key="nav_choice")
+_startup = {n: s for n, s in startup_summary().items() if s["launches"]}
+if _startup:
+    st.caption(" · ".join(
+        f"{n}: {s['launches']} aberturas, {s['failures']} falhas"
+        + (f", mediana {s['median_s']:.1f}s / p90 {s['p90_s']:.1f}s" if s["median_s"] is not None else "")
+        + (f", {s['hedge_wins']} vitórias na corrida" if s["hedge_wins"] else "")
+        for n, s in _startup.items()
+    ))
+
+def _record_run_metrics(browser: str, page_load_s: float, rss_mb, extract_ms: float = None):
+    """Guarda carga da página/memória por perfil para comparar enxuto × padrão."""
+    perfil = "Enxuto" if lean_profile else "Padrão"
+    st.session_state.last_run_metrics = {
+        "browser": browser, "perfil": perfil, "page_load_s": page_load_s, "rss_mb": rss_mb,
+        "extract_ms": extract_ms,
+    }
+    hist = st.session_state.setdefault("profile_metrics", {})
+    hist.setdefault(perfil, []).append((page_load_s, rss_mb))
+
+def calc_inputs() -> dict:
+    """Retrato das entradas da calculadora (permite rodar fora da thread do script)."""
+    empty = {"AL": None, "K1": None, "K2": None, "ACD": None}
+    bio = st.session_state.get("bio_vals") or {"OD": empty, "OS": empty}
+    return {
+        "doctor": st.session_state.get("doctor_name_val", "Luis"),
+        "patient": st.session_state.get("patient_name_val", "AutoFill"),
+        "OD": dict(bio["OD"]),
+        "OS": dict(bio["OS"]),
+        "iol": st.session_state.get("selected_iol") or IOL_PLACEHOLDER["label"],
+        "const_tipo": st.session_state.get("const_tipo_radio", "A-constant"),
+        "a_constant": (st.session_state.get("a_constant_val") or "").strip(),
+        "lens_factor": (st.session_state.get("lens_factor_val") or "").strip(),
+    }
+
+def _history_record_calc(inputs: dict, tables: dict):
+    history_save_calculation(st.session_state.get("pdf_hash"), inputs, tables)
+
+def executar_calculadora():
+    inputs = calc_inputs()
+    hit = calc_cache_get(inputs)
+    if hit:
+        st.session_state.tables, browser = hit[0], hit[1]
+        st.session_state.used_browser = f"{browser} · cache"
+        _history_record_calc(inputs, hit[0])
+        return
+    pool = spec_pool()
+    with pool["lock"]:
+        pool["real_runs"] += 1
     try:
-        os.environ["PATH"] = os.pathsep.join(filtered)
-        service = ChromeService()
-        return webdriver.Chrome(service=service, options=opts)
-    finally:
-        os.environ["PATH"] = old_path
-
-def run_selenium_and_fetch(preferred: str):
-    last_error = None
-    order = [preferred] + (["Firefox", "Chrome"] if preferred == "Chrome" else ["Chrome"])
-    for choice in order:
-        try:
-            driver = build_firefox(headless) if choice == "Firefox" else build_chrome(headless)
-            wait = WebDriverWait(driver, 30)
-
-            driver.get("https://calc.apacrs.org/barrett_universal2105/")
-
-            def fill_by_id(elem_id, value):
-                el = wait.until(EC.presence_of_element_located((By.ID, elem_id)))
-                el.clear()
-                el.send_keys(str(value))
-
-            # Identificação
-            fill_by_id("MainContent_DoctorName", st.session_state.get("doctor_name_val", "Luis"))
-            fill_by_id("MainContent_PatientName", st.session_state.get("patient_name_val", "AutoFill"))
-
-            # OD
-            fill_by_id("MainContent_Axlength", al_od)
-            fill_by_id("MainContent_MeasuredK1", k1_od)
-            fill_by_id("MainContent_MeasuredK2", k2_od)
-            fill_by_id("MainContent_OpticalACD", acd_od)
-
-            # OS
-            fill_by_id("MainContent_Axlength0", al_os)
-            fill_by_id("MainContent_MeasuredK10", k1_os)
-            fill_by_id("MainContent_MeasuredK20", k2_os)
-            fill_by_id("MainContent_OpticalACD0", acd_os)
-
-            # Modelo de LIO (se houver)
-            if st.session_state.get("selected_iol") and st.session_state["selected_iol"] != "— selecionar —":
-                try:
-                    sel_el = wait.until(EC.presence_of_element_located((By.ID, "MainContent_IOLModel")))
-                    Select(sel_el).select_by_visible_text(st.session_state["selected_iol"])
-                    WebDriverWait(driver, 6).until(EC.staleness_of(sel_el))
-                except Exception:
-                    pass
-
-            # Constantes manuais (sobrescrevem)
-            if st.session_state.get("const_tipo_radio") == "Lens Factor" and st.session_state.get("lens_factor_val", "").strip():
-                fill_by_id("MainContent_LensFactor", st.session_state["lens_factor_val"].strip())
-            if st.session_state.get("const_tipo_radio") == "A-constant" and st.session_state.get("a_constant_val", "").strip():
-                fill_by_id("MainContent_Aconstant", st.session_state["a_constant_val"].strip())
-
-            # Calcular
-            wait.until(EC.element_to_be_clickable((By.ID, "MainContent_Button1"))).click()
-            # Aba Universal Formula
-            driver.execute_script("__doPostBack('ctl00$MainContent$menuTabs','1');")
-
-            # Tabelas
-            wait.until(EC.presence_of_element_located((By.ID, "MainContent_Panel14")))
-            grid_od = driver.find_element(By.ID, "MainContent_GridView1")
-            grid_os = driver.find_element(By.ID, "MainContent_GridView2")
-            table_od = parse_table_rows(grid_od)
-            table_os = parse_table_rows(grid_os)
-
+        with st.status("Executando calculadora...", expanded=False) as status:
+            progress_local.report = _status_reporter(status)
             try:
-                driver.quit()
-            except Exception:
-                pass
-
-            return {"OD": table_od, "OS": table_os}, choice
+                tables, used = run_selenium_and_fetch(
+                    nav_choice, inputs, headless=headless, lean=lean_profile, on_metrics=_record_run_metrics,
+                    hedge=hedge_launch, live_sid=_current_session_id() if live_calc else None,
+                )
+                st.session_state.tables = tables
+                st.session_state.used_browser = used
+                _history_record_calc(inputs, tables)
+            except CalculatorUnavailable as e:
+                status.update(label="Calculadora indisponível", state="error")
+                st.warning(str(e))
+            except Exception as e:
+                st.error("Erro ao executar Selenium.")
+                with st.expander("Detalhes técnicos (Selenium)"):
+                    st.exception(e)
+    finally:
+        progress_local.report = None
+        with pool["lock"]:
+            pool["real_runs"] -= 1
 
-        except Exception as e:
-            last_error = e
-            try:
-                driver.quit()
-            except Exception:
-                pass
-            continue
-    raise last_error or RuntimeError("Falha ao iniciar navegador")
+_br = calc_breaker()
+if _br["state"] != "closed":
+    st.caption(f"⚠️ Calculadora com falhas recentes (circuito {'aberto' if _br['state'] == 'open' else 'em teste'}): {_br['last_error']}")
 
 # --------- Auto-execução após seleção/edição ---------
 if st.session_state.get("auto_run"):
     st.session_state.auto_run = False
-    with st.status("Executando calculadora...", expanded=False):
-        try:
-            tables, used = run_selenium_and_fetch(nav_choice)
-            st.session_state.tables = tables
-            st.session_state.used_browser = used
-        except Exception as e:
-            st.error("Erro ao executar Selenium.")
-            with st.expander("Detalhes técnicos (Selenium)"):
-                st.exception(e)
-
-# Persistir nomes para o Selenium
-st.session_state["doctor_name_val"] = locals().get("doctor_name", st.session_state.get("doctor_name_val", "Luis"))
-st.session_state["patient_name_val"] = locals().get("patient_name", st.session_state.get("patient_name_val", "AutoFill"))
+    executar_calculadora()
 
 # Botão Recalcular manual
 if st.button("Recalcular"):
-    with st.status("Executando calculadora...", expanded=False):
-        try:
-            tables, used = run_selenium_and_fetch(nav_choice)
-            st.session_state.tables = tables
-            st.session_state.used_browser = used
-        except Exception as e:
-            st.error("Erro ao executar Selenium.")
-            with st.expander("Detalhes técnicos (Selenium)"):
-                st.exception(e)
+    executar_calculadora()
+
+# Especulação: só depois que a biometria ficou igual em duas execuções seguidas
+if speculative and dados:
+    base = calc_inputs()
+    bio_key = json.dumps([base["OD"], base["OS"], base["const_tipo"]], sort_keys=True)
+    if st.session_state.get("spec_bio_key") == bio_key:
+        speculate_likely_lenses(nav_choice, base, headless=headless, lean=lean_profile)
+    st.session_state.spec_bio_key = bio_key
+
+# =========================
+# Refração alvo (solver vetorizado em barrett_core.rank_lenses)
+# =========================
+def _result_label(inputs: dict) -> str:
+    const = inputs["lens_factor"] if inputs["const_tipo"] == "Lens Factor" else inputs["a_constant"]
+    iol = inputs["iol"] if inputs["iol"] != IOL_PLACEHOLDER["label"] else "manual"
+    return f"{iol} ({inputs['const_tipo']} {const or '—'})"
 
 # Exibição das tabelas importadas
-if st.session_state.get("tables"):
+@st.fragment
+def mostrar_resultados():
+    if not st.session_state.get("tables"):
+        return
     st.success(f"Tabelas importadas com sucesso (navegador: {st.session_state.get('used_browser')}).")
+    m = st.session_state.get("last_run_metrics")
+    if m:
+        rss_txt = f"{m['rss_mb']:.0f} MB" if m["rss_mb"] is not None else "n/d"
+        resumo = []
+        for perfil, amostras in st.session_state.get("profile_metrics", {}).items():
+            cargas = [a[0] for a in amostras]
+            mems = [a[1] for a in amostras if a[1] is not None]
+            mem_txt = f"{sum(mems)/len(mems):.0f} MB" if mems else "n/d"
+            resumo.append(f"{perfil}: {sum(cargas)/len(cargas):.2f} s / {mem_txt} (n={len(amostras)})")
+        st.caption(
+            f"Perfil {m['perfil']} · carga da página {m['page_load_s']:.2f} s · memória do navegador {rss_txt}"
+            + (f" · leitura das tabelas {m['extract_ms']:.0f} ms" if m.get("extract_ms") is not None else "")
+            + (" · médias → " + " | ".join(resumo) if resumo else "")
+        )
+    st.subheader("Refração alvo")
+    ct1, ct2 = st.columns(2)
+    with ct1:
+        target_od = st.number_input("Alvo OD (D)", value=0.0, step=0.25, format="%.2f", key="target_od")
+    with ct2:
+        target_os = st.number_input("Alvo OS (D)", value=0.0, step=0.25, format="%.2f", key="target_os")
+    atual = calc_inputs()
+    results, labels = [st.session_state.tables], [f"Atual · {_result_label(atual)}"]
+    for inp, tables in calc_cache_same_biometry(atual):
+        if tables is not st.session_state.tables:
+            results.append(tables)
+            labels.append(_result_label(inp))
+    try:
+        ranking = rank_lenses(results, labels, target_od, target_os)
+    except Exception:
+        ranking = []   # falha no ranking não esconde as tabelas
+    if ranking:
+        st.dataframe(ranking, use_container_width=True, hide_index=True)
+        st.caption("Poder = linha da tabela com refração mais próxima do alvo; interpolado = entre as duas linhas que cercam o alvo. "
+                   "Inclui todos os resultados em cache com a mesma biometria.")
+
     colod, colos = st.columns(2)
     with colod:
         st.subheader("Sugestões (OD)")
@@ -551,3 +601,7 @@ if st.session_state.get("tables"):
             st.dataframe(st.session_state.tables["OS"], use_container_width=True)
         else:
             st.info("Sem linhas em OS.")
+
+mostrar_resultados()
+
+st.sidebar.caption(f"Execução completa do script: {(time.perf_counter() - _run_t0) * 1000:.0f} ms")
@@ -0,0 +1,2221 @@
+# barrett_core.py
+# Pipeline sem interface (PDF/exportação → biometria → calculadora Barrett), usado pelo
+# app Streamlit (app_barrett.py) e pelo modo serviço HTTP (barrett_service.py).
+import re
+import csv
+import json
+import os
+import difflib
+import functools
+import hashlib
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as futures_wait
+from itertools import islice
+from urllib.parse import urlparse
+from xml.etree import ElementTree as ET
+import urllib.error
+import urllib.request
+import numpy as np
+from PIL import Image, ImageOps, ImageFilter
+import pytesseract
+from pdf2image import convert_from_path
+try:
+    import pydicom  # opcional: só para exportações DICOM-SR
+except ImportError:
+    pydicom = None
+try:
+    import pypdfium2 as pdfium  # opcional: rasterização no próprio processo (sem pdftoppm/PNG)
+except ImportError:
+    pdfium = None
+
+# Selenium
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait, Select
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.firefox.service import Service as FirefoxService
+from selenium.webdriver.chrome.service import Service as ChromeService
+from selenium.webdriver.common.selenium_manager import SeleniumManager
+
+# BARRETT_CALC_URL permite apontar para um servidor substituto local (ver calc_standin.py)
+CALC_URL = os.environ.get("BARRETT_CALC_URL", "https://calc.apacrs.org/barrett_universal2105/")
+CALC_HOSTS = [urlparse(CALC_URL).hostname]
+
+def shared(fn):
+    """Um único objeto por processo, criado na 1ª chamada (thread-safe).
+       Fora do runtime do Streamlit (modo serviço, testes, scripts) o st.cache_resource não memoriza
+       nada: fila, disjuntor e caches seriam recriados a cada chamada."""
+    lock = threading.Lock()
+    box = []
+
+    @functools.wraps(fn)
+    def get():
+        if not box:
+            with lock:
+                if not box:
+                    box.append(fn())
+        return box[0]
+    return get
+
+# =========================
+# IOL PRESETS (catálogo externo, recarregado quando o arquivo muda)
+# =========================
+IOL_CATALOG_PATH = os.environ.get(
+    "BARRETT_IOL_CATALOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "iol_catalog.json")
+)
+IOL_PLACEHOLDER = {"label": "— selecionar —", "a_constant": "", "lens_factor": ""}
+
+def _search_key(txt: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", txt.lower()).strip()
+
+@functools.lru_cache(maxsize=2)
+def load_iol_catalog(path: str, mtime: float) -> dict:
+    """Lê o catálogo (JSON) uma vez por versão do arquivo e monta os índices.
+       Formato: {"version": 1, "lenses": [{"label", "manufacturer", "model",
+                 "a_constant", "lens_factor", "optimized": {fórmula: constante}}]}
+    """
+    with open(path, encoding="utf-8") as f:
+        lenses = json.load(f)["lenses"]
+    presets = [IOL_PLACEHOLDER] + [
+        {**ln, "a_constant": str(ln.get("a_constant", "") or ""), "lens_factor": str(ln.get("lens_factor", "") or "")}
+        for ln in lenses
+    ]
+    by_manufacturer, by_a_constant = {}, {}
+    for p in presets[1:]:
+        by_manufacturer.setdefault(p.get("manufacturer", ""), []).append(p["label"])
+        if p["a_constant"]:
+            by_a_constant.setdefault(p["a_constant"], []).append(p["label"])
+    labels = [p["label"] for p in presets]
+    return {
+        "presets": presets,
+        "labels": labels,
+        "label_index": {lab: i for i, lab in enumerate(labels)},
+        "by_label": {p["label"]: p for p in presets},
+        "by_manufacturer": by_manufacturer,
+        "by_a_constant": by_a_constant,
+        "search_keys": [(_search_key(f"{p['label']} {p.get('model', '')} {p['a_constant']}"), p["label"]) for p in presets[1:]],
+    }
+
+def iol_catalog() -> dict:
+    try:
+        return load_iol_catalog(IOL_CATALOG_PATH, os.path.getmtime(IOL_CATALOG_PATH))
+    except Exception:
+        # catálogo ausente/inválido: só o placeholder (constantes manuais continuam funcionando)
+        return load_iol_catalog_fallback()
+
+@shared
+def load_iol_catalog_fallback() -> dict:
+    return {
+        "presets": [IOL_PLACEHOLDER], "labels": [IOL_PLACEHOLDER["label"]],
+        "label_index": {IOL_PLACEHOLDER["label"]: 0}, "by_label": {IOL_PLACEHOLDER["label"]: IOL_PLACEHOLDER},
+        "by_manufacturer": {}, "by_a_constant": {}, "search_keys": [],
+    }
+
+def search_iol(query: str, limit: int = 50) -> list:
+    """Busca tipo 'type-ahead': todos os termos contidos; senão, aproximação por difflib."""
+    cat = iol_catalog()
+    q = _search_key(query)
+    if not q:
+        return cat["labels"][1:]
+    terms = q.split()
+    hits = [lab for key, lab in cat["search_keys"] if all(t in key for t in terms)]
+    if not hits:
+        keys = {key: lab for key, lab in cat["search_keys"]}
+        hits = [keys[k] for k in difflib.get_close_matches(q, list(keys), n=limit, cutoff=0.4)]
+    return hits[:limit]
+
+# =========================
+# Controle de admissão (compartilhado entre sessões): render, OCR e navegador
+# =========================
+GOVERNOR_LIMITS = {"render": 2, "ocr": 3, "browser": 2}
+GOVERNOR_JOB_MB = {"render": 200, "ocr": 100, "browser": 400}   # estimativa de pico por job
+GOVERNOR_RESERVE_MB = 150                                       # folga mínima que sempre sobra
+GOVERNOR_LABELS = {"render": "renderização", "ocr": "OCR", "browser": "navegador"}
+progress_local = threading.local()   # .report: callback(rótulo) da execução atual (posição na fila)
+
+@shared
+def governor() -> dict:
+    return {
+        "cond": threading.Condition(),
+        "pools": {k: {"running": 0, "queue": deque(), "avg_s": 2.0 if k != "browser" else 20.0}
+                  for k in GOVERNOR_LIMITS},
+    }
+
+CGROUP_MEMORY_FILES = [
+    # (limite, uso, estatísticas, campo do cache de arquivos inativo)
+    ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.stat", "inactive_file"),
+    ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+     "/sys/fs/cgroup/memory/memory.stat", "total_inactive_file"),
+]
+
+def _cgroup_stat(stat_f: str, field: str) -> int:
+    try:
+        with open(stat_f) as f:
+            for ln in f:
+                name, _, val = ln.partition(" ")
+                if name == field:
+                    return int(val)
+    except Exception:
+        pass
+    return 0
+
+def _available_mb():
+    """Memória livre do container (cgroup v2/v1) ou do host (/proc/meminfo); None se não der para ler.
+       O uso do cgroup inclui o cache de páginas: o cache inativo (que o kernel devolve sob pressão,
+       como o MemAvailable do host) não conta como ocupado."""
+    for limit_f, usage_f, stat_f, inactive in CGROUP_MEMORY_FILES:
+        try:
+            with open(limit_f) as f:
+                raw = f.read().strip()
+            if raw == "max" or int(raw) > 1 << 60:
+                continue
+            with open(usage_f) as f:
+                used = int(f.read().strip())
+            used = max(0, used - _cgroup_stat(stat_f, inactive))
+            return (int(raw) - used) / 1_048_576
+        except Exception:
+            continue
+    try:
+        with open("/proc/meminfo") as f:
+            for ln in f:
+                if ln.startswith("MemAvailable:"):
+                    return int(ln.split()[1]) / 1024
+    except Exception:
+        pass
+    return None
+
+def _memory_allows(kind: str) -> bool:
+    free = _available_mb()
+    return free is None or free - GOVERNOR_JOB_MB[kind] >= GOVERNOR_RESERVE_MB
+
+def queue_reporter():
+    """Callback de progresso da execução atual (da thread que chamou). Threads de executor não
+       enxergam o progress_local de quem as criou: capture-o antes e passe em `report=`."""
+    return getattr(progress_local, "report", None)
+
+def _report_queue(report, kind: str, pos: int = None, est_s: float = None):
+    if report is None:
+        return
+    if pos is None:
+        label = f"Executando ({GOVERNOR_LABELS[kind]})..."
+    else:
+        label = f"Na fila de {GOVERNOR_LABELS[kind]}: posição {pos + 1} · espera estimada ~{est_s:.0f} s"
+    try:
+        report(label)
+    except Exception:
+        pass
+
+@contextmanager
+def admitted(kind: str, report=None):
+    """Fila FIFO por tipo de job, com limite de concorrência e checagem de memória livre.
+       Se nada desse tipo estiver rodando, admite mesmo com pouca memória (evita travar a fila).
+       A posição na fila vai para `report` (padrão: queue_reporter() da thread atual)."""
+    report = report or queue_reporter()
+    gov = governor()
+    pool = gov["pools"][kind]
+    ticket = object()
+    last = None
+    with gov["cond"]:
+        pool["queue"].append(ticket)
+        while True:
+            pos = pool["queue"].index(ticket)
+            if pos == 0 and pool["running"] < GOVERNOR_LIMITS[kind] and (pool["running"] == 0 or _memory_allows(kind)):
+                break
+            ahead = pos + pool["running"]
+            est = pool["avg_s"] * max(1, ahead) / GOVERNOR_LIMITS[kind]
+            if (pos, round(est)) != last:
+                _report_queue(report, kind, pos, est)
+                last = (pos, round(est))
+            gov["cond"].wait(timeout=1.0)
+        pool["queue"].popleft()
+        pool["running"] += 1
+    if last is not None:
+        _report_queue(report, kind)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        with gov["cond"]:
+            pool["running"] -= 1
+            pool["avg_s"] = 0.8 * pool["avg_s"] + 0.2 * (time.perf_counter() - t0)
+            gov["cond"].notify_all()
+
+def try_admit(kind: str) -> bool:
+    """Vaga imediata, sem entrar na fila (para trabalho opcional, ex.: navegador de reserva da corrida).
+       Quem recebe True precisa chamar release(kind)."""
+    gov = governor()
+    pool = gov["pools"][kind]
+    with gov["cond"]:
+        if pool["queue"] or pool["running"] >= GOVERNOR_LIMITS[kind] or not _memory_allows(kind):
+            return False
+        pool["running"] += 1
+    return True
+
+def release(kind: str):
+    gov = governor()
+    with gov["cond"]:
+        gov["pools"][kind]["running"] -= 1
+        gov["cond"].notify_all()
+
+# Rasterização: pdfium no processo (buffer em tons de cinza direto, documento aberto uma vez para
+# todas as páginas/DPIs) ou pdftoppm via pdf2image (subprocesso + arquivo temporário por chamada)
+RASTER_BACKEND = os.environ.get("BARRETT_RASTER", "auto")   # auto | pdfium | pdftoppm
+_PDFIUM_LOCK = threading.Lock()   # o pdfium não é thread-safe, nem entre documentos diferentes
+
+def raster_backend() -> str:
+    return "pdfium" if pdfium is not None and RASTER_BACKEND != "pdftoppm" else "pdftoppm"
+
+def _pdfium_render(doc, first_page: int, last_page: int, dpi: int) -> list:
+    out = []
+    with _PDFIUM_LOCK:
+        n = len(doc)
+        for i in range(first_page - 1, min(last_page or n, n)):
+            page = doc[i]
+            try:
+                out.append(page.render(scale=dpi / 72, grayscale=True).to_pil())
+            finally:
+                page.close()
+    return out
+
+@contextmanager
+def open_pdf_raster(pdf_path: str, backend: str = None):
+    """Entrega render(first_page=1, last_page=None, dpi=200) -> [páginas em "L"] (last_page=None: até o fim).
+       Com pdfium o documento fica aberto até o fim do bloco; se o pdfium recusar o arquivo ou a página,
+       a chamada cai para o pdftoppm."""
+    backend = backend or raster_backend()
+    doc = None
+    if backend == "pdfium":
+        try:
+            with _PDFIUM_LOCK:
+                doc = pdfium.PdfDocument(pdf_path)
+        except Exception:
+            doc = None
+
+    def render(first_page: int = 1, last_page: int = None, dpi: int = 200) -> list:
+        with admitted("render"):
+            if doc is not None:
+                try:
+                    return _pdfium_render(doc, first_page, last_page, dpi)
+                except Exception:
+                    pass
+            # ppm/pgm: sem codificar/decodificar PNG
+            return convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                                     grayscale=True, thread_count=2)
+    render.backend = "pdfium" if doc is not None else "pdftoppm"
+    try:
+        yield render
+    finally:
+        if doc is not None:
+            with _PDFIUM_LOCK:
+                doc.close()
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for ln in f:
+                if ln.startswith("VmRSS:"):
+                    return int(ln.split()[1]) / 1024
+    except Exception:
+        pass
+    return None
+
+@contextmanager
+def rss_peak(out: dict, interval_s: float = 0.05):
+    """Amostra o RSS do processo enquanto o bloco roda; grava rss_start_mb/rss_peak_mb em `out`.
+       (É o processo inteiro: com documentos simultâneos o pico inclui os vizinhos.)"""
+    start = _rss_mb()
+    box = {"peak": start or 0.0}
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval_s):
+            cur = _rss_mb()
+            if cur and cur > box["peak"]:
+                box["peak"] = cur
+    th = threading.Thread(target=sample, daemon=True, name="barrett-rss")
+    if start is not None:
+        th.start()
+    try:
+        yield out
+    finally:
+        done.set()
+        if start is not None:
+            th.join()
+            box["peak"] = max(box["peak"], _rss_mb() or 0.0)
+            out.update(rss_start_mb=start, rss_peak_mb=box["peak"])
+
+# =========================
+# Utilitários OCR
+# =========================
+def _to_f(s: str) -> float:
+    return float(str(s).replace(",", ".").strip())
+
+def preprocess_for_ocr(img: Image.Image, binarize: bool = True, scale: float = 1.8, box: tuple = None) -> Image.Image:
+    """`box` = região (x0, y0, x1, y1) da página: reamostrada direto da página, sem cópia intermediária do recorte."""
+    if img.mode != "L":
+        img = img.convert("L")
+    # super-amostra antes do OCR (ajuda dígitos pequenos/borrados)
+    x0, y0, x1, y1 = box or (0, 0, *img.size)
+    if scale != 1.0:
+        img = img.resize((int((x1 - x0) * scale), int((y1 - y0) * scale)), Image.BICUBIC, box=box)
+    elif box:
+        img = img.crop(box)
+    # contraste + sharpen
+    img = ImageOps.autocontrast(img, cutoff=2)
+    img = img.filter(ImageFilter.UnsharpMask(radius=1.6, percent=180, threshold=2))
+    # binarização suave para destacar números (1 bit por pixel)
+    if binarize:
+        img = img.point(lambda p: 255 if p > 180 else 0, mode="1")
+    return img
+
+def ocr_text(img: Image.Image, psm: str = "6", report=None) -> str:
+    # psm 6 = parágrafos; 11 = linha única (fallback)
+    with admitted("ocr", report):
+        return pytesseract.image_to_string(img, lang="por+eng", config=f"--psm {psm}")
+
+def ocr_top_header_get_text(img: Image.Image, top_ratio: float = 0.22) -> str:
+    w, h = img.size
+    top_h = int(h * top_ratio)
+    header = img.crop((0, 0, w, top_h))
+    # header usa OCR "texto" (sem binarizar forte) para pegar nome
+    with admitted("ocr"):
+        txt = pytesseract.image_to_string(header, lang="por+eng", config="--psm 6")
+    return txt
+
+def extrair_patient_name_do_header(texto_header: str) -> str:
+    blacklist = [
+        "report date","biometria","cálculo iol","page","id:","dob:","gender:",
+        "r. ","av. ","rua ","tel","cep","http","www","e-mail","email",
+        "printing images","admin/","instituto","hospital"
+    ]
+    linhas = [ln.strip() for ln in texto_header.splitlines() if ln.strip()]
+    for ln in linhas:
+        low = ln.lower()
+        if any(b in low for b in blacklist):
+            continue
+        candidato = re.sub(r"[^A-Za-zÀ-ÖØ-öø-ÿ' \-\.]", "", ln).strip()
+        if len(candidato.split()) >= 2 and 2 <= len(candidato) <= 80:
+            return candidato
+    return ""
+
+def _parse_eye_text(txt: str) -> dict:
+    """Extrai estritamente:
+       Comp. AL: <num>
+       MV: <K1> / <K2>
+       ACD: <num>
+    """
+    t = txt.replace(",", ".")
+    # AL
+    m_al = re.search(r"Comp\.?\s*AL\s*[:=]\s*([0-9]+(?:\.[0-9]+)?)", t, re.IGNORECASE)
+    al = _to_f(m_al.group(1)) if m_al else None
+    # MV → K1 / K2
+    m_mv = re.search(r"\bMV\b\s*[:=]\s*([0-9]+(?:\.[0-9]+)?)\s*/\s*([0-9]+(?:\.[0-9]+)?)", t, re.IGNORECASE)
+    k1 = _to_f(m_mv.group(1)) if m_mv else None
+    k2 = _to_f(m_mv.group(2)) if m_mv else None
+    # ACD
+    m_acd = re.search(r"\bACD\b\s*[:=]\s*([0-9]+(?:\.[0-9]+)?)", t, re.IGNORECASE)
+    acd = _to_f(m_acd.group(1)) if m_acd else None
+    return {"AL": al, "K1": k1, "K2": k2, "ACD": acd}
+
+def _eye_complete(eye: dict) -> bool:
+    return all(eye[k] is not None for k in ["AL", "K1", "K2", "ACD"])
+
+def extrair_biometria_dupla_por_metades(pil_page: Image.Image, psms=("6", "11"), binarize: bool = True,
+                                        scale: float = 1.8, info: dict = None, memo: dict = None) -> dict:
+    """Divide a 1ª página em duas metades (esq=OD, dir=OS), pré-processa e faz OCR+parse.
+       Um olho por vez: a metade pré-processada só existe enquanto os PSMs dela rodam.
+       Tenta os PSMs em ordem (padrão 6, depois 11) até o olho ficar completo.
+       Se `info` for passado, recebe em info["psms"] os PSMs que foram realmente necessários.
+       `memo` ({(olho, psm): texto}, da mesma página/binarização/escala) evita repetir um PSM já rodado.
+    """
+    w, h = pil_page.size
+    mid = w // 2
+    empty = {"AL": None, "K1": None, "K2": None, "ACD": None}
+    eyes = {}
+    used = 0
+    memo = memo if memo is not None else {}
+    for eye, box in (("OD", (0, 0, mid, h)), ("OS", (mid, 0, w, h))):
+        half = None
+        eyes[eye] = dict(empty)
+        for i, psm in enumerate(psms):
+            if (eye, psm) not in memo:
+                if half is None:
+                    half = preprocess_for_ocr(pil_page, binarize=binarize, scale=scale, box=box)
+                memo[(eye, psm)] = ocr_text(half, psm=psm)
+            eyes[eye] = _parse_eye_text(memo[(eye, psm)])
+            used = max(used, i + 1)
+            if _eye_complete(eyes[eye]):
+                break
+        del half
+        if not _eye_complete(eyes[eye]):
+            break  # sem este olho não há resultado: não gasta OCR no outro
+
+    if info is not None:
+        info["psms"] = tuple(psms[:used])
+    ok = all(_eye_complete(eyes.get(e, empty)) for e in ("OD", "OS"))
+    return {"OD": eyes["OD"], "OS": eyes["OS"]} if ok else {}
+
+# =========================
+# Aquecimento (uma vez por processo)
+# =========================
+CHROMEDRIVER_ENV_VARS = ("WEBDRIVER_CHROME_DRIVER", "webdriver.chrome.driver", "CHROMEDRIVER", "CHROMEWEBDRIVER")
+
+def _path_without_chromedriver(path_value: str) -> str:
+    # filtra PATH para não confundir o Selenium Manager
+    filtered = []
+    for p in path_value.split(os.pathsep):
+        try:
+            found = shutil.which("chromedriver", path=p)
+        except Exception:
+            found = None
+        if not found:
+            filtered.append(p)
+    return os.pathsep.join(filtered)
+
+def _driver_env() -> dict:
+    # cópia do ambiente sem chromedriver antigo (variáveis e PATH), só para os subprocessos do Selenium:
+    # o os.environ do processo não muda, então outras threads continuam vendo o PATH original
+    env = {k: v for k, v in os.environ.items() if k not in CHROMEDRIVER_ENV_VARS}
+    env["PATH"] = _path_without_chromedriver(env.get("PATH", ""))
+    return env
+
+# as mesmas flags que SeleniumManager.binary_paths acrescenta (conferido em tests/test_browser_startup.py)
+SELENIUM_MANAGER_FLAGS = ["--language-binding", "python", "--output", "json"]
+
+def _resolve_browser(name: str, browser_path: str = None) -> dict:
+    """Resolve driver + navegador via Selenium Manager (subprocesso com _driver_env)."""
+    # Subprocesso próprio de propósito: o público SeleniumManager().binary_paths() roda o binário com
+    # o os.environ do processo (sem parâmetro env) e, nesta versão, sem --skip-driver-in-path, então
+    # acharia o chromedriver velho do PATH; trocar o PATH global para isso afeta as outras threads.
+    # Do Selenium só vem o caminho do binário (_get_binary, privado; o teste de contrato quebra se mudar).
+    args = [str(SeleniumManager._get_binary()), "--browser", "chrome" if name == "Chrome" else "firefox",
+            *SELENIUM_MANAGER_FLAGS]
+    if browser_path:
+        args += ["--browser-path", browser_path]
+    res = subprocess.run(args, capture_output=True, env=_driver_env(), timeout=120)
+    try:
+        out = json.loads(res.stdout or b"{}").get("result") or {}
+    except ValueError:
+        out = {}
+    paths = {"driver_path": out.get("driver_path") or "", "browser_path": out.get("browser_path") or ""}
+    if res.returncode or not os.path.isfile(paths["driver_path"]):
+        err = res.stderr.decode("utf-8", errors="ignore").strip()[-300:]
+        raise RuntimeError(f"Selenium Manager não resolveu o driver do {name}: {err or out}")
+    return paths
+
+def _run_warmup(state: dict):
+    t0 = time.perf_counter()
+    state["bins"] = {b: shutil.which(b) for b in ["pdftoppm", "tesseract"]}
+    if state["bins"]["tesseract"]:
+        pytesseract.pytesseract.tesseract_cmd = state["bins"]["tesseract"]
+    for name in ["Firefox", "Chrome"]:
+        try:
+            state["drivers"][name] = _resolve_browser(name)
+        except Exception as e:
+            state["errors"][name] = str(e)
+    # 1ª chamada do Tesseract carrega o traineddata do disco; faz isso agora (cache do SO)
+    try:
+        pytesseract.image_to_string(Image.new("L", (64, 32), 255), lang="por+eng", config="--psm 6")
+        state["ocr_ready"] = True
+    except Exception as e:
+        state["errors"]["tesseract"] = str(e)
+    state["elapsed_s"] = time.perf_counter() - t0
+    state["ready"] = True
+
+@shared
+def warmup_state() -> dict:
+    """Estado compartilhado entre sessões; o aquecimento roda em background na 1ª execução."""
+    state = {"ready": False, "bins": {}, "drivers": {}, "errors": {}, "ocr_ready": False, "elapsed_s": None}
+    threading.Thread(target=_run_warmup, args=(state,), daemon=True, name="barrett-warmup").start()
+    return state
+
+def _pinned_binaries(name: str) -> dict:
+    state = warmup_state()
+    return state["drivers"].get(name, {}) if state["ready"] else {}
+
+# =========================
+# Spool de uploads (endereçado por conteúdo, compartilhado entre sessões)
+# =========================
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), "barrett-spool")
+SPOOL_MAX_MB = 400
+SPOOL_IDLE_S = 30 * 60
+# extensão real no nome: pdfium/pdftoppm/pdfimages só recebem o que é PDF de fato
+SPOOL_SUFFIX = {"pdf": ".pdf", "xml": ".xml", "csv": ".csv", "dicom": ".dcm"}
+
+@shared
+def spool_registry() -> dict:
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return {"lock": threading.Lock(), "refs": {}, "session_doc": {}, "last_seen": {}}
+
+def spool_path(doc_hash: str, kind: str = "pdf") -> str:
+    return os.path.join(SPOOL_DIR, doc_hash + SPOOL_SUFFIX[kind])
+
+def _spool_evict(reg: dict):
+    """Solta sessões ociosas e apaga arquivos sem referência (mais antigos primeiro se passar do limite)."""
+    now = time.time()
+    for sid, seen in list(reg["last_seen"].items()):
+        if now - seen > SPOOL_IDLE_S:
+            h = reg["session_doc"].pop(sid, None)
+            reg["last_seen"].pop(sid, None)
+            if h:
+                reg["refs"].get(h, set()).discard(sid)
+    files = []
+    for fn in os.listdir(SPOOL_DIR):
+        fp = os.path.join(SPOOL_DIR, fn)
+        try:
+            # hash = nome até o 1º ponto (vale para "<hash>.csv" e para "<hash>.pdf.<pid>.tmp")
+            files.append((os.path.getmtime(fp), os.path.getsize(fp), fn.split(".", 1)[0], fp))
+        except OSError:
+            continue
+    total = sum(f[1] for f in files)
+    for mtime, size, h, fp in sorted(files):
+        if reg["refs"].get(h):
+            continue
+        if total > SPOOL_MAX_MB * 1024 * 1024 or now - mtime > SPOOL_IDLE_S:
+            try:
+                os.remove(fp)
+                total -= size
+            except OSError:
+                pass
+            reg["refs"].pop(h, None)
+
+def spool_put(arquivo, owner: str, kind: str = "pdf") -> str:
+    """Grava o upload uma única vez (nome = sha256 + extensão do tipo) e associa ao dono (sessão ou requisição)."""
+    buf = arquivo.getbuffer()  # sem cópia
+    doc_hash = hashlib.sha256(buf).hexdigest()
+    path = spool_path(doc_hash, kind)
+    reg = spool_registry()
+    with reg["lock"]:
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(buf)
+            os.replace(tmp, path)
+        spool_touch(doc_hash, owner, reg)
+        _spool_evict(reg)
+    return doc_hash
+
+def spool_touch(doc_hash: str, sid: str, reg: dict = None):
+    reg = reg or spool_registry()
+    old = reg["session_doc"].get(sid)
+    if old and old != doc_hash:
+        reg["refs"].get(old, set()).discard(sid)
+    reg["session_doc"][sid] = doc_hash
+    reg["refs"].setdefault(doc_hash, set()).add(sid)
+    reg["last_seen"][sid] = time.time()
+
+def spool_release(sid: str):
+    """Dono terminou (ex.: requisição da API): o arquivo fica livre para o despejo."""
+    reg = spool_registry()
+    with reg["lock"]:
+        h = reg["session_doc"].pop(sid, None)
+        reg["last_seen"].pop(sid, None)
+        if h:
+            reg["refs"].get(h, set()).discard(sid)
+
+# =========================
+# Histórico local (SQLite, WAL) de extrações e cálculos
+# =========================
+HISTORY_DB = os.environ.get(
+    "BARRETT_HISTORY_DB", os.path.join(os.path.expanduser("~"), ".barrett_autofill", "history.sqlite3")
+)
+
+def _history_conn():
+    os.makedirs(os.path.dirname(HISTORY_DB), exist_ok=True)
+    conn = sqlite3.connect(HISTORY_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+@shared
+def history_init() -> bool:
+    with _history_conn() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_hash TEXT PRIMARY KEY,
+                file_name TEXT,
+                patient TEXT,
+                biometry TEXT,
+                created_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS calculations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                doc_hash TEXT,
+                patient TEXT,
+                iol TEXT,
+                const_tipo TEXT,
+                a_constant TEXT,
+                lens_factor TEXT,
+                biometry TEXT,
+                tables TEXT,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_patient ON documents(patient COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_documents_created ON documents(created_at);
+            CREATE INDEX IF NOT EXISTS idx_calc_patient ON calculations(patient COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_calc_created ON calculations(created_at);
+            CREATE INDEX IF NOT EXISTS idx_calc_doc ON calculations(doc_hash);
+            CREATE TABLE IF NOT EXISTS strategies (
+                template TEXT NOT NULL,
+                dpi INTEGER NOT NULL,
+                psms TEXT NOT NULL,
+                binarize INTEGER NOT NULL,
+                layout TEXT NOT NULL,
+                successes INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                cost_s REAL NOT NULL DEFAULT 0,
+                render_s REAL NOT NULL DEFAULT 0,
+                ocr_s REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (template, dpi, psms, binarize, layout)
+            );
+        """)
+        # bancos anteriores: custo só tinha o total
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(strategies)")}
+        for col in ("render_s", "ocr_s"):
+            if col not in cols:
+                conn.execute(f"ALTER TABLE strategies ADD COLUMN {col} REAL NOT NULL DEFAULT 0")
+    return True
+
+def _now_iso() -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+def history_get_document(doc_hash: str):
+    """Biometria já extraída deste PDF (sem OCR), ou None."""
+    try:
+        history_init()
+        with _history_conn() as conn:
+            row = conn.execute(
+                "SELECT patient, biometry FROM documents WHERE doc_hash = ?", (doc_hash,)
+            ).fetchone()
+    except Exception:
+        return None
+    if not row or not row["biometry"]:
+        return None
+    return json.loads(row["biometry"]), row["patient"] or ""
+
+def history_save_document(doc_hash: str, file_name: str, biometry: dict, patient: str):
+    try:
+        history_init()
+        with _history_conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (doc_hash, file_name, patient, biometry, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (doc_hash, file_name, patient, json.dumps(biometry), _now_iso()),
+            )
+    except Exception:
+        pass
+
+def history_save_calculation(doc_hash, inputs: dict, tables: dict):
+    try:
+        history_init()
+        with _history_conn() as conn:
+            conn.execute(
+                "INSERT INTO calculations (doc_hash, patient, iol, const_tipo, a_constant, lens_factor, "
+                "biometry, tables, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    doc_hash, inputs["patient"], inputs["iol"], inputs["const_tipo"],
+                    inputs["a_constant"], inputs["lens_factor"],
+                    json.dumps({"OD": inputs["OD"], "OS": inputs["OS"]}), json.dumps(tables), _now_iso(),
+                ),
+            )
+    except Exception:
+        pass
+
+def history_top_iols(limit: int = 3) -> list:
+    """LIOs mais escolhidas (estatística local de uso)."""
+    try:
+        history_init()
+        with _history_conn() as conn:
+            rows = conn.execute(
+                "SELECT iol, COUNT(*) AS n FROM calculations WHERE iol IS NOT NULL AND iol != ? "
+                "GROUP BY iol ORDER BY n DESC LIMIT ?",
+                (IOL_PLACEHOLDER["label"], limit),
+            ).fetchall()
+    except Exception:
+        return []
+    return [r["iol"] for r in rows]
+
+def history_search(patient_query: str = "", limit: int = 30) -> list:
+    """Cálculos mais recentes, filtrando por nome do paciente (prefixo, sem caixa)."""
+    try:
+        history_init()
+        with _history_conn() as conn:
+            rows = conn.execute(
+                "SELECT * FROM calculations WHERE patient LIKE ? COLLATE NOCASE "
+                "ORDER BY created_at DESC LIMIT ?",
+                (f"{patient_query.strip()}%", limit),
+            ).fetchall()
+    except Exception:
+        return []
+    return [dict(r) for r in rows]
+
+# =========================
+# Importadores de exportação estruturada do biômetro (XML / CSV / DICOM-SR)
+# =========================
+STRUCTURED_EXT = {"xml": "xml", "csv": "csv", "txt": "csv", "dcm": "dicom"}   # extensão → leitor
+STRUCT_MAX_RECORDS = 500
+FIELD_ALIASES = {
+    "AL": {"al", "axiallength", "compal", "complal", "axl", "axiallen"},
+    "K1": {"k1", "flatk", "kflat", "k1d", "k1power"},
+    "K2": {"k2", "steepk", "ksteep", "k2d", "k2power"},
+    "ACD": {"acd", "anteriorchamberdepth", "acdepth", "acdc"},
+}
+FIELD_BY_ALIAS = {a: k for k, aliases in FIELD_ALIASES.items() for a in aliases}
+EYE_ALIASES = {
+    "OD": {"od", "r", "re", "right", "righteye", "dir", "direito", "olhodireito"},
+    "OS": {"os", "l", "le", "left", "lefteye", "oe", "esq", "esquerdo", "olhoesquerdo"},
+}
+EYE_BY_ALIAS = {a: k for k, aliases in EYE_ALIASES.items() for a in aliases}
+NAME_KEYS = {"patientname", "patient", "name", "nome", "paciente", "fullname"}
+FIRST_NAME_KEYS = {"firstname", "givenname", "prenome"}
+LAST_NAME_KEYS = {"lastname", "familyname", "surname", "sobrenome"}
+EYE_KEYS = {"eye", "side", "laterality", "olho", "lado"}
+# faixas plausíveis (fora disso o valor é descartado, como um campo não lido)
+FIELD_RANGES = {"AL": (15.0, 40.0), "K1": (30.0, 65.0), "K2": (30.0, 65.0), "ACD": (1.0, 6.5)}
+
+def _norm_key(s: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(s).lower())
+
+def _eye_of(value) -> str:
+    return EYE_BY_ALIAS.get(_norm_key(value or ""))
+
+def _field_and_eye(raw_key: str, eye: str = None):
+    """'AL OD', 'od_al', 'Axial Length (R)', 'K1 [D]' → ('AL', 'OD'); eye herdado se não estiver na chave."""
+    tokens = [t for t in re.split(r"[^a-z0-9]+", str(raw_key).lower()) if t]
+    rest = []
+    for t in tokens:
+        if t in EYE_BY_ALIAS and len(tokens) > 1:
+            eye = EYE_BY_ALIAS[t]
+        else:
+            rest.append(t)
+    key = "".join(rest)
+    field = FIELD_BY_ALIAS.get(key) or FIELD_BY_ALIAS.get(re.sub(r"(mm|d|dpt)$", "", key))
+    return field, eye
+
+def _measure(field: str, value):
+    try:
+        v = _to_f(value)
+    except (TypeError, ValueError):
+        return None
+    if field in ("K1", "K2") and 5.0 <= v <= 12.0:
+        v = 337.5 / v  # raio em mm → dioptrias (índice 1.3375)
+    lo, hi = FIELD_RANGES[field]
+    return round(v, 2) if lo <= v <= hi else None
+
+def _new_record() -> dict:
+    return {"patient": "", "dados": {eye: {"AL": None, "K1": None, "K2": None, "ACD": None} for eye in ("OD", "OS")}}
+
+def _record_put(rec: dict, raw_key: str, value, eye: str = None):
+    nk = _norm_key(raw_key)
+    if nk in NAME_KEYS and not rec["patient"]:
+        rec["patient"] = str(value).replace("^", " ").strip()
+        return
+    if nk in FIRST_NAME_KEYS:
+        rec["first"] = str(value).strip()
+        return
+    if nk in LAST_NAME_KEYS:
+        rec["last"] = str(value).strip()
+        return
+    field, eye = _field_and_eye(raw_key, eye)
+    if field and eye and rec["dados"][eye][field] is None:
+        rec["dados"][eye][field] = _measure(field, value)
+
+def _record_done(rec: dict):
+    """Registro completo → {"patient", "dados"}; incompleto → None."""
+    if not rec["patient"] and (rec.get("first") or rec.get("last")):
+        rec["patient"] = f"{rec.get('first', '')} {rec.get('last', '')}".strip()
+    if not all(_eye_complete(rec["dados"][eye]) for eye in ("OD", "OS")):
+        return None
+    return {"patient": rec["patient"], "dados": rec["dados"]}
+
+def _iter_csv_records(path: str):
+    """Uma linha por paciente (colunas 'OD AL', 'AL_OS', ...) ou uma linha por olho (coluna Eye/Side)."""
+    with open(path, newline="", encoding="utf-8-sig", errors="replace") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        eye_col = next((c for c in reader.fieldnames or [] if _norm_key(c) in EYE_KEYS), None)
+        rec, current = None, None
+        for row in reader:
+            name = next((v for c, v in row.items() if _norm_key(c or "") in NAME_KEYS and v), "")
+            key = name or current
+            if eye_col is None or key != current:
+                if rec is not None:
+                    done = _record_done(rec)
+                    if done:
+                        yield done
+                rec, current = _new_record(), key
+            eye = _eye_of(row.get(eye_col)) if eye_col else None
+            for col, value in row.items():
+                if col is None or col == eye_col or value in (None, ""):
+                    continue
+                _record_put(rec, col, value, eye)
+        if rec is not None:
+            done = _record_done(rec)
+            if done:
+                yield done
+
+RECORD_TAGS = {"patient", "paciente", "exam", "examination", "record", "measurement", "biometry"}
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+def _xml_fill(rec: dict, elem, eye: str = None):
+    eye = _eye_of(_local(elem.tag)) or next(
+        (_eye_of(v) for a, v in elem.attrib.items() if _norm_key(_local(a)) in EYE_KEYS), None) or eye
+    for a, v in elem.attrib.items():
+        if _norm_key(_local(a)) not in EYE_KEYS:
+            _record_put(rec, _local(a), v, eye)
+    children = list(elem)
+    text = (elem.text or "").strip()
+    if text and not children:
+        _record_put(rec, _local(elem.tag), text, eye)
+    for child in children:
+        _xml_fill(rec, child, eye)
+
+def _iter_xml_records(path: str):
+    """iterparse: cada elemento de paciente/exame é lido e descartado (arquivo com muitos pacientes em memória constante)."""
+    depth, root, emitted = 0, None, 0
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if root is None:
+            root = elem
+        is_record = _norm_key(_local(elem.tag)) in RECORD_TAGS
+        if event == "start":
+            depth += is_record
+            continue
+        if elem is root and not emitted:
+            # exportação de um só paciente, sem elemento de registro: o documento inteiro é o registro
+            rec = _new_record()
+            _xml_fill(rec, root)
+            done = _record_done(rec)
+            if done:
+                yield done
+            continue
+        if not is_record:
+            continue
+        depth -= 1
+        if depth:
+            continue  # registro aninhado (exame dentro de paciente): emite no nível externo
+        rec = _new_record()
+        _xml_fill(rec, elem)
+        elem.clear()
+        done = _record_done(rec)
+        if done:
+            emitted += 1
+            yield done
+
+def _sr_meaning(seq) -> str:
+    return str(seq[0].CodeMeaning) if seq else ""
+
+def _sr_fill(rec: dict, items, eye: str = None):
+    # lateralidade declarada no próprio container vale para os filhos
+    for it in items:
+        if getattr(it, "ValueType", "") == "CODE" and _norm_key(_sr_meaning(it.ConceptNameCodeSequence)) in {
+                "laterality", "findingsite", "targetsite"}:
+            eye = _eye_of(_sr_meaning(it.ConceptCodeSequence).replace("Eye", "")) or eye
+    for it in items:
+        name = _sr_meaning(getattr(it, "ConceptNameCodeSequence", None))
+        if getattr(it, "ValueType", "") == "NUM" and getattr(it, "MeasuredValueSequence", None):
+            _record_put(rec, name, it.MeasuredValueSequence[0].NumericValue, eye)
+        if getattr(it, "ContentSequence", None):
+            _sr_fill(rec, it.ContentSequence, _eye_of(name) or eye)
+
+def _iter_dicom_records(path: str):
+    if pydicom is None:
+        raise RuntimeError("Leitura de DICOM-SR requer o pacote 'pydicom'.")
+    ds = pydicom.dcmread(path, stop_before_pixels=True)
+    rec = _new_record()
+    rec["patient"] = " ".join(reversed(str(getattr(ds, "PatientName", "")).split("^"))).strip()
+    _sr_fill(rec, getattr(ds, "ContentSequence", []))
+    done = _record_done(rec)
+    if done:
+        yield done
+
+STRUCTURED_READERS = {"csv": _iter_csv_records, "xml": _iter_xml_records, "dicom": _iter_dicom_records}
+
+def iter_structured_records(path: str, kind: str):
+    """Gera {"patient", "dados": {"OD": {...}, "OS": {...}}} por paciente completo no arquivo."""
+    return STRUCTURED_READERS[kind](path)
+
+# =========================
+# Extração da página de biometria (PDF)
+# =========================
+# Localizador da página de biometria: texto do PDF (pdftotext) ou miniaturas (1 chamada ao rasterizador)
+LOCATOR_DPI = 72
+LOCATOR_MAX_PAGES = 40
+BIOMETRY_LABELS = [
+    r"Comp\.?\s*AL", r"\bAL\b", r"\bMV\b", r"\bACD\b", r"\bK1\b", r"\bK2\b",
+    r"\bOD\b", r"\bOS\b", r"Biometria", r"Axial", r"\bmm\b",
+]
+
+# Rótulos com valor (AL/ACD/K1/K2 seguidos de número): bastam para confiar na camada de texto
+STRONG_LABELS = [
+    r"\bAL\b\s*[:=]?\s*\d{2}[.,]\d", r"\bACD\b\s*[:=]?\s*\d[.,]\d",
+    r"\bK1\b\s*[:=]?\s*\d{2}[.,]\d", r"\bK2\b\s*[:=]?\s*\d{2}[.,]\d",
+]
+LOCATOR_MIN_SCORE = 6      # ou rótulos fracos suficientes numa mesma página
+LOCATOR_FALLBACK = (1, 2)  # completam o ranking quando poucas páginas pontuam
+
+def _score_biometry_text(txt: str) -> int:
+    return sum(1 for pat in BIOMETRY_LABELS if re.search(pat, txt or "", re.IGNORECASE))
+
+def _confident_biometry_text(txt: str) -> bool:
+    strong = sum(1 for pat in STRONG_LABELS if re.search(pat, txt or "", re.IGNORECASE))
+    return strong >= 3 or _score_biometry_text(txt) >= LOCATOR_MIN_SCORE
+
+def _pdf_text_pages(pdf_path: str) -> list:
+    """Texto embutido por página (vazio se for só imagem)."""
+    if not shutil.which("pdftotext"):
+        return []
+    try:
+        res = subprocess.run(
+            ["pdftotext", "-l", str(LOCATOR_MAX_PAGES), "-layout", pdf_path, "-"],
+            capture_output=True, timeout=30,
+        )
+    except Exception:
+        return []
+    if res.returncode != 0:
+        return []
+    out = res.stdout.decode("utf-8", errors="ignore")
+    pages = out.split("\f")
+    # cada página termina em \f: o último pedaço é vazio
+    return pages[:-1] if out.endswith("\f") else pages
+
+def locate_biometry_pages(pdf_path: str, top: int = 2, render=None) -> tuple:
+    """Retorna (páginas 1-based mais prováveis, do melhor para o pior; texto de cada página;
+       páginas que têm camada de texto). `render` (open_pdf_raster) reaproveita o documento já aberto.
+       Páginas só de imagem passam por OCR de miniatura, a menos que alguma página com texto já traga
+       a biometria com valores; as páginas 1 e 2 completam o ranking."""
+    texts = dict(enumerate(_pdf_text_pages(pdf_path), start=1))
+    text_pages = {i for i, txt in texts.items() if txt.strip()}
+    scores = {i: _score_biometry_text(texts[i]) for i in text_pages}
+    image_pages = [i for i in texts if i not in text_pages]
+    if not any(_confident_biometry_text(texts[i]) for i in text_pages) and (image_pages or not texts):
+        # sem pdftotext o nº de páginas é desconhecido: miniaturas de todas até o limite
+        first, last = (min(image_pages), max(image_pages)) if image_pages else (1, LOCATOR_MAX_PAGES)
+        try:
+            if render is None:
+                with open_pdf_raster(pdf_path) as own:
+                    thumbs = own(first, last, dpi=LOCATOR_DPI)
+            else:
+                thumbs = render(first, last, dpi=LOCATOR_DPI)
+        except Exception:
+            thumbs = []
+        pages = {first + k: im for k, im in enumerate(thumbs) if first + k not in text_pages}
+        if pages:
+            report = queue_reporter()   # as threads do executor não veem o progress_local desta
+            try:
+                with ThreadPoolExecutor(max_workers=min(4, len(pages))) as ex:
+                    txts = dict(zip(pages, ex.map(lambda im: ocr_text(im, psm="11", report=report),
+                                                  pages.values())))
+            except Exception:
+                txts = {}   # sem OCR disponível: ficam as páginas com texto e o padrão
+            for i, t in txts.items():
+                texts[i] = t
+                scores[i] = _score_biometry_text(t)
+    ranked = [p for p, sc in sorted(scores.items(), key=lambda kv: (-kv[1], kv[0])) if sc > 0][:top]
+    for p in LOCATOR_FALLBACK:
+        if len(ranked) < top and p not in ranked:
+            ranked.append(p)
+    return ranked, texts, text_pages
+
+# Auto-ajuste por modelo de laudo: aprende a estratégia mais barata que funcionou
+TEMPLATE_KEYWORDS = [
+    "iolmaster", "lenstar", "argos", "aladdin", "al-scan", "pentacam", "oa-2000", "eyestar",
+    "biometria", "report date", "comp. al", "mv", "acd", "wtw", "lt", "cct", "tk", "se", "snr",
+]
+DEFAULT_STRATEGIES = [
+    {"dpi": 400, "psms": ("6", "11"), "binarize": True, "layout": "metades"},
+    {"dpi": 480, "psms": ("6", "11"), "binarize": True, "layout": "metades"},
+    {"dpi": 400, "psms": ("6", "11"), "binarize": False, "layout": "metades"},
+]
+
+def pdf_layout_features(pdf_path: str, page_no: int) -> dict:
+    """Traços estáveis do arquivo (não dependem de OCR): nº de páginas, produtor sem versão e
+       tamanho da página em pontos."""
+    feats = {"pages": 0, "producer": "", "size": None}
+    if pdfium is not None:
+        try:
+            with _PDFIUM_LOCK:
+                doc = pdfium.PdfDocument(pdf_path)
+                try:
+                    feats["pages"] = len(doc)
+                    feats["producer"] = doc.get_metadata_dict().get("Producer") or ""
+                    if 1 <= page_no <= len(doc):
+                        feats["size"] = [round(v) for v in doc.get_page_size(page_no - 1)]
+                finally:
+                    doc.close()
+        except Exception:
+            pass
+    elif shutil.which("pdfinfo"):
+        try:
+            res = subprocess.run(["pdfinfo", "-f", str(page_no), "-l", str(page_no), pdf_path],
+                                 capture_output=True, timeout=20, text=True, errors="ignore")
+            for ln in res.stdout.splitlines():
+                key, _, val = ln.partition(":")
+                if key == "Pages":
+                    feats["pages"] = int(val)
+                elif key == "Producer":
+                    feats["producer"] = val.strip()
+                elif key.startswith("Page") and key.endswith("size"):
+                    m = re.match(r"\s*([\d.]+) x ([\d.]+)", val)
+                    if m:
+                        feats["size"] = [round(float(m.group(1))), round(float(m.group(2)))]
+        except Exception:
+            pass
+    feats["producer"] = re.sub(r"[\d.]+", "", feats["producer"]).strip().lower()
+    return feats
+
+def template_fingerprint(features: dict, page_no: int, text_layer: str = "") -> str:
+    """Modelo do laudo a partir de traços estáveis do arquivo + palavras-chave da camada de texto
+       (se houver). O OCR das miniaturas do localizador fica de fora: varia de uma digitalização à outra."""
+    low = (text_layer or "").lower()
+    found = [k for k in TEMPLATE_KEYWORDS if re.search(rf"(?<![a-z]){re.escape(k)}(?![a-z])", low)]
+    key = json.dumps({**features, "page": page_no, "text": bool(low.strip()),
+                      "keywords": found}, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+def strategy_plan(template: str) -> list:
+    """Estratégias aprendidas (menor custo por sucesso primeiro) seguidas das padrão."""
+    learned = []
+    try:
+        history_init()
+        with _history_conn() as conn:
+            rows = conn.execute(
+                "SELECT dpi, psms, binarize, layout FROM strategies WHERE template = ? AND successes > 0 "
+                "ORDER BY (render_s + ocr_s) / successes ASC",
+                (template,),
+            ).fetchall()
+        learned = [
+            {"dpi": r["dpi"], "psms": tuple(r["psms"].split(",")), "binarize": bool(r["binarize"]), "layout": r["layout"]}
+            for r in rows
+        ]
+    except Exception:
+        pass
+    plan = []
+    for strat in learned + DEFAULT_STRATEGIES:
+        if strat not in plan:
+            plan.append(strat)
+    return plan
+
+def strategy_record(template: str, strat: dict, ok: bool, render_s: float, ocr_s: float):
+    """Soma uma tentativa: `render_s` é o custo da renderização (e do gate) que a estratégia usou,
+       mesmo que reaproveitada de outra estratégia do mesmo DPI; `ocr_s`, só o OCR dela."""
+    try:
+        history_init()
+        with _history_conn() as conn:
+            conn.execute(
+                "INSERT INTO strategies (template, dpi, psms, binarize, layout, successes, failures, cost_s, "
+                "render_s, ocr_s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(template, dpi, psms, binarize, layout) DO UPDATE SET "
+                "successes = successes + excluded.successes, failures = failures + excluded.failures, "
+                "cost_s = cost_s + excluded.cost_s, render_s = render_s + excluded.render_s, "
+                "ocr_s = ocr_s + excluded.ocr_s",
+                (template, strat["dpi"], ",".join(strat["psms"]), int(strat["binarize"]), strat["layout"],
+                 int(ok), int(not ok), render_s + ocr_s, render_s, ocr_s),
+            )
+    except Exception:
+        pass
+
+# Correção de orientação (OSD) e inclinação (perfil de projeção) numa miniatura, antes do OCR
+ORIENT_THUMB_PX = 1200
+SKEW_MAX_DEG = 5.0
+SKEW_STEP_DEG = 0.5
+OSD_MIN_CONF = 2.0   # abaixo disso o OSD está chutando (pouco texto, tabelas): não gira a página
+
+def _row_profile_variance(img: Image.Image) -> float:
+    # média de cada linha via resize para 1 coluna; texto alinhado = linhas bem contrastadas
+    rows = list(img.resize((1, img.size[1]), Image.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((r - mean) ** 2 for r in rows) / len(rows)
+
+def estimate_orientation_skew(page: Image.Image) -> dict:
+    """Retorna {"rotate": 0/90/180/270 (horário), "skew": graus (anti-horário), "osd_conf", "ms": custo}.
+       Rotações com confiança do OSD abaixo de OSD_MIN_CONF são ignoradas."""
+    t0 = time.perf_counter()
+    # miniatura reamostrada direto da página (sem cópia em tamanho cheio)
+    ratio = min(1.0, ORIENT_THUMB_PX / max(page.size))
+    thumb = page.resize((max(1, int(page.size[0] * ratio)), max(1, int(page.size[1] * ratio))), Image.BOX)
+    if thumb.mode != "L":
+        thumb = thumb.convert("L")
+    rotate, conf = 0, 0.0
+    try:
+        with admitted("ocr"):
+            osd = pytesseract.image_to_osd(thumb, config="--psm 0")
+        rotate, conf = parse_osd(osd)
+    except Exception:
+        rotate = 0  # sem osd.traineddata ou pouco texto: assume em pé
+    if conf < OSD_MIN_CONF:
+        rotate = 0
+    if rotate:
+        thumb = thumb.rotate(-rotate, expand=True)
+    # inverte (texto claro) para a rotação não criar bordas "de texto"
+    inv = ImageOps.invert(ImageOps.autocontrast(thumb)).point(lambda p: 255 if p > 128 else 0)
+    inv.thumbnail((600, 600))
+    best, best_score = 0.0, -1.0
+    steps = int(SKEW_MAX_DEG / SKEW_STEP_DEG)
+    for i in range(-steps, steps + 1):
+        ang = i * SKEW_STEP_DEG
+        score = _row_profile_variance(inv.rotate(ang, resample=Image.BILINEAR) if ang else inv)
+        if score > best_score:
+            best, best_score = ang, score
+    return {"rotate": rotate, "skew": best, "osd_conf": conf, "ms": (time.perf_counter() - t0) * 1000}
+
+def parse_osd(osd: str) -> tuple:
+    """(rotação horária, confiança da orientação) da saída do `tesseract --psm 0`."""
+    m = re.search(r"Rotate:\s*(\d+)", osd)
+    c = re.search(r"Orientation confidence:\s*([\d.]+)", osd)
+    return (int(m.group(1)) % 360 if m else 0), (float(c.group(1)) if c else 0.0)
+
+def correct_orientation_skew(page: Image.Image, est: dict) -> Image.Image:
+    if est["rotate"]:
+        page = page.rotate(-est["rotate"], expand=True)
+    if abs(est["skew"]) >= SKEW_STEP_DEG:
+        page = page.rotate(est["skew"], resample=Image.BICUBIC, expand=True, fillcolor="white")
+    return page
+
+@shared
+def ocr_gate_stats() -> dict:
+    """Contadores do processo: custo do gate e quantas tentativas/fallbacks cada documento precisou."""
+    return {"lock": threading.Lock(), "docs": 0, "gate_ms": 0.0, "corrected": 0,
+            "attempts": 0, "defaults": 0, "rss_peak_mb": 0.0}
+
+PREVIEW_MAX_PX = 1100
+
+# Página que é só uma digitalização embutida: extrai a imagem na resolução nativa (pdfimages),
+# sem re-rasterizar/reamostrar pelo pdftoppm
+EMBED_MIN_PPI = 150
+OCR_TARGET_PPI = 720   # 400 dpi × 1.8 (super-amostragem padrão do preprocess_for_ocr)
+
+def extract_embedded_scan(pdf_path: str, page_no: int):
+    """Retorna (imagem, ppi) se a página tiver exatamente uma imagem de digitalização; senão None."""
+    if not shutil.which("pdfimages"):
+        return None
+    try:
+        res = subprocess.run(
+            ["pdfimages", "-list", "-f", str(page_no), "-l", str(page_no), pdf_path],
+            capture_output=True, timeout=20, text=True,
+        )
+    except Exception:
+        return None
+    imgs = []
+    for ln in res.stdout.splitlines()[2:]:
+        cols = ln.split()
+        if len(cols) >= 14 and cols[2] == "image":
+            try:
+                imgs.append(float(cols[12]))
+            except ValueError:
+                continue
+    if len(imgs) != 1 or imgs[0] < EMBED_MIN_PPI:
+        return None
+    with admitted("render"), tempfile.TemporaryDirectory(prefix="barrett-img-") as tmpdir:
+        try:
+            subprocess.run(
+                ["pdfimages", "-all", "-f", str(page_no), "-l", str(page_no), pdf_path, os.path.join(tmpdir, "img")],
+                capture_output=True, timeout=60, check=True,
+            )
+            files = sorted(os.listdir(tmpdir))
+            if not files:
+                return None
+            img = Image.open(os.path.join(tmpdir, files[0]))
+            img.load()
+            if img.mode not in ("L", "1"):
+                img = img.convert("L")
+        except Exception:
+            return None
+    return img, imgs[0]
+
+def try_render_and_extract(pdf_path: str, stats: dict = None):
+    """Localiza a página de biometria, identifica o modelo do laudo e tenta primeiro a estratégia
+       (DPI, PSMs, binarização) historicamente mais barata; depois a escada padrão e a 2ª melhor página.
+       Páginas sem texto com uma única digitalização usam a imagem embutida na resolução nativa (DPI ignorado).
+       A orientação/inclinação é estimada uma vez por página (miniatura) e corrigida antes do corte em metades.
+       A página fica em memória uma única vez, em tons de cinza de 8 bits, e só enquanto as estratégias
+       daquela renderização rodam (o plano é agrupado por página/DPI). O PDF é aberto uma única vez
+       (open_pdf_raster) para o localizador e todas as renderizações.
+       Retorna (pil_image, dados_dict, patient_name); `stats` recebe custo do gate, nº de tentativas,
+       rasterizador usado e tempo total de renderização."""
+    stats = stats if stats is not None else {}
+    stats.update(attempts=0, gate=None, embedded=False, render_ms=0.0)
+    with open_pdf_raster(pdf_path) as render:
+        stats["raster"] = render.backend
+        return _extract_with(pdf_path, stats, render)
+
+def _extract_with(pdf_path: str, stats: dict, render):
+    ranked, texts, text_pages = locate_biometry_pages(pdf_path, render=render)
+    template = template_fingerprint(pdf_layout_features(pdf_path, ranked[0]), ranked[0],
+                                    texts.get(ranked[0], "") if ranked[0] in text_pages else "")
+    plan = [(ranked[0], strat) for strat in strategy_plan(template)]
+    plan += [(p, DEFAULT_STRATEGIES[0]) for p in ranked[1:]]
+    first_seen = {}
+    for i, (page_no, strat) in enumerate(plan):
+        first_seen.setdefault((page_no, strat["dpi"]), i)
+    plan.sort(key=lambda item: first_seen[(item[0], item[1]["dpi"])])   # estável: mantém a ordem dentro do grupo
+
+    renders, unrotated, names, gates, embedded, tried = {}, {}, {}, {}, {}, set()
+    prep_s, ocr_memo = {}, {}   # custo de renderização+gate por página/DPI; textos de OCR já obtidos
+    preview = None   # miniatura da melhor página, para a prévia se nada for extraído
+    for (page_no, strat) in plan:
+        t0 = time.perf_counter()
+        if page_no not in embedded:
+            embedded[page_no] = None if page_no in text_pages else extract_embedded_scan(pdf_path, page_no)
+        key = (page_no, "nativo" if embedded[page_no] else strat["dpi"])
+        # com imagem nativa o DPI não muda nada: não repete a mesma combinação
+        attempt_id = (key, strat["psms"], strat["binarize"])
+        if attempt_id in tried:
+            continue
+        tried.add(attempt_id)
+        scale = 1.8
+        if embedded[page_no]:
+            scale = min(1.8, max(1.0, OCR_TARGET_PPI / embedded[page_no][1]))
+        rendered_now = key not in renders
+        if rendered_now:
+            tp = time.perf_counter()
+            renders.clear()   # renderização anterior não volta a ser usada
+            unrotated.clear()
+            ocr_memo.clear()
+            page = None
+            if embedded[page_no]:
+                page = embedded[page_no][0]
+                stats["embedded"] = True
+            else:
+                tr = time.perf_counter()
+                try:
+                    pages = render(page_no, page_no, dpi=strat["dpi"])
+                    page = pages[0] if pages else None
+                    del pages
+                except Exception:
+                    pass
+                stats["render_ms"] += (time.perf_counter() - tr) * 1000
+            if page is not None:
+                if page_no not in gates:
+                    try:
+                        gates[page_no] = estimate_orientation_skew(page)
+                    except Exception:
+                        gates[page_no] = {"rotate": 0, "skew": 0.0, "ms": 0.0}
+                if gates[page_no]["rotate"]:
+                    unrotated[key] = page   # fallback se a página girada não extrair nada
+                page = correct_orientation_skew(page, gates[page_no])
+                if preview is None and page_no == ranked[0]:
+                    ratio = min(1.0, PREVIEW_MAX_PX / max(page.size))
+                    preview = page.resize((int(page.size[0] * ratio), int(page.size[1] * ratio)), Image.BOX)
+            renders[key] = page
+            prep_s[key] = time.perf_counter() - tp
+        page = renders[key]
+        if page is None:
+            continue
+        stats["attempts"] += 1
+        stats["gate"] = stats["gate"] or gates.get(page_no)
+        # extrai nome (topo) a partir da página sem binarização forte
+        if key not in names:
+            try:
+                header_txt = ocr_top_header_get_text(page, top_ratio=0.22)
+                names[key] = extrair_patient_name_do_header(header_txt) if header_txt else ""
+            except Exception:
+                names[key] = ""
+        # extrai OD/OS por metades
+        info = {}
+        try:
+            got = extrair_biometria_dupla_por_metades(page, psms=strat["psms"], binarize=strat["binarize"],
+                                                      scale=scale, info=info,
+                                                      memo=ocr_memo.setdefault((strat["binarize"], False), {}))
+        except Exception:
+            got = {}
+        if not got and key in unrotated:
+            # o OSD pode errar (pouco texto, tabelas): tenta a página como veio, sem girar
+            try:
+                got = extrair_biometria_dupla_por_metades(unrotated[key], psms=strat["psms"],
+                                                          binarize=strat["binarize"], scale=scale, info=info,
+                                                          memo=ocr_memo.setdefault((strat["binarize"], True), {}))
+            except Exception:
+                got = {}
+            if got:
+                page = unrotated[key]
+                gates[page_no] = {**gates[page_no], "rotate": 0, "skew": 0.0}
+                stats["gate"] = gates[page_no]
+                try:
+                    header_txt = ocr_top_header_get_text(page, top_ratio=0.22)
+                    names[key] = extrair_patient_name_do_header(header_txt) if header_txt else names[key]
+                except Exception:
+                    pass
+        if page_no == ranked[0]:
+            used = {**strat, "psms": info.get("psms") or strat["psms"]} if got else strat
+            elapsed = time.perf_counter() - t0
+            strategy_record(template, used, bool(got), prep_s[key],
+                            elapsed - (prep_s[key] if rendered_now else 0.0))
+        if got:
+            _gate_stats_add(stats, ok=True)
+            return page, got, names[key]
+        # se não conseguiu, continua para próximo fallback
+    # nenhuma extração: ao menos devolve a melhor página (miniatura) para prévia
+    _gate_stats_add(stats, ok=False)
+    return preview, {}, ""
+
+def _gate_stats_add(stats: dict, ok: bool):
+    agg = ocr_gate_stats()
+    gate = stats.get("gate") or {"rotate": 0, "skew": 0.0, "ms": 0.0}
+    with agg["lock"]:
+        agg["docs"] += 1
+        agg["gate_ms"] += gate["ms"]
+        agg["corrected"] += int(bool(gate["rotate"]) or abs(gate["skew"]) >= SKEW_STEP_DEG)
+        agg["attempts"] += stats["attempts"]
+        agg["defaults"] += int(not ok)
+
+def extract_document(doc_hash: str, kind: str = "pdf", file_name: str = None) -> dict:
+    """Extração completa de um arquivo do spool: exportação estruturada (parse direto), PDF já visto
+       (histórico, sem OCR) ou PDF novo (localizador + OCR, gravado no histórico se extrair).
+       Retorna {"page", "dados", "patient", "stats", "from_history", "records"}."""
+    path = spool_path(doc_hash, kind)
+    if kind != "pdf":
+        t0 = time.perf_counter()
+        try:
+            records = list(islice(iter_structured_records(path, kind), STRUCT_MAX_RECORDS))
+            error = None
+        except Exception as e:
+            records, error = [], f"{type(e).__name__}: {e}"
+        stats = {"kind": kind, "parse_ms": (time.perf_counter() - t0) * 1000, "error": error}
+        first = records[0] if records else {"dados": {}, "patient": ""}
+        return {"page": None, "dados": first["dados"], "patient": first["patient"], "stats": stats,
+                "from_history": False, "records": records}
+    salvo = history_get_document(doc_hash)
+    if salvo:
+        # PDF já processado antes: reaproveita a biometria sem OCR
+        return {"page": None, "dados": salvo[0], "patient": salvo[1], "stats": {}, "from_history": True,
+                "records": None}
+    stats = {}
+    with rss_peak(stats):
+        page, dados, patient = try_render_and_extract(path, stats)
+    if "rss_peak_mb" in stats:
+        agg = ocr_gate_stats()
+        with agg["lock"]:
+            agg["rss_peak_mb"] = max(agg["rss_peak_mb"], stats["rss_peak_mb"])
+    if dados:
+        history_save_document(doc_hash, file_name, dados, patient)
+    return {"page": page, "dados": dados, "patient": patient, "stats": stats, "from_history": False,
+            "records": None}
+
+# =========================
+# Calculadora (Selenium)
+# =========================
+# Lê as duas GridViews numa única chamada ao navegador (em vez de 1 round trip por célula)
+_GRIDS_JS = """
+const out = {};
+for (const [eye, id] of [["OD", "MainContent_GridView1"], ["OS", "MainContent_GridView2"]]) {
+    const t = document.getElementById(id);
+    out[eye] = t ? Array.from(t.rows).slice(1).map(r => Array.from(r.cells).map(c => c.textContent.trim())) : [];
+}
+return out;
+"""
+
+def _num_or_text(s: str):
+    txt = str(s).replace("\u2212", "-").replace(",", ".").strip()
+    try:
+        return float(txt)
+    except ValueError:
+        return s.strip()
+
+def parse_grid_rows(cells: list) -> list:
+    out = []
+    for tds in cells:
+        if len(tds) >= 3:
+            out.append({
+                "IOL Power": _num_or_text(tds[0]),
+                "Optic": _num_or_text(tds[1]),
+                "Refraction": _num_or_text(tds[2]),
+            })
+    return out
+
+def fetch_result_tables(driver) -> dict:
+    grids = driver.execute_script(_GRIDS_JS) or {}
+    return {"OD": parse_grid_rows(grids.get("OD", [])), "OS": parse_grid_rows(grids.get("OS", []))}
+
+# Perfil enxuto: só os hosts da calculadora são acessíveis; perfil/cache em tmpfs
+def _lean_profile_dir() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+    return tempfile.mkdtemp(prefix="barrett-profile-", dir=base)
+
+def _firefox_pac_url() -> str:
+    # PAC: hosts da calculadora vão direto; o resto cai num proxy inexistente (bloqueado)
+    allowed = " || ".join(f"dnsDomainIs(h, '{h}')" for h in CALC_HOSTS)
+    pac = f"function FindProxyForURL(u, h) {{ return ({allowed}) ? 'DIRECT' : 'PROXY 127.0.0.1:9'; }}"
+    return "data:text/javascript," + pac
+
+def _quit_driver(driver):
+    if driver is None:
+        return
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    profile_dir = getattr(driver, "_barrett_profile_dir", None)
+    if profile_dir:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+def _browser_rss_mb(driver):
+    """Soma o RSS (MB) do driver + processos filhos do navegador via /proc (Linux)."""
+    try:
+        root = driver.service.process.pid
+    except Exception:
+        return None
+    if not os.path.isdir("/proc"):
+        return None
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except Exception:
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total_kb, stack = 0, [root]
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for ln in f:
+                    if ln.startswith("VmRSS:"):
+                        total_kb += int(ln.split()[1])
+                        break
+        except Exception:
+            continue
+    return total_kb / 1024.0
+
+def build_firefox(headless_flag: bool, lean: bool = False):
+    opts = webdriver.FirefoxOptions()
+    if headless_flag:
+        opts.add_argument("-headless")
+    profile_dir = None
+    if lean:
+        opts.page_load_strategy = "eager"
+        profile_dir = _lean_profile_dir()
+        opts.add_argument("-profile")
+        opts.add_argument(profile_dir)
+        for key, val in {
+            "permissions.default.image": 2,
+            "gfx.downloadable_fonts.enabled": False,
+            "browser.display.use_document_fonts": 0,
+            "network.proxy.type": 2,
+            "network.proxy.autoconfig_url": _firefox_pac_url(),
+            "network.prefetch-next": False,
+            "network.dns.disablePrefetch": True,
+            "toolkit.telemetry.enabled": False,
+            "toolkit.telemetry.unified": False,
+            "datareporting.healthreport.uploadEnabled": False,
+            "datareporting.policy.dataSubmissionEnabled": False,
+            "app.update.auto": False,
+            "app.normandy.enabled": False,
+            "extensions.enabledScopes": 0,
+            "extensions.update.enabled": False,
+            "browser.safebrowsing.malware.enabled": False,
+            "browser.safebrowsing.phishing.enabled": False,
+            "browser.cache.disk.parent_directory": profile_dir,
+            "media.autoplay.default": 5,
+        }.items():
+            opts.set_preference(key, val)
+    pinned = _pinned_binaries("Firefox")
+    if pinned.get("browser_path"):
+        opts.binary_location = pinned["browser_path"]
+    if pinned.get("driver_path"):
+        service = FirefoxService(executable_path=pinned["driver_path"])
+    else:
+        service = FirefoxService()  # Selenium Manager resolve geckodriver
+    try:
+        driver = webdriver.Firefox(service=service, options=opts)
+    except Exception:
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+        raise
+    driver._barrett_profile_dir = profile_dir
+    return driver
+
+def build_chrome(headless_flag: bool, lean: bool = False):
+    opts = webdriver.ChromeOptions()
+    if headless_flag:
+        opts.add_argument("--headless=new")
+    profile_dir = None
+    if lean:
+        opts.page_load_strategy = "eager"
+        profile_dir = _lean_profile_dir()
+        opts.add_argument(f"--user-data-dir={profile_dir}")
+        opts.add_argument(f"--disk-cache-dir={os.path.join(profile_dir, 'cache')}")
+        opts.add_argument("--blink-settings=imagesEnabled=false")
+        excl = ", ".join(f"EXCLUDE {h}" for h in CALC_HOSTS)
+        opts.add_argument(f"--host-resolver-rules=MAP * ~NOTFOUND , {excl}")
+        opts.add_argument("--disable-extensions")
+        opts.add_argument("--disable-component-update")
+        opts.add_argument("--disable-background-networking")
+        opts.add_argument("--disable-sync")
+        opts.add_argument("--disable-default-apps")
+        opts.add_argument("--metrics-recording-only")
+        opts.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "webkit.webprefs.remote_fonts_enabled": False,
+        })
+    opts.add_argument("--disable-gpu")
+    opts.add_argument("--no-sandbox")
+    opts.add_argument("--disable-dev-shm-usage")
+    opts.add_argument("--window-size=1280,1000")
+    opts.add_argument("--disable-software-rasterizer")
+    opts.add_argument("--no-first-run")
+    opts.add_argument("--no-default-browser-check")
+    opts.add_argument("--remote-allow-origins=*")
+    pinned = _pinned_binaries("Chrome")
+    if pinned.get("browser_path"):
+        opts.binary_location = pinned["browser_path"]
+    try:
+        driver_path = pinned.get("driver_path")
+        if not driver_path:
+            driver_path = _resolve_browser("Chrome", pinned.get("browser_path"))["driver_path"]
+        service = ChromeService(executable_path=driver_path, env=_driver_env())
+        driver = webdriver.Chrome(service=service, options=opts)
+    except Exception:
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+        raise
+    driver._barrett_profile_dir = profile_dir
+    return driver
+
+# Abertura do navegador até a calculadora pronta: estatística por navegador + corrida (hedge) opcional
+HEDGE_DELAY_S = 4.0           # sem a página pronta nesse prazo, o outro navegador começa em paralelo
+BROWSER_STATS_WINDOW = 30     # últimas aberturas consideradas por navegador
+BROWSERS = ("Firefox", "Chrome")
+
+class BrowserLaunchFailed(RuntimeError):
+    pass
+
+@shared
+def browser_stats() -> dict:
+    return {"lock": threading.Lock(),
+            "browsers": {b: {"ready_s": deque(maxlen=BROWSER_STATS_WINDOW), "launches": 0, "failures": 0,
+                             "hedge_wins": 0} for b in BROWSERS}}
+
+def _record_startup(browser: str, ready_s: float = None):
+    # estatística nunca pode virar falha da tentativa (seria contada contra a calculadora)
+    try:
+        stats = browser_stats()
+        with stats["lock"]:
+            b = stats["browsers"].setdefault(browser, {"launches": 0, "failures": 0, "hedge_wins": 0,
+                                                       "ready_s": deque(maxlen=BROWSER_STATS_WINDOW)})
+            b["launches"] += 1
+            b["failures"] += int(ready_s is None)
+            if ready_s is not None:
+                b["ready_s"].append(ready_s)
+    except Exception:
+        pass
+
+def startup_summary() -> dict:
+    """Por navegador: nº de aberturas, falhas, vitórias na corrida e mediana/p90 do tempo até a página pronta."""
+    stats = browser_stats()
+    out = {}
+    with stats["lock"]:
+        for name, b in stats["browsers"].items():
+            vals = sorted(b["ready_s"])
+            out[name] = {
+                "launches": b["launches"], "failures": b["failures"], "hedge_wins": b["hedge_wins"],
+                "median_s": vals[len(vals) // 2] if vals else None,
+                "p90_s": vals[min(len(vals) - 1, int(len(vals) * 0.9))] if vals else None,
+            }
+    return out
+
+def preferred_browser(default: str = "Firefox") -> str:
+    """Navegador com menor custo esperado até a calculadora pronta (falha custa o timeout inteiro).
+       Sem amostras dos dois, fica o padrão."""
+    penalty = CALC_STAGE_TIMEOUTS["page_load"] * 2
+    costs = {}
+    for name, s in startup_summary().items():
+        if s["launches"] and s["median_s"] is not None:
+            fail_rate = s["failures"] / s["launches"]
+            costs[name] = s["median_s"] * (1 - fail_rate) + penalty * fail_rate
+        elif s["launches"]:
+            costs[name] = penalty
+    if len(costs) < len(BROWSERS):
+        return default
+    return min(costs, key=costs.get)
+
+def open_calculator(choice: str, headless: bool, lean: bool) -> tuple:
+    """Abre o navegador e carrega a calculadora. Retorna (driver, carga_da_página_s).
+       Falha ao abrir o navegador vira BrowserLaunchFailed; falha de carga propaga como veio."""
+    t0 = time.perf_counter()
+    try:
+        driver = build_firefox(headless, lean) if choice == "Firefox" else build_chrome(headless, lean)
+    except Exception as e:
+        _record_startup(choice)
+        raise BrowserLaunchFailed(f"{choice}: {e}") from e
+    try:
+        driver.set_page_load_timeout(CALC_STAGE_TIMEOUTS["page_load"])
+        t1 = time.perf_counter()
+        driver.get(CALC_URL)
+        WebDriverWait(driver, CALC_STAGE_TIMEOUTS["page_load"]).until(
+            EC.presence_of_element_located((By.ID, "MainContent_DoctorName"))
+        )
+        page_load_s = time.perf_counter() - t1
+        _record_startup(choice, time.perf_counter() - t0)
+    except Exception:
+        _record_startup(choice)
+        _quit_driver(driver)
+        raise
+    return driver, page_load_s
+
+def _discard_when_done(fut, spare: bool):
+    """Perdedor da corrida: fecha o navegador assim que ele terminar de abrir e devolve a vaga extra."""
+    def _cleanup(f):
+        if not f.cancelled() and f.exception() is None:
+            _quit_driver(f.result()[0])
+        if spare:
+            release("browser")
+    fut.add_done_callback(_cleanup)
+
+def hedged_open_calculator(preferred: str, headless: bool, lean: bool) -> tuple:
+    """Corrida: o preferido começa; se não estiver pronto em HEDGE_DELAY_S (ou falhar), o outro começa
+       também. O primeiro a ter a calculadora carregada vence; o outro é encerrado.
+       O 2º navegador simultâneo só roda se houver vaga livre no controle de admissão."""
+    other = next(b for b in BROWSERS if b != preferred)
+    ex = ThreadPoolExecutor(max_workers=2, thread_name_prefix="barrett-hedge")
+    try:
+        first = ex.submit(open_calculator, preferred, headless, lean)
+        futs = {first: preferred}
+        spare = False
+        done, _ = futures_wait([first], timeout=HEDGE_DELAY_S)
+        if not done:
+            spare = try_admit("browser")
+            if spare:
+                futs[ex.submit(open_calculator, other, headless, lean)] = other
+
+        errors, pending = [], set(futs)
+        while pending:
+            done, pending = futures_wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((f for f in done if f.exception() is None), None)
+            errors += [f.exception() for f in done if f.exception() is not None]
+            if winner is None:
+                if not pending and len(futs) == 1:
+                    # preferido falhou sem reserva rodando: o outro usa a vaga que ele liberou
+                    f = ex.submit(open_calculator, other, headless, lean)
+                    futs[f] = other
+                    pending = {f}
+                continue
+            for f in done:
+                if f is not winner and f.exception() is None:
+                    _quit_driver(f.result()[0])
+            for f in pending:
+                _discard_when_done(f, spare)
+            if spare and not pending:
+                release("browser")
+            driver, page_load_s = winner.result()
+            if futs[winner] != preferred:
+                with browser_stats()["lock"]:
+                    browser_stats()["browsers"][futs[winner]]["hedge_wins"] += 1
+            return driver, futs[winner], page_load_s
+        if spare:
+            release("browser")
+        # a falha de carga (calculadora) tem prioridade sobre a falha de abrir o navegador
+        raise next((e for e in errors if not isinstance(e, BrowserLaunchFailed)), errors[-1])
+    finally:
+        ex.shutdown(wait=False)
+
+# Disjuntor (circuit breaker) compartilhado entre sessões para a calculadora
+CALC_FAILURE_THRESHOLD = 3     # falhas seguidas para abrir o circuito
+CALC_OPEN_S = 60               # tempo aberto antes de liberar uma sonda (half-open)
+CALC_PROBE_TIMEOUT_S = 5       # sonda HTTP antes de abrir navegador
+CALC_STAGE_TIMEOUTS = {"page_load": 15, "fill": 10, "results": 20}
+CALC_MAX_ATTEMPTS = 2
+CALC_BACKOFF_S = 1.0
+
+class CalculatorUnavailable(RuntimeError):
+    pass
+
+@shared
+def calc_breaker() -> dict:
+    return {"lock": threading.Lock(), "state": "closed", "failures": 0, "opened_at": 0.0, "probing": False,
+            "last_error": ""}
+
+def breaker_allow() -> bool:
+    """Fechado: libera. Aberto: recusa até CALC_OPEN_S; depois libera uma única sonda (half-open)."""
+    br = calc_breaker()
+    with br["lock"]:
+        if br["state"] == "closed":
+            return True
+        if br["state"] == "open" and time.time() - br["opened_at"] >= CALC_OPEN_S:
+            br["state"] = "half_open"
+        if br["state"] == "half_open" and not br["probing"]:
+            br["probing"] = True
+            return True
+        return False
+
+def breaker_success():
+    br = calc_breaker()
+    with br["lock"]:
+        br.update(state="closed", failures=0, probing=False, last_error="")
+
+def breaker_failure(err: Exception):
+    br = calc_breaker()
+    with br["lock"]:
+        br["failures"] += 1
+        br["last_error"] = str(err)[:200]
+        if br["state"] == "half_open" or br["failures"] >= CALC_FAILURE_THRESHOLD:
+            br.update(state="open", opened_at=time.time(), probing=False)
+
+def breaker_release():
+    # tentativa terminou sem veredito sobre a calculadora (ex.: navegador não abriu)
+    br = calc_breaker()
+    with br["lock"]:
+        br["probing"] = False
+
+def probe_calculator():
+    """GET rápido na calculadora: falha aqui evita abrir um navegador à toa.
+       Só 5xx, timeout e erro de conexão contam; um 4xx (WAF, bloqueio de robô, limite de taxa)
+       mostra que o servidor responde, e o navegador de verdade pode passar onde o urllib não passa."""
+    req = urllib.request.Request(CALC_URL, headers={"User-Agent": "barrett-autofill"})
+    try:
+        with urllib.request.urlopen(req, timeout=CALC_PROBE_TIMEOUT_S):
+            pass
+    except urllib.error.HTTPError as e:   # o urlopen levanta HTTPError para todo status >= 400
+        e.close()
+        if e.code >= 500:
+            raise CalculatorUnavailable(f"HTTP {e.code}") from e
+
+def calc_cache_key(inputs: dict) -> str:
+    # nomes de médico/paciente não mudam as tabelas
+    relevant = {k: v for k, v in inputs.items() if k not in ("doctor", "patient")}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+# Formulário da calculadora: (chave em inputs, olho ou None, id do campo)
+CALC_FORM_IDS = [
+    ("doctor", None, "MainContent_DoctorName"),
+    ("patient", None, "MainContent_PatientName"),
+    ("AL", "OD", "MainContent_Axlength"),
+    ("K1", "OD", "MainContent_MeasuredK1"),
+    ("K2", "OD", "MainContent_MeasuredK2"),
+    ("ACD", "OD", "MainContent_OpticalACD"),
+    ("AL", "OS", "MainContent_Axlength0"),
+    ("K1", "OS", "MainContent_MeasuredK10"),
+    ("K2", "OS", "MainContent_MeasuredK20"),
+    ("ACD", "OS", "MainContent_OpticalACD0"),
+]
+CALC_CONST_IDS = {"a_constant": "MainContent_Aconstant", "lens_factor": "MainContent_LensFactor"}
+CALC_CONST_BY_TIPO = {"A-constant": "a_constant", "Lens Factor": "lens_factor"}
+
+def _form_value(inputs: dict, key: str, eye: str = None):
+    return inputs[eye][key] if eye else inputs[key]
+
+def _page_constants(inputs: dict, defaults: dict) -> dict:
+    """Constantes que ficam na página: as da LIO, com a constante manual do tipo escolhido por cima."""
+    consts = dict(defaults)
+    active = CALC_CONST_BY_TIPO.get(inputs["const_tipo"])
+    if active and inputs[active]:
+        consts[active] = inputs[active]
+    return consts
+
+def _fill_calculator(driver, inputs: dict, prev: dict = None, defaults: dict = None) -> dict:
+    """Preenche o formulário. Com `prev` (entradas já na página) só reenvia os campos que mudaram.
+       Retorna as constantes da LIO lidas da página (para desfazer uma constante manual depois)."""
+    wait = WebDriverWait(driver, CALC_STAGE_TIMEOUTS["fill"])
+
+    def fill_by_id(elem_id, value):
+        el = wait.until(EC.presence_of_element_located((By.ID, elem_id)))
+        el.clear()
+        el.send_keys(str(value))
+
+    for key, eye, elem_id in CALC_FORM_IDS:
+        value = _form_value(inputs, key, eye)
+        if prev is None or _form_value(prev, key, eye) != value:
+            fill_by_id(elem_id, value)
+
+    # Modelo de LIO (se houver): o postback da troca recarrega as constantes da lente
+    if prev is None or inputs["iol"] != prev["iol"]:
+        if prev is not None and inputs["iol"] == IOL_PLACEHOLDER["label"]:
+            raise RuntimeError("LIO removida: a página precisa ser recarregada")
+        if inputs["iol"] != IOL_PLACEHOLDER["label"]:
+            try:
+                sel_el = wait.until(EC.presence_of_element_located((By.ID, "MainContent_IOLModel")))
+                Select(sel_el).select_by_visible_text(inputs["iol"])
+                WebDriverWait(driver, 6).until(EC.staleness_of(sel_el))
+            except Exception:
+                pass
+        defaults = {}
+        for key, elem_id in CALC_CONST_IDS.items():
+            try:
+                defaults[key] = driver.find_element(By.ID, elem_id).get_attribute("value") or ""
+            except Exception:
+                pass
+        on_page = dict(defaults)
+    else:
+        on_page = _page_constants(prev, defaults or {})
+
+    # Constantes manuais (sobrescrevem); ao trocar o tipo, a outra volta ao valor da LIO
+    wanted = _page_constants(inputs, defaults)
+    for key, elem_id in CALC_CONST_IDS.items():
+        if wanted.get(key) != on_page.get(key):
+            if wanted.get(key) is None:
+                raise RuntimeError(f"valor da LIO para {key} desconhecido")
+            fill_by_id(elem_id, wanted[key])
+    return defaults
+
+def _submit_and_fetch(driver) -> tuple:
+    """Calcular → aba Universal Formula → tabelas. Retorna (tabelas, leitura_ms)."""
+    wait = WebDriverWait(driver, CALC_STAGE_TIMEOUTS["fill"])
+    old_panel = driver.find_elements(By.ID, "MainContent_Panel14")
+    wait.until(EC.element_to_be_clickable((By.ID, "MainContent_Button1"))).click()
+    # Aba Universal Formula
+    driver.execute_script("__doPostBack('ctl00$MainContent$menuTabs','1');")
+
+    # Tabelas (na página ao vivo, só depois de o painel anterior ser substituído)
+    results_wait = WebDriverWait(driver, CALC_STAGE_TIMEOUTS["results"])
+    if old_panel:
+        results_wait.until(EC.staleness_of(old_panel[0]))
+    results_wait.until(EC.presence_of_element_located((By.ID, "MainContent_Panel14")))
+    t1 = time.perf_counter()
+    tables = fetch_result_tables(driver)
+    return tables, (time.perf_counter() - t1) * 1000
+
+# Calculadora ao vivo: a página preenchida fica aberta para a sessão; a próxima execução
+# reenvia só os campos alterados (um postback em vez de navegador + carga + formulário inteiro)
+LIVE_IDLE_S = 5 * 60      # ociosa por mais que isso: fechada
+LIVE_YIELD_S = 20         # com alguém na fila por navegador, cede a vaga bem antes
+LIVE_REAP_EVERY_S = 5
+
+def _copy_inputs(inputs: dict) -> dict:
+    return {**inputs, "OD": dict(inputs["OD"]), "OS": dict(inputs["OS"])}
+
+@shared
+def live_calculators() -> dict:
+    reg = {"lock": threading.Lock(), "items": {}}
+    threading.Thread(target=_live_reaper, args=(reg,), daemon=True, name="barrett-live-reaper").start()
+    return reg
+
+def _live_close(ctx: dict):
+    _quit_driver(ctx["driver"])
+    release("browser")
+
+def _live_reaper(reg: dict):
+    while True:
+        time.sleep(LIVE_REAP_EVERY_S)
+        gov = governor()
+        with gov["cond"]:
+            waiting = bool(gov["pools"]["browser"]["queue"])
+        limit = LIVE_YIELD_S if waiting else LIVE_IDLE_S
+        now = time.time()
+        expired = []
+        with reg["lock"]:
+            for sid, ctx in list(reg["items"].items()):
+                # em uso agora: fica para a próxima volta
+                if now - ctx["last_used"] > limit and ctx["lock"].acquire(blocking=False):
+                    expired.append(reg["items"].pop(sid))
+        for ctx in expired:
+            try:
+                _live_close(ctx)
+            finally:
+                ctx["lock"].release()
+
+def live_close(sid: str):
+    reg = live_calculators()
+    with reg["lock"]:
+        ctx = reg["items"].pop(sid, None)
+    if ctx:
+        with ctx["lock"]:
+            _live_close(ctx)
+
+def live_info(sid: str):
+    """{"browser", "idle_s", "runs"} da calculadora ao vivo da sessão, ou None."""
+    reg = live_calculators()
+    with reg["lock"]:
+        ctx = reg["items"].get(sid)
+        if ctx is None:
+            return None
+        return {"browser": ctx["browser"], "idle_s": time.time() - ctx["last_used"], "runs": ctx["runs"]}
+
+def _live_store(sid: str, ctx: dict):
+    # a vaga do navegador passa a ser da sessão; sem vaga livre (ou com fila), fecha como sempre
+    if not try_admit("browser"):
+        _quit_driver(ctx["driver"])
+        return
+    ctx.update(lock=threading.Lock(), last_used=time.time(), runs=0)
+    reg = live_calculators()
+    with reg["lock"]:
+        old = reg["items"].pop(sid, None)
+        reg["items"][sid] = ctx
+    if old:
+        with old["lock"]:
+            _live_close(old)
+
+def _live_run(sid: str, inputs: dict, opts: tuple):
+    """Reaproveita a página ao vivo da sessão. Retorna (tabelas, navegador) ou None (execução completa)."""
+    reg = live_calculators()
+    with reg["lock"]:
+        ctx = reg["items"].get(sid)
+        if ctx is None or not ctx["lock"].acquire(blocking=False):
+            return None
+    try:
+        if ctx["opts"] != opts:
+            raise RuntimeError("navegador/perfil mudou")
+        driver = ctx["driver"]
+        form = driver.find_elements(By.ID, "MainContent_Axlength")
+        if not form or not form[0].is_displayed():
+            # volta para a aba do formulário (o ViewState mantém o que já foi preenchido)
+            driver.execute_script("__doPostBack('ctl00$MainContent$menuTabs','0');")
+            WebDriverWait(driver, CALC_STAGE_TIMEOUTS["page_load"]).until(
+                EC.visibility_of_element_located((By.ID, "MainContent_Axlength"))
+            )
+        ctx["defaults"] = _fill_calculator(driver, inputs, ctx["inputs"], ctx["defaults"])
+        tables, _ = _submit_and_fetch(driver)
+        ctx.update(inputs=_copy_inputs(inputs), last_used=time.time(), runs=ctx["runs"] + 1)
+    except Exception:
+        with reg["lock"]:
+            if reg["items"].get(sid) is ctx:
+                reg["items"].pop(sid)
+        _live_close(ctx)
+        return None
+    finally:
+        ctx["lock"].release()
+    breaker_success()
+    calc_cache_put(inputs, tables, ctx["browser"])
+    return tables, f"{ctx['browser']} · ao vivo"
+
+def run_selenium_and_fetch(preferred: str, inputs: dict, headless: bool = True, lean: bool = False,
+                           on_metrics=None, hedge: bool = False, live_sid: str = None, speculative: bool = False):
+    """Preenche a calculadora com `inputs` e devolve (tabelas, navegador usado).
+       `on_metrics(navegador, carga_s, rss_mb, leitura_ms)` recebe as medidas da execução bem-sucedida.
+       Com `hedge`, cada tentativa é uma corrida entre os dois navegadores (hedged_open_calculator).
+       Com `live_sid`, a página preenchida fica aberta para essa sessão e as próximas chamadas só
+       reenviam os campos alterados; qualquer falha na página ao vivo cai para a execução completa.
+       Com `speculative` (pré-cálculo), nada conta para o disjuntor (nem sucesso, nem falha, nem a
+       sonda do meio-aberto) e, antes de cada tentativa, a execução cede a vez (retorna None) se houver
+       execução real, o disjuntor não estiver fechado ou o resultado já estiver em cache."""
+    if preferred not in BROWSERS:
+        raise ValueError(f"Navegador desconhecido: {preferred}")
+    if speculative:
+        if _spec_should_yield(inputs):
+            return None
+    elif not breaker_allow():
+        br = calc_breaker()
+        resta = max(0, CALC_OPEN_S - (time.time() - br["opened_at"]))
+        raise CalculatorUnavailable(f"Calculadora indisponível (nova tentativa em ~{resta:.0f} s). {br['last_error']}")
+    opts = (preferred, headless, lean)
+    if live_sid:
+        got = _live_run(live_sid, inputs, opts)
+        if got:
+            return got
+    try:
+        probe_calculator()
+    except Exception as e:
+        if not speculative:
+            breaker_failure(e)
+        raise CalculatorUnavailable(f"Calculadora indisponível: {e}") from e
+
+    last_error = None
+    calc_failed = False
+    result = kept = None
+    order = ([preferred] + (["Firefox", "Chrome"] if preferred == "Chrome" else ["Chrome"]))[:CALC_MAX_ATTEMPTS]
+    # um navegador por vez por execução; a fila limita quantos existem no servidor inteiro
+    with admitted("browser"):
+        for attempt, choice in enumerate(order):
+            if attempt:
+                time.sleep(CALC_BACKOFF_S * 2 ** (attempt - 1))
+            if speculative and _spec_should_yield(inputs):
+                break   # a fila do navegador e o backoff levam tempo: reavalia a cada tentativa
+            driver = None
+            stage = "open"
+            try:
+                if hedge:
+                    driver, choice, page_load_s = hedged_open_calculator(preferred, headless, lean)
+                else:
+                    driver, page_load_s = open_calculator(choice, headless, lean)
+
+                stage = "fill"
+                defaults = _fill_calculator(driver, inputs)
+
+                # Calcular
+                stage = "results"
+                tables, extract_ms = _submit_and_fetch(driver)
+
+                if on_metrics:
+                    on_metrics(choice, page_load_s, _browser_rss_mb(driver), extract_ms)
+                if live_sid:
+                    kept = {"driver": driver, "browser": choice, "inputs": _copy_inputs(inputs),
+                            "defaults": defaults, "opts": opts}
+                else:
+                    _quit_driver(driver)
+                if not speculative:
+                    breaker_success()
+                calc_cache_put(inputs, tables, choice)
+                result = (tables, choice)
+                break
+
+            except Exception as e:
+                last_error = e
+                _quit_driver(driver)
+                if stage == "open":
+                    stage = "launch" if isinstance(e, BrowserLaunchFailed) else "page_load"
+                # só conta contra a calculadora o que aconteceu depois de o navegador abrir
+                if stage in ("page_load", "results"):
+                    calc_failed = True
+                    if speculative:
+                        break   # especulação não insiste com a calculadora instável
+                    breaker_failure(e)
+                    if not breaker_allow():
+                        break
+                continue
+    if result:
+        if kept:
+            _live_store(live_sid, kept)
+        return result
+    if speculative:
+        if last_error is None:
+            return None
+    elif not calc_failed:
+        breaker_release()
+    raise last_error or RuntimeError("Falha ao iniciar navegador")
+
+# Cache por entrada (compartilhado) + pré-cálculo especulativo das LIOs mais usadas
+CALC_CACHE_MAX = 200
+SPEC_DEFAULT_IOLS = ["Alcon SN60WF", "J&J ZCB00", "Rayner RayOne EMV"]
+SPEC_MAX_LENSES = 3      # LIOs especuladas por biometria
+SPEC_MAX_PENDING = 6     # teto global de jobs especulativos na fila
+
+@shared
+def calc_result_cache() -> dict:
+    return {"lock": threading.Lock(), "items": OrderedDict()}
+
+def calc_cache_get(inputs: dict):
+    cache = calc_result_cache()
+    key = calc_cache_key(inputs)
+    with cache["lock"]:
+        hit = cache["items"].get(key)
+        if hit:
+            cache["items"].move_to_end(key)
+        return hit
+
+def calc_cache_same_biometry(inputs: dict) -> list:
+    """Todos os resultados em cache com a mesma biometria (qualquer LIO/constante)."""
+    cache = calc_result_cache()
+    with cache["lock"]:
+        items = list(cache["items"].values())
+    return [(inp, tables) for tables, _, inp in items if inp["OD"] == inputs["OD"] and inp["OS"] == inputs["OS"]]
+
+def calc_cache_put(inputs: dict, tables: dict, browser: str):
+    cache = calc_result_cache()
+    with cache["lock"]:
+        cache["items"][calc_cache_key(inputs)] = (tables, browser, inputs)
+        while len(cache["items"]) > CALC_CACHE_MAX:
+            cache["items"].popitem(last=False)
+
+@shared
+def spec_pool() -> dict:
+    # 1 worker: especulação nunca ocupa mais de um navegador
+    return {"executor": ThreadPoolExecutor(max_workers=1, thread_name_prefix="barrett-spec"),
+            "lock": threading.Lock(), "pending": 0, "real_runs": 0, "submitted": set()}
+
+def _spec_should_yield(inputs: dict) -> bool:
+    # cede a vez a execuções reais e não insiste com a calculadora instável
+    return bool(spec_pool()["real_runs"] or calc_breaker()["state"] != "closed" or calc_cache_get(inputs))
+
+def _spec_job(preferred: str, inputs: dict, headless: bool, lean: bool):
+    pool = spec_pool()
+    try:
+        run_selenium_and_fetch(preferred, inputs, headless=headless, lean=lean, speculative=True)
+    except Exception:
+        pass
+    finally:
+        with pool["lock"]:
+            pool["pending"] -= 1
+
+def speculate_likely_lenses(preferred: str, base_inputs: dict, headless: bool = True, lean: bool = False):
+    """Agenda as LIOs mais usadas para esta biometria (uma vez por combinação de entradas)."""
+    pool = spec_pool()
+    presets = iol_catalog()["by_label"]
+    ranked = history_top_iols(SPEC_MAX_LENSES)
+    ranked += [lab for lab in SPEC_DEFAULT_IOLS if lab not in ranked]
+    for label in ranked[:SPEC_MAX_LENSES]:
+        preset = presets.get(label)
+        if not preset:
+            continue
+        inputs = {**base_inputs, "iol": label,
+                  "a_constant": preset.get("a_constant", "") or "", "lens_factor": preset.get("lens_factor", "") or ""}
+        key = calc_cache_key(inputs)
+        with pool["lock"]:
+            if key in pool["submitted"] or pool["pending"] >= SPEC_MAX_PENDING:
+                continue
+            if len(pool["submitted"]) > CALC_CACHE_MAX:
+                pool["submitted"].clear()
+            pool["submitted"].add(key)
+            pool["pending"] += 1
+        pool["executor"].submit(_spec_job, preferred, inputs, headless, lean)
+
+# =========================
+# Refração alvo: solver vetorizado sobre várias tabelas de resultado
+# =========================
+def tables_to_arrays(results: list, eye: str) -> tuple:
+    """Empilha as linhas (IOL Power, Refraction) de vários resultados em matrizes [n_resultados, n_linhas]
+       ordenadas por poder; células faltantes/texto viram NaN."""
+    rows = []
+    for tables in results:
+        pares = [(r["IOL Power"], r["Refraction"]) for r in (tables.get(eye) or [])
+                 if isinstance(r.get("IOL Power"), float) and isinstance(r.get("Refraction"), float)]
+        rows.append(sorted(pares))
+    width = max((len(r) for r in rows), default=0)
+    power = np.full((len(rows), max(width, 1)), np.nan)
+    refr = np.full_like(power, np.nan)
+    for i, pares in enumerate(rows):
+        if pares:
+            power[i, :len(pares)], refr[i, :len(pares)] = zip(*pares)
+    return power, refr
+
+def solve_target(power: np.ndarray, refr: np.ndarray, target: float) -> dict:
+    """Para cada resultado: poder com refração mais próxima do alvo (linha da tabela) e poder
+       interpolado linearmente entre as duas linhas que cercam o alvo (NaN se o alvo não é cercado)."""
+    d = refr - target
+    absd = np.where(np.isnan(d), np.inf, np.abs(d))
+    idx = np.argmin(absd, axis=1)
+    rows = np.arange(power.shape[0])
+    nearest_power = power[rows, idx]
+    nearest_refr = refr[rows, idx]
+    nearest_err = np.where(np.isinf(absd[rows, idx]), np.nan, absd[rows, idx])
+
+    interp_power = np.full(power.shape[0], np.nan)
+    if power.shape[1] >= 2:
+        # com 0/1 linha por resultado não há par de linhas para cercar o alvo
+        d0, d1 = d[:, :-1], d[:, 1:]
+        p0, p1 = power[:, :-1], power[:, 1:]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bracket = (d0 * d1 <= 0) & (d0 != d1)
+            frac = d0 / (d0 - d1)
+            interp = p0 + (p1 - p0) * frac
+        has = bracket.any(axis=1)
+        first = np.argmax(bracket, axis=1)
+        interp_power = np.where(has, interp[rows, first], np.nan)
+    return {"nearest_power": nearest_power, "nearest_refr": nearest_refr, "nearest_err": nearest_err,
+            "interp_power": interp_power}
+
+def rank_lenses(results: list, labels: list, target_od: float, target_os: float) -> list:
+    """Uma única conta para todas as combinações LIO/constante; ordena pela soma dos erros (OD+OS)."""
+    if not results:
+        return []
+    sol = {}
+    for eye, alvo in (("OD", target_od), ("OS", target_os)):
+        power, refr = tables_to_arrays(results, eye)
+        sol[eye] = solve_target(power, refr, alvo)
+    total = np.nan_to_num(sol["OD"]["nearest_err"], nan=np.inf) + np.nan_to_num(sol["OS"]["nearest_err"], nan=np.inf)
+    out = []
+    for i in np.argsort(total, kind="stable"):
+        linha = {"Lente": labels[i]}
+        for eye in ("OD", "OS"):
+            linha[f"{eye} poder"] = float(sol[eye]["nearest_power"][i])
+            linha[f"{eye} refração"] = float(sol[eye]["nearest_refr"][i])
+            linha[f"{eye} poder interpolado"] = round(float(sol[eye]["interp_power"][i]), 2)
+        linha["Erro total (D)"] = round(float(total[i]), 2)
+        out.append(linha)
+    return out
@@ -0,0 +1,453 @@
+# barrett_service.py
+"""Modo serviço: API HTTP local (JSON) sobre o mesmo pipeline do app, para integração com o prontuário.
+
+Uso:
+    python barrett_service.py serve --port 8600 [--extract-workers 2] [--calc-workers 2] [--browser auto|Firefox|Chrome] [--hedge] [--lean]
+    python barrett_service.py bench --file exame.pdf [--endpoint extract] [-n 50] [-c 4] [--async]
+    python barrett_service.py bench-render --file exame.pdf [--dpi 72 400 480] [--backend pdfium pdftoppm]
+
+Endpoints (arquivo no corpo; tipo pela extensão em ?name=exame.pdf ou explícito em ?kind=pdf|xml|csv|dicom):
+    POST /extract                  → {"doc_hash", "patient", "biometry", "records", "stats", "from_history"}
+    POST /calculate                → corpo JSON {"OD": {"AL", "K1", "K2", "ACD"}, "OS": {...}, "iol",
+                                     "const_tipo", "a_constant", "lens_factor", "doctor", "patient", "browser",
+                                     "session"}  (session: mantém a página da calculadora aberta entre chamadas)
+    POST /extract-and-calculate    → arquivo no corpo, parâmetros da calculadora na query (?iol=...&a_constant=...)
+    POST ...?async=1               → 202 {"job_id", "status_url"}; acompanhar em GET /jobs/<id>
+    GET  /health                   → aquecimento, disjuntor da calculadora, abertura dos navegadores e filas
+
+Cada tipo de trabalho tem um pool limitado (extração e calculadora); com a fila cheia a resposta é 503 +
+Retry-After. Render/OCR/navegador continuam passando pelo controle de admissão do barrett_core.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import threading
+import time
+import traceback
+import urllib.request
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from barrett_core import (
+    IOL_PLACEHOLDER, STRUCTURED_EXT, CalculatorUnavailable,
+    warmup_state, history_init, spool_put, spool_release, extract_document, history_save_calculation,
+    iol_catalog, calc_breaker, calc_cache_get, run_selenium_and_fetch, governor,
+    preferred_browser, startup_summary, open_pdf_raster, rss_peak, pdfium,
+)
+
+MAX_BODY_MB = 80
+JOB_TTL_S = 60 * 60      # jobs assíncronos terminados ficam consultáveis por 1 h
+JOB_MAX = 1000
+CALC_FIELDS = ("AL", "K1", "K2", "ACD")
+BROWSER_CHOICES = ("auto", "Firefox", "Chrome")
+
+class BadRequest(ValueError):
+    pass
+
+class ExtractionFailed(RuntimeError):
+    pass
+
+class Busy(RuntimeError):
+    pass
+
+SERVICE = {
+    "lock": threading.Lock(),
+    "pools": {}, "limits": {}, "pending": Counter(),
+    "jobs": OrderedDict(),
+    "browser": "Firefox", "headless": True, "lean": False, "hedge": False,
+}
+
+# =========================
+# Trabalhos (mesmo pipeline do app)
+# =========================
+def _doc_kind(params: dict) -> str:
+    kind = params.get("kind")
+    if not kind:
+        ext = os.path.splitext(params.get("name", ""))[1].lower().lstrip(".")
+        kind = STRUCTURED_EXT.get(ext, "pdf")
+    if kind not in ("pdf", *STRUCTURED_EXT.values()):
+        raise BadRequest(f"Tipo de arquivo desconhecido: {kind}")
+    return kind
+
+def do_extract(body: bytes, params: dict) -> dict:
+    if not body:
+        raise BadRequest("Corpo vazio: envie os bytes do arquivo.")
+    kind = _doc_kind(params)
+    owner = f"api-{uuid.uuid4().hex}"
+    doc_hash = spool_put(io.BytesIO(body), owner, kind)
+    try:
+        ext = extract_document(doc_hash, kind, params.get("name"))
+    finally:
+        spool_release(owner)
+    if not ext["dados"]:
+        raise ExtractionFailed((ext["stats"] or {}).get("error") or "Não consegui extrair a biometria do arquivo.")
+    return {
+        "doc_hash": doc_hash, "patient": ext["patient"], "biometry": ext["dados"], "records": ext["records"],
+        "stats": ext["stats"], "from_history": ext["from_history"],
+    }
+
+def browser_from(src: dict):
+    """Navegador pedido na requisição (None = padrão do serviço)."""
+    browser = src.get("browser") or None
+    if browser is not None and browser not in BROWSER_CHOICES:
+        raise BadRequest(f"browser deve ser um de: {', '.join(BROWSER_CHOICES)}.")
+    return browser
+
+def calc_inputs_from(payload: dict, biometry: dict = None, patient: str = None) -> dict:
+    """Valida e completa as entradas da calculadora (constantes do catálogo se a LIO vier sem elas)."""
+    presets = iol_catalog()["by_label"]
+    iol = payload.get("iol") or IOL_PLACEHOLDER["label"]
+    if iol not in presets:
+        raise BadRequest(f"LIO desconhecida no catálogo: {iol}")
+    const_tipo = payload.get("const_tipo") or (
+        "Lens Factor" if payload.get("lens_factor") and not payload.get("a_constant") else "A-constant"
+    )
+    if const_tipo not in ("A-constant", "Lens Factor"):
+        raise BadRequest("const_tipo deve ser 'A-constant' ou 'Lens Factor'.")
+    eyes = {}
+    for eye in ("OD", "OS"):
+        src = payload.get(eye) or (biometry or {}).get(eye) or {}
+        try:
+            eyes[eye] = {k: float(str(src[k]).replace(",", ".")) for k in CALC_FIELDS}
+        except (KeyError, TypeError, ValueError):
+            raise BadRequest(f"Biometria {eye} incompleta: informe {', '.join(CALC_FIELDS)}.")
+    return {
+        "doctor": payload.get("doctor") or "Luis",
+        "patient": payload.get("patient") or patient or "AutoFill",
+        "OD": eyes["OD"],
+        "OS": eyes["OS"],
+        "iol": iol,
+        "const_tipo": const_tipo,
+        "a_constant": str(payload.get("a_constant") or presets[iol].get("a_constant", "") or "").strip(),
+        "lens_factor": str(payload.get("lens_factor") or presets[iol].get("lens_factor", "") or "").strip(),
+    }
+
+def do_calculate(inputs: dict, browser: str = None, doc_hash: str = None, session: str = None) -> dict:
+    hit = calc_cache_get(inputs)
+    if hit:
+        tables, used, cached = hit[0], hit[1], True
+    else:
+        browser = browser or SERVICE["browser"]
+        if browser == "auto":
+            browser = preferred_browser()
+        tables, used = run_selenium_and_fetch(
+            browser, inputs, headless=SERVICE["headless"], lean=SERVICE["lean"], hedge=SERVICE["hedge"],
+            live_sid=f"api:{session}" if session else None,
+        )
+        cached = False
+    history_save_calculation(doc_hash, inputs, tables)
+    return {"tables": tables, "browser": used, "cached": cached, "inputs": inputs}
+
+def do_extract_and_calculate(body: bytes, params: dict) -> dict:
+    ext = do_extract(body, params)
+    inputs = calc_inputs_from(params, ext["biometry"], ext["patient"])
+    return {**ext, **do_calculate(inputs, browser_from(params), ext["doc_hash"], params.get("session"))}
+
+# =========================
+# Pools limitados + jobs assíncronos
+# =========================
+def _counted(kind: str, fn, *args):
+    try:
+        return fn(*args)
+    finally:
+        with SERVICE["lock"]:
+            SERVICE["pending"][kind] -= 1
+
+def submit(kind: str, fn, *args):
+    with SERVICE["lock"]:
+        if SERVICE["pending"][kind] >= SERVICE["limits"][kind]:
+            raise Busy(f"Fila de {kind} cheia ({SERVICE['limits'][kind]}); tente novamente.")
+        SERVICE["pending"][kind] += 1
+    return SERVICE["pools"][kind].submit(_counted, kind, fn, *args)
+
+def _purge_jobs(now: float):
+    jobs = SERVICE["jobs"]
+    for job_id, job in list(jobs.items()):
+        if len(jobs) <= JOB_MAX and not (job["finished_at"] and now - job["finished_at"] > JOB_TTL_S):
+            break
+        if job["finished_at"]:
+            jobs.pop(job_id)
+
+def register_job(fut) -> str:
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    job = {"status": "running", "created_at": now, "finished_at": None, "result": None, "error": None}
+    with SERVICE["lock"]:
+        _purge_jobs(now)
+        SERVICE["jobs"][job_id] = job
+
+    def _done(f):
+        status, payload = _outcome(f)
+        with SERVICE["lock"]:
+            job["finished_at"] = time.time()
+            if status == 200:
+                job.update(status="done", result=payload)
+            else:
+                job.update(status="error", error=payload.get("error"), http_status=status)
+    fut.add_done_callback(_done)
+    return job_id
+
+def _outcome(fut) -> tuple:
+    """(status HTTP, corpo JSON) de um trabalho terminado."""
+    try:
+        return 200, fut.result()
+    except BadRequest as e:
+        return 400, {"error": str(e)}
+    except ExtractionFailed as e:
+        return 422, {"error": str(e)}
+    except CalculatorUnavailable as e:
+        return 503, {"error": str(e)}
+    except Exception as e:
+        traceback.print_exc()
+        return 500, {"error": f"{type(e).__name__}: {e}"}
+
+def health() -> dict:
+    warm = warmup_state()
+    br = calc_breaker()
+    gov = governor()
+    with gov["cond"]:
+        admission = {k: {"running": p["running"], "queued": len(p["queue"])} for k, p in gov["pools"].items()}
+    with SERVICE["lock"]:
+        pending = dict(SERVICE["pending"])
+        jobs = Counter(j["status"] for j in SERVICE["jobs"].values())
+    return {
+        "ok": True,
+        "warmup": {"ready": warm["ready"], "errors": warm["errors"]},
+        "calculator": {"state": br["state"], "last_error": br["last_error"]},
+        "browsers": startup_summary(),
+        "pending": pending, "limits": SERVICE["limits"], "admission": admission, "jobs": dict(jobs),
+    }
+
+# =========================
+# HTTP
+# =========================
+ROUTES = {
+    "/extract": ("extract", do_extract),
+    "/calculate": ("calc", None),          # corpo JSON, validado antes de entrar na fila
+    "/extract-and-calculate": ("calc", do_extract_and_calculate),
+}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _json(self, status: int, obj: dict, headers: dict = None):
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            return self._json(200, health())
+        if url.path.startswith("/jobs/"):
+            with SERVICE["lock"]:
+                job = SERVICE["jobs"].get(url.path[len("/jobs/"):])
+                job = dict(job) if job else None
+            if not job:
+                return self._json(404, {"error": "Job não encontrado (ou expirado)."})
+            return self._json(200, job)
+        self._json(404, {"error": "Rota desconhecida."})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        route = ROUTES.get(url.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        if route is None:
+            self.rfile.read(length)
+            return self._json(404, {"error": "Rota desconhecida."})
+        if length > MAX_BODY_MB * 1024 * 1024:
+            self.close_connection = True
+            return self._json(413, {"error": f"Arquivo maior que {MAX_BODY_MB} MB."})
+        body = self.rfile.read(length)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        kind, fn = route
+        try:
+            if fn is None:
+                payload = json.loads(body or b"{}")
+                if not isinstance(payload, dict):
+                    raise BadRequest("Corpo deve ser um objeto JSON.")
+                inputs = calc_inputs_from(payload)
+                fut = submit(kind, do_calculate, inputs, browser_from(payload), None, payload.get("session"))
+            else:
+                browser_from(params)   # recusa antes de gastar a extração
+                fut = submit(kind, fn, body, params)
+        except Busy as e:
+            return self._json(503, {"error": str(e)}, {"Retry-After": "5"})
+        except (BadRequest, ValueError) as e:
+            return self._json(400, {"error": str(e)})
+        if params.get("async") in ("1", "true"):
+            job_id = register_job(fut)
+            return self._json(202, {"job_id": job_id, "status_url": f"/jobs/{job_id}"})
+        status, obj = _outcome(fut)
+        self._json(status, obj)
+
+    def log_message(self, fmt, *args):
+        pass
+
+def serve(args):
+    SERVICE.update(browser=args.browser, headless=not args.show_browser, lean=args.lean, hedge=args.hedge)
+    SERVICE["limits"] = {"extract": args.extract_workers + args.queue, "calc": args.calc_workers + args.queue}
+    SERVICE["pools"] = {
+        "extract": ThreadPoolExecutor(max_workers=args.extract_workers, thread_name_prefix="api-extract"),
+        "calc": ThreadPoolExecutor(max_workers=args.calc_workers, thread_name_prefix="api-calc"),
+    }
+    warmup_state()   # resolve binários/navegadores em background
+    history_init()
+    httpd = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Barrett API em http://{args.host}:{args.port} (extração ×{args.extract_workers}, "
+          f"calculadora ×{args.calc_workers}, fila +{args.queue})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# =========================
+# Cliente de benchmark
+# =========================
+def _percentile(sorted_vals: list, pct: float) -> float:
+    if not sorted_vals:
+        return float("nan")
+    idx = min(len(sorted_vals) - 1, max(0, int(round(pct / 100 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[idx]
+
+def _request(url: str, body: bytes = None, content_type: str = None, timeout: float = 300) -> tuple:
+    req = urllib.request.Request(url, data=body, method="POST" if body is not None else "GET")
+    if content_type:
+        req.add_header("Content-Type", content_type)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read() or b"{}")
+    except HTTPError as e:
+        return e.code, {}
+
+def bench(args):
+    with open(args.file, "rb") as f:
+        body = f.read()
+    base = args.url.rstrip("/")
+    query = {"name": os.path.basename(args.file)}
+    for kv in args.param:
+        k, _, v = kv.partition("=")
+        query[k] = v
+    if args.async_jobs:
+        query["async"] = "1"
+    url = f"{base}/{args.endpoint}?{urlencode(query)}"
+    ctype = "application/json" if args.endpoint == "calculate" else "application/octet-stream"
+
+    def one(_):
+        t0 = time.perf_counter()
+        status, obj = _request(url, body, ctype, args.timeout)
+        if status == 202:
+            # assíncrono: latência até o job terminar
+            while True:
+                time.sleep(args.poll)
+                st_code, job = _request(f"{base}{obj['status_url']}", timeout=args.timeout)
+                if st_code != 200 or job.get("status") != "running":
+                    status = 200 if job.get("status") == "done" else job.get("http_status", st_code)
+                    break
+        return time.perf_counter() - t0, status
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        results = list(ex.map(one, range(args.requests)))
+    wall = time.perf_counter() - t0
+    ok = sorted(lat for lat, status in results if status == 200)
+    codes = Counter(status for _, status in results)
+    print(f"{args.requests} requisições em {wall:.2f} s (concorrência {args.concurrency}) → "
+          f"{args.requests / wall:.2f} req/s, {len(ok) / wall:.2f} sucessos/s")
+    print("status: " + ", ".join(f"{k}×{v}" for k, v in sorted(codes.items())))
+    if ok:
+        print("latência (s): " + " · ".join(
+            f"p{p} {_percentile(ok, p):.3f}" for p in (50, 90, 95, 99)) + f" · máx {ok[-1]:.3f}")
+
+def _bench_backend(args, backend: str):
+    children0 = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    for dpi in args.dpi:
+        lat, peaks, px_mb = [], [], []
+        for _ in range(args.repeat):
+            with open_pdf_raster(args.file, backend) as render:
+                used = render.backend
+                for page_no in range(1, args.pages + 1):
+                    mem = {}
+                    t0 = time.perf_counter()
+                    try:
+                        with rss_peak(mem, interval_s=0.01):
+                            pages = render(page_no, page_no, dpi=dpi)
+                    except Exception as e:
+                        print(f"{backend} @ {dpi} dpi: {type(e).__name__}: {e}")
+                        return
+                    if not pages:
+                        break
+                    lat.append(time.perf_counter() - t0)
+                    peaks.append(mem.get("rss_peak_mb", 0.0) - mem.get("rss_start_mb", 0.0))
+                    px_mb.append(pages[0].size[0] * pages[0].size[1] / 1_048_576)
+                    del pages
+        if not lat:
+            print(f"{backend} @ {dpi} dpi: nenhuma página renderizada")
+            continue
+        lat.sort()
+        print(f"{used} @ {dpi} dpi: {len(lat)} páginas · latência (ms) "
+              + " · ".join(f"p{p} {_percentile(lat, p) * 1000:.0f}" for p in (50, 90, 99))
+              + f" · imagem {sum(px_mb) / len(px_mb):.1f} MB/página"
+              + f" · pico RSS do processo +{max(peaks):.0f} MB")
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    if children > children0:
+        print(f"  (subprocessos: pico RSS {children:.0f} MB)")
+
+def bench_render(args):
+    """Latência e memória por página de cada rasterizador, com o documento aberto uma vez por rodada."""
+    for backend in args.backend:
+        if backend == "pdfium" and pdfium is None:
+            print("pdfium: pypdfium2 não instalado, pulando")
+            continue
+        _bench_backend(args, backend)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sp = sub.add_parser("serve", help="sobe a API")
+    sp.add_argument("--host", default="127.0.0.1")
+    sp.add_argument("--port", type=int, default=8600)
+    sp.add_argument("--extract-workers", type=int, default=2)
+    sp.add_argument("--calc-workers", type=int, default=2)
+    sp.add_argument("--queue", type=int, default=16, help="trabalhos aguardando além dos workers (por pool)")
+    sp.add_argument("--browser", choices=BROWSER_CHOICES, default="Firefox",
+                    help="auto: o de menor tempo/falha de abertura medido até agora")
+    sp.add_argument("--hedge", action="store_true",
+                    help="corrida: abre o outro navegador se o escolhido demorar/falhar (havendo vaga)")
+    sp.add_argument("--lean", action="store_true", help="perfil enxuto do navegador")
+    sp.add_argument("--show-browser", action="store_true", help="navegador com janela (sem headless)")
+    sp.set_defaults(func=serve)
+    bp = sub.add_parser("bench", help="mede req/s e latências contra uma API em execução")
+    bp.add_argument("--url", default="http://127.0.0.1:8600")
+    bp.add_argument("--file", required=True, help="arquivo enviado (PDF/XML/CSV/DICOM, ou JSON para /calculate)")
+    bp.add_argument("--endpoint", choices=["extract", "calculate", "extract-and-calculate"], default="extract")
+    bp.add_argument("--param", action="append", default=[], help="parâmetro extra da query (chave=valor)")
+    bp.add_argument("-n", "--requests", type=int, default=20)
+    bp.add_argument("-c", "--concurrency", type=int, default=4)
+    bp.add_argument("--async", dest="async_jobs", action="store_true", help="usa ?async=1 e acompanha o job")
+    bp.add_argument("--poll", type=float, default=0.2)
+    bp.add_argument("--timeout", type=float, default=300)
+    bp.set_defaults(func=bench)
+    rp = sub.add_parser("bench-render", help="compara rasterizadores (pdfium × pdftoppm): latência e memória por página")
+    rp.add_argument("--file", required=True, help="PDF")
+    rp.add_argument("--backend", nargs="+", choices=["pdfium", "pdftoppm"], default=["pdfium", "pdftoppm"])
+    rp.add_argument("--dpi", nargs="+", type=int, default=[72, 400, 480])
+    rp.add_argument("--pages", type=int, default=2, help="primeiras N páginas")
+    rp.add_argument("--repeat", type=int, default=3)
+    rp.set_defaults(func=bench_render)
+    args = ap.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# calc_standin.py
+"""Servidor local que imita a calculadora Barrett (mesmos IDs de campos/tabelas).
+
+Uso:
+    python calc_standin.py --port 8765 [--delay 0] [--fail] [--status 403]
+    BARRETT_CALC_URL=http://127.0.0.1:8765/barrett_universal2105/ streamlit run app_barrett.py
+
+Durante a execução dá para mudar o comportamento sem reiniciar:
+    curl "http://127.0.0.1:8765/__mode?delay=20"   # lento
+    curl "http://127.0.0.1:8765/__mode?fail=1"     # responde 503
+    curl "http://127.0.0.1:8765/__mode?status=403" # responde 403 (como um WAF)
+    curl "http://127.0.0.1:8765/__mode?delay=0&fail=0&status=0"
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MODE = {"delay": 0.0, "fail": False, "status": 0}   # status 0 = resposta normal
+MODE_LOCK = threading.Lock()
+
+FIELDS = [
+    "DoctorName", "PatientName",
+    "Axlength", "MeasuredK1", "MeasuredK2", "OpticalACD",
+    "Axlength0", "MeasuredK10", "MeasuredK20", "OpticalACD0",
+    "LensFactor", "Aconstant",
+]
+
+def _grid(grid_id: str, al: float) -> str:
+    rows = []
+    base = round(20.0 + (23.5 - al) * 2.5, 1)
+    for i in range(-5, 6):
+        power = base + i * 0.5
+        refr = round(-i * 0.35, 2)
+        rows.append(f"<tr><td>{power:.1f}</td><td>{'SN60WF' if i else 'SN60WF*'}</td><td>{refr:+.2f}</td></tr>")
+    return (f'<table id="{grid_id}"><tr><th>IOL Power</th><th>Optic</th><th>Refraction</th></tr>'
+            + "".join(rows) + "</table>")
+
+def _page(values: dict, results: bool) -> str:
+    inputs = "".join(
+        f'<label>{f}<input id="MainContent_{f}" name="{f}" value="{values.get(f, "")}"></label><br>' for f in FIELDS
+    )
+    panel = ""
+    if results:
+        def _f(k, d):
+            try:
+                return float(values.get(k, d))
+            except ValueError:
+                return d
+        panel = ('<div id="MainContent_Panel14">'
+                 + _grid("MainContent_GridView1", _f("Axlength", 23.5))
+                 + _grid("MainContent_GridView2", _f("Axlength0", 23.5)) + "</div>")
+    return f"""<!doctype html><html><head><title>Barrett stand-in</title>
+<script>function __doPostBack(t, a) {{}}</script></head><body>
+<form method="post">{inputs}
+<select id="MainContent_IOLModel" name="IOLModel"><option>Alcon SN60WF</option></select>
+<input type="submit" id="MainContent_Button1" value="Calculate"></form>{panel}</body></html>"""
+
+class Handler(BaseHTTPRequestHandler):
+    def _respond(self, body: str, status: int = 200):
+        with MODE_LOCK:
+            delay, fail, forced = MODE["delay"], MODE["fail"], MODE["status"]
+        if delay:
+            time.sleep(delay)
+        if fail:
+            status, body = 503, "Service Unavailable"
+        elif forced:
+            status, body = forced, f"HTTP {forced}"
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/__mode":
+            q = parse_qs(url.query)
+            with MODE_LOCK:
+                if "delay" in q:
+                    MODE["delay"] = float(q["delay"][0])
+                if "fail" in q:
+                    MODE["fail"] = q["fail"][0] not in ("0", "false", "")
+                if "status" in q:
+                    MODE["status"] = int(q["status"][0] or 0)
+                body = f"delay={MODE['delay']} fail={MODE['fail']} status={MODE['status']}"
+            data = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self._respond(_page({}, results=False))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        self._respond(_page(form, results=True))
+
+    def log_message(self, fmt, *args):
+        pass
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--delay", type=float, default=0.0, help="atraso (s) em cada resposta")
+    ap.add_argument("--fail", action="store_true", help="responder 503 em tudo")
+    ap.add_argument("--status", type=int, default=0, help="responder este status HTTP em tudo (ex.: 403)")
+    args = ap.parse_args()
+    MODE.update(delay=args.delay, fail=args.fail, status=args.status)
+    srv = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Stand-in em http://{args.host}:{args.port}/barrett_universal2105/")
+    srv.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# barrett_core lê caminhos do ambiente na importação: histórico/acervos isolados do usuário
+_TMP = tempfile.mkdtemp(prefix="barrett-tests-")
+os.environ.setdefault("BARRETT_HISTORY_DB", os.path.join(_TMP, "history.sqlite3"))
+os.environ.setdefault("BARRETT_OCR_STORE", os.path.join(_TMP, "ocr"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+import barrett_core as bc
+import calc_standin
+
+PROBE = bc.probe_calculator   # a fixture br troca a sonda; os testes do stand-in usam a de verdade
+INPUTS = {"doctor": "", "patient": "", "OD": {"AL": 23.4}, "OS": {"AL": 23.5}, "iol": "teste-disjuntor"}
+
+
+@pytest.fixture
+def br(monkeypatch):
+    state = {"lock": threading.Lock(), "state": "closed", "failures": 0, "opened_at": 0.0, "probing": False,
+             "last_error": ""}
+    pool = {"lock": threading.Lock(), "pending": 0, "real_runs": 0, "submitted": set()}
+    monkeypatch.setattr(bc, "calc_breaker", lambda: state)
+    monkeypatch.setattr(bc, "spec_pool", lambda: pool)
+    monkeypatch.setattr(bc, "probe_calculator", lambda: None)
+    monkeypatch.setattr(bc, "CALC_BACKOFF_S", 0.0)
+    monkeypatch.setattr(bc, "calc_cache_get", lambda inputs: None)
+    state["pool"] = pool
+    return state
+
+
+@pytest.fixture
+def standin(monkeypatch):
+    from http.server import ThreadingHTTPServer
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), calc_standin.Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    monkeypatch.setattr(bc, "CALC_URL", f"http://127.0.0.1:{srv.server_address[1]}/barrett_universal2105/")
+    monkeypatch.setitem(calc_standin.MODE, "status", 0)
+    monkeypatch.setitem(calc_standin.MODE, "fail", False)
+    yield calc_standin.MODE
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_opens_after_threshold_and_allows_one_probe(br, monkeypatch):
+    for _ in range(bc.CALC_FAILURE_THRESHOLD):
+        bc.breaker_failure(RuntimeError("timeout"))
+    assert br["state"] == "open" and not bc.breaker_allow()
+    monkeypatch.setattr(bc, "CALC_OPEN_S", 0.0)
+    assert bc.breaker_allow()          # sonda do meio-aberto
+    assert not bc.breaker_allow()      # só uma
+    bc.breaker_success()
+    assert br["state"] == "closed" and br["failures"] == 0
+
+
+def test_half_open_probe_failure_reopens(br):
+    br.update(state="half_open", probing=True)
+    bc.breaker_failure(RuntimeError("500"))
+    assert br["state"] == "open" and not br["probing"]
+
+
+def test_speculative_failure_does_not_count(br, monkeypatch):
+    def page_load_fails(choice, headless, lean):
+        raise TimeoutError("carga da página")
+    monkeypatch.setattr(bc, "open_calculator", page_load_fails)
+    with pytest.raises(TimeoutError):
+        bc.run_selenium_and_fetch("Firefox", INPUTS, speculative=True)
+    assert br["failures"] == 0 and br["state"] == "closed"
+    with pytest.raises(TimeoutError):
+        bc.run_selenium_and_fetch("Firefox", INPUTS)
+    assert br["failures"] == bc.CALC_MAX_ATTEMPTS
+
+
+def test_speculation_yields_to_a_real_run_between_attempts(br, monkeypatch):
+    calls = []
+
+    def launch_fails(choice, headless, lean):
+        calls.append(choice)
+        br["pool"]["real_runs"] += 1      # execução real chegou durante a 1ª tentativa
+        raise bc.BrowserLaunchFailed(choice)
+    monkeypatch.setattr(bc, "open_calculator", launch_fails)
+    with pytest.raises(bc.BrowserLaunchFailed):
+        bc.run_selenium_and_fetch("Firefox", INPUTS, speculative=True)
+    assert calls == ["Firefox"]
+
+
+def test_speculation_never_takes_the_half_open_probe(br):
+    br.update(state="half_open")
+    assert bc.run_selenium_and_fetch("Firefox", INPUTS, speculative=True) is None
+    assert not br["probing"]
+
+
+def test_probe_treats_4xx_as_reachable_and_the_run_proceeds(br, standin, monkeypatch):
+    standin["status"] = 403
+    PROBE()                                  # WAF respondeu: servidor no ar
+    monkeypatch.setattr(bc, "probe_calculator", PROBE)
+    opened = []
+
+    def launch_fails(choice, headless, lean):
+        opened.append(choice)
+        raise bc.BrowserLaunchFailed(choice)
+    monkeypatch.setattr(bc, "open_calculator", launch_fails)
+    with pytest.raises(bc.BrowserLaunchFailed):
+        bc.run_selenium_and_fetch("Firefox", INPUTS)
+    assert opened                            # a sonda não barrou o navegador
+    assert br["failures"] == 0 and br["state"] == "closed"
+
+
+def test_probe_counts_5xx_as_unavailable(br, standin, monkeypatch):
+    standin["fail"] = True
+    with pytest.raises(bc.CalculatorUnavailable):
+        PROBE()
+    monkeypatch.setattr(bc, "probe_calculator", PROBE)
+    with pytest.raises(bc.CalculatorUnavailable):
+        bc.run_selenium_and_fetch("Firefox", INPUTS)
+    assert br["failures"] == 1
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import barrett_core as bc
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    stats = {"lock": bc.threading.Lock(),
+             "browsers": {b: {"ready_s": bc.deque(maxlen=bc.BROWSER_STATS_WINDOW), "launches": 0,
+                              "failures": 0, "hedge_wins": 0} for b in bc.BROWSERS}}
+    monkeypatch.setattr(bc, "browser_stats", lambda: stats)
+    return stats
+
+
+def test_record_startup_unknown_browser_does_not_raise(fresh_stats):
+    bc._record_startup("Safari", 1.0)
+    assert fresh_stats["browsers"]["Safari"]["launches"] == 1
+
+
+def test_unknown_browser_rejected_before_breaker():
+    before = dict(bc.calc_breaker())
+    with pytest.raises(ValueError):
+        bc.run_selenium_and_fetch("Safari", {})
+    after = bc.calc_breaker()
+    assert (after["state"], after["failures"]) == (before["state"], before["failures"])
+
+
+def test_launch_failure_is_recorded(monkeypatch, fresh_stats):
+    def boom(headless, lean):
+        raise RuntimeError("no geckodriver")
+    monkeypatch.setattr(bc, "build_firefox", boom)
+    with pytest.raises(bc.BrowserLaunchFailed):
+        bc.open_calculator("Firefox", True, False)
+    assert fresh_stats["browsers"]["Firefox"]["failures"] == 1
+
+
+def test_preferred_browser_needs_samples_of_both(fresh_stats):
+    assert bc.preferred_browser() == "Firefox"
+    for _ in range(3):
+        bc._record_startup("Firefox", 6.0)
+        bc._record_startup("Chrome", 2.0)
+    assert bc.preferred_browser() == "Chrome"
+
+
+def test_driver_resolution_filters_path_without_touching_os_environ(monkeypatch, tmp_path):
+    stale = tmp_path / "velho"
+    stale.mkdir()
+    (stale / "chromedriver").write_text("#!/bin/sh\n")
+    (stale / "chromedriver").chmod(0o755)
+    driver = tmp_path / "chromedriver-novo"
+    driver.write_text("")
+    path = os.pathsep.join([str(stale), "/usr/bin"])
+    monkeypatch.setenv("PATH", path)
+    monkeypatch.setenv("CHROMEDRIVER", str(stale / "chromedriver"))
+    seen = {}
+
+    def fake_run(args, capture_output=True, env=None, timeout=None):
+        seen.update(args=args, env=env, path_during=os.environ["PATH"])
+        out = {"result": {"driver_path": str(driver), "browser_path": "/usr/bin/chrome"}}
+        return subprocess.CompletedProcess(args, 0, json.dumps(out).encode(), b"")
+
+    monkeypatch.setattr(bc.SeleniumManager, "_get_binary", staticmethod(lambda: "selenium-manager"))
+    monkeypatch.setattr(bc.subprocess, "run", fake_run)
+    assert bc._resolve_browser("Chrome")["driver_path"] == str(driver)
+    assert seen["args"][:3] == ["selenium-manager", "--browser", "chrome"]
+    assert seen["env"]["PATH"] == "/usr/bin"
+    assert "CHROMEDRIVER" not in seen["env"]
+    assert seen["path_during"] == path and os.environ["PATH"] == path
+    assert os.environ["CHROMEDRIVER"] == str(stale / "chromedriver")
+
+
+def test_selenium_manager_contract_used_by_driver_resolution(monkeypatch):
+    # _resolve_browser monta a chamada do binário por conta própria (precisa de env=): quebra aqui se
+    # o _get_binary privado sumir ou se o binding passar a mandar outras flags
+    binary = bc.SeleniumManager._get_binary()
+    assert os.path.isfile(binary)
+    sent = []
+    monkeypatch.setattr(bc.SeleniumManager, "_run", staticmethod(lambda args: sent.append(args) or {}))
+    bc.SeleniumManager().binary_paths(["--browser", "chrome"])
+    assert sent == [[str(binary), "--browser", "chrome", *bc.SELENIUM_MANAGER_FLAGS]]
@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+import barrett_core as bc
+
+LENSES = [
+    {"label": "Alcon SN60WF", "manufacturer": "Alcon", "model": "SN60WF", "a_constant": "118.99", "lens_factor": "1.88"},
+    {"label": "Alcon SN6AD", "manufacturer": "Alcon", "model": "SN6AD", "a_constant": "119.01", "lens_factor": "1.89"},
+    {"label": "J&J ZCB00", "manufacturer": "J&J", "model": "ZCB00", "a_constant": 119.3, "lens_factor": None},
+]
+
+
+@pytest.fixture
+def catalog(monkeypatch, tmp_path):
+    path = tmp_path / "iol_catalog.json"
+    path.write_text(json.dumps({"version": 1, "lenses": LENSES}), encoding="utf-8")
+    monkeypatch.setattr(bc, "IOL_CATALOG_PATH", str(path))
+    return path
+
+
+def test_indexes(catalog):
+    cat = bc.iol_catalog()
+    assert cat["labels"][0] == bc.IOL_PLACEHOLDER["label"]
+    assert cat["by_manufacturer"]["Alcon"] == ["Alcon SN60WF", "Alcon SN6AD"]
+    assert cat["by_label"]["J&J ZCB00"]["a_constant"] == "119.3"
+    assert cat["by_label"]["J&J ZCB00"]["lens_factor"] == ""
+
+
+@pytest.mark.parametrize("query,esperado", [
+    ("sn6", ["Alcon SN60WF", "Alcon SN6AD"]),
+    ("alcon ad", ["Alcon SN6AD"]),
+    ("119.3", ["J&J ZCB00"]),
+    ("zcb 00", ["J&J ZCB00"]),
+    ("", ["Alcon SN60WF", "Alcon SN6AD", "J&J ZCB00"]),
+])
+def test_search_terms(catalog, query, esperado):
+    assert bc.search_iol(query) == esperado
+
+
+def test_search_falls_back_to_fuzzy_match(catalog):
+    assert bc.search_iol("alcon sn60wg")[0] == "Alcon SN60WF"
+
+
+def test_catalog_reloads_when_file_changes(catalog):
+    assert "Rayner RayOne EMV" not in bc.iol_catalog()["labels"]
+    novo = LENSES + [{"label": "Rayner RayOne EMV", "manufacturer": "Rayner", "model": "RAO200E",
+                      "a_constant": "118.6", "lens_factor": "1.68"}]
+    catalog.write_text(json.dumps({"version": 1, "lenses": novo}), encoding="utf-8")
+    st = os.stat(catalog)
+    os.utime(catalog, (st.st_atime, st.st_mtime + 5))
+    assert "Rayner RayOne EMV" in bc.iol_catalog()["labels"]
+
+
+def test_missing_catalog_keeps_manual_constants(monkeypatch, tmp_path):
+    monkeypatch.setattr(bc, "IOL_CATALOG_PATH", str(tmp_path / "nao_existe.json"))
+    assert bc.iol_catalog()["labels"] == [bc.IOL_PLACEHOLDER["label"]]
+    assert bc.search_iol("sn60") == []
@@ -0,0 +1,55 @@
+import os
+import subprocess
+
+import pytest
+from PIL import Image
+
+import barrett_core as bc
+
+HEADER = ("page   num  type   width height color comp bpc  enc interp  object ID x-ppi y-ppi size ratio\n"
+          + "-" * 92 + "\n")
+
+
+def _row(ppi, kind="image"):
+    return f"   1     0 {kind}    2480  3508  rgb     3   8  jpeg   no         7  0   {ppi}   {ppi}  412K 4.8%\n"
+
+
+@pytest.fixture
+def pdfimages(monkeypatch):
+    calls = {"list": "", "extracted": 0}
+
+    def fake_run(args, capture_output=True, timeout=None, text=False, check=False):
+        assert args[0] == "pdfimages"
+        if args[1] == "-list":
+            return subprocess.CompletedProcess(args, 0, calls["list"], "")
+        calls["extracted"] += 1
+        Image.new("RGB", (40, 60), "white").save(args[-1] + "-000.png")
+        return subprocess.CompletedProcess(args, 0, b"", b"")
+
+    monkeypatch.setattr(bc.shutil, "which", lambda name: "/usr/bin/" + name)
+    monkeypatch.setattr(bc.subprocess, "run", fake_run)
+    return calls
+
+
+def test_single_scan_is_extracted_at_native_resolution(pdfimages):
+    pdfimages["list"] = HEADER + _row(300)
+    img, ppi = bc.extract_embedded_scan("laudo.pdf", 1)
+    assert ppi == 300.0 and img.mode == "L" and img.size == (40, 60)
+
+
+@pytest.mark.parametrize("listing", [
+    HEADER,                                          # página sem imagem (texto vetorial)
+    HEADER + _row(300) + _row(300),                  # mais de uma imagem: layout composto
+    HEADER + _row(bc.EMBED_MIN_PPI - 1),             # resolução baixa demais para o OCR
+    HEADER + _row(300, kind="smask"),                # só máscara, não é digitalização
+])
+def test_pages_that_are_not_one_usable_scan_fall_back_to_rendering(pdfimages, listing):
+    pdfimages["list"] = listing
+    assert bc.extract_embedded_scan("laudo.pdf", 1) is None
+    assert pdfimages["extracted"] == 0
+
+
+def test_without_poppler_nothing_is_attempted(monkeypatch):
+    monkeypatch.setattr(bc.shutil, "which", lambda name: None)
+    monkeypatch.setattr(bc.subprocess, "run", lambda *a, **kw: pytest.fail("não devia chamar pdfimages"))
+    assert bc.extract_embedded_scan(os.devnull, 1) is None
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import barrett_core as bc
+
+
+@pytest.fixture
+def gov(monkeypatch):
+    state = {"cond": threading.Condition(),
+             "pools": {k: {"running": 0, "queue": bc.deque(), "avg_s": 1.0} for k in bc.GOVERNOR_LIMITS}}
+    monkeypatch.setattr(bc, "governor", lambda: state)
+    monkeypatch.setattr(bc, "_memory_allows", lambda kind: True)
+    return state
+
+
+def _wait_for(cond, timeout=5.0):
+    t_end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < t_end
+        time.sleep(0.01)
+
+
+def test_available_mb_discounts_inactive_page_cache(monkeypatch, tmp_path):
+    (tmp_path / "max").write_text(str(1000 * 1_048_576))
+    (tmp_path / "current").write_text(str(900 * 1_048_576))
+    (tmp_path / "stat").write_text(f"anon 1\nactive_file 5\ninactive_file {300 * 1_048_576}\n")
+    monkeypatch.setattr(bc, "CGROUP_MEMORY_FILES",
+                        [(str(tmp_path / "max"), str(tmp_path / "current"), str(tmp_path / "stat"), "inactive_file")])
+    assert bc._available_mb() == pytest.approx(400)
+
+
+def test_queue_position_reaches_explicit_reporter_from_another_thread(gov):
+    labels = []
+    gov["pools"]["ocr"]["running"] = bc.GOVERNOR_LIMITS["ocr"]   # pool cheio
+
+    def job():
+        with bc.admitted("ocr", report=labels.append):
+            pass
+    th = threading.Thread(target=job)
+    th.start()
+    _wait_for(lambda: labels)
+    with gov["cond"]:
+        gov["pools"]["ocr"]["running"] = 0
+        gov["cond"].notify_all()
+    th.join(5)
+    assert labels[0].startswith("Na fila de OCR: posição 1")
+    assert labels[-1] == "Executando (OCR)..."
+
+
+def test_locator_passes_the_caller_reporter_to_executor_threads(monkeypatch):
+    seen = []
+    report = object()
+    monkeypatch.setattr(bc, "_pdf_text_pages", lambda path: ["", ""])
+    monkeypatch.setattr(bc, "ocr_text", lambda im, psm="6", report=None: seen.append(report) or "")
+    bc.progress_local.report = report
+    try:
+        bc.locate_biometry_pages("x.pdf", render=lambda first, last, dpi=200: [Image.new("L", (8, 8))] * 2)
+    finally:
+        bc.progress_local.report = None
+    assert seen == [report, report]
+
+
+def test_queue_is_fifo_per_kind(gov, monkeypatch):
+    monkeypatch.setitem(bc.GOVERNOR_LIMITS, "render", 1)
+    order, lock = [], threading.Lock()
+    gate = threading.Event()
+
+    def job(n):
+        with bc.admitted("render"):
+            with lock:
+                order.append(n)
+            gate.wait(5)
+
+    first = threading.Thread(target=job, args=(0,))
+    first.start()
+    _wait_for(lambda: order == [0])
+    waiting = []
+    for n in (1, 2, 3):
+        th = threading.Thread(target=job, args=(n,))
+        th.start()
+        waiting.append(th)
+        _wait_for(lambda: len(gov["pools"]["render"]["queue"]) == n)   # entra na fila nesta ordem
+    gate.set()
+    for th in [first] + waiting:
+        th.join(10)
+    assert order == [0, 1, 2, 3]
+    assert gov["pools"]["render"]["running"] == 0
+
+
+def test_try_admit_never_jumps_the_queue(gov):
+    gov["pools"]["browser"]["queue"].append(object())
+    assert not bc.try_admit("browser")
+    gov["pools"]["browser"]["queue"].clear()
+    assert bc.try_admit("browser")
+    bc.release("browser")
+    assert gov["pools"]["browser"]["running"] == 0
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+import barrett_core as bc
+
+BIO = {"OD": {"AL": 23.4, "K1": 43.1, "K2": 44.0, "ACD": 3.1}, "OS": {"AL": 23.6, "K1": 43.3, "K2": 44.2, "ACD": 3.2}}
+
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch, tmp_path):
+    path = tmp_path / "history.sqlite3"
+    monkeypatch.setattr(bc, "HISTORY_DB", str(path))
+    monkeypatch.setattr(bc, "history_init", bc.history_init.__wrapped__)   # sem o memo do processo
+    return path
+
+
+def _inputs(patient, iol):
+    return {"patient": patient, "iol": iol, "const_tipo": "A-constant", "a_constant": "119.0", "lens_factor": "",
+            **BIO}
+
+
+def test_document_is_recalled_by_hash():
+    assert bc.history_get_document("h1") is None
+    bc.history_save_document("h1", "laudo.pdf", BIO, "Maria Silva")
+    assert bc.history_get_document("h1") == (BIO, "Maria Silva")
+
+
+def test_search_is_prefix_and_case_insensitive_newest_first(monkeypatch):
+    stamps = iter(["2026-01-01 10:00:00", "2026-01-02 10:00:00", "2026-01-03 10:00:00"])
+    monkeypatch.setattr(bc, "_now_iso", lambda: next(stamps))
+    bc.history_save_calculation("h1", _inputs("Maria Silva", "Alcon SN60WF"), {"OD": [], "OS": []})
+    bc.history_save_calculation("h2", _inputs("Mario Souza", "Alcon SN60WF"), {"OD": [], "OS": []})
+    bc.history_save_calculation("h3", _inputs("João Lima", "J&J ZCB00"), {"OD": [], "OS": []})
+    assert [r["doc_hash"] for r in bc.history_search("mar")] == ["h2", "h1"]
+    assert [r["doc_hash"] for r in bc.history_search("")] == ["h3", "h2", "h1"]
+    assert bc.history_top_iols(1) == ["Alcon SN60WF"]
+
+
+def test_placeholder_lens_is_not_a_favourite():
+    bc.history_save_calculation(None, _inputs("X", bc.IOL_PLACEHOLDER["label"]), {"OD": [], "OS": []})
+    assert bc.history_top_iols() == []
+
+
+def test_indexes_exist(db):
+    bc.history_init()
+    with sqlite3.connect(db) as conn:
+        names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert {"idx_documents_patient", "idx_calc_patient", "idx_calc_created", "idx_calc_doc"} <= names
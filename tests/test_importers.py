@@ -0,0 +1,65 @@
+import os
+import shutil
+
+import pytest
+
+import barrett_core as bc
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def _records(name, kind):
+    return list(bc.iter_structured_records(os.path.join(FIXTURES, name), kind))
+
+
+def test_csv_one_row_per_patient_with_comma_decimals():
+    recs = _records("lenstar_por_paciente.csv", "csv")
+    assert [r["patient"] for r in recs] == ["SILVA MARIA"]   # 2º paciente: AL fora da faixa, incompleto
+    assert recs[0]["dados"]["OD"] == {"AL": 23.45, "K1": 43.1, "K2": 44.2, "ACD": 3.1}
+    assert recs[0]["dados"]["OS"]["ACD"] == 3.05
+
+
+def test_csv_one_row_per_eye_converts_radius_to_diopters():
+    recs = _records("iolmaster_por_olho.csv", "csv")
+    assert [r["patient"] for r in recs] == ["Maria Silva", "Ana Lima"]
+    od = recs[0]["dados"]["OD"]
+    assert od["AL"] == 23.45 and od["ACD"] == 3.1
+    assert od["K1"] == pytest.approx(337.5 / 7.83, abs=0.01)
+    assert recs[1]["dados"]["OS"]["K2"] == pytest.approx(337.5 / 7.41, abs=0.01)
+
+
+def test_xml_many_patients_nested_exams_attributes_and_namespace():
+    recs = _records("exportacao_varios.xml", "xml")
+    assert [r["patient"] for r in recs] == ["Maria Silva", "João Souza"]
+    assert recs[0]["dados"]["OS"] == {"AL": 23.5, "K1": 43.0, "K2": 44.0, "ACD": 3.05}
+    assert recs[1]["dados"]["OD"]["AL"] == 24.01
+
+
+def test_xml_single_patient_without_record_element():
+    recs = _records("exportacao_um_paciente.xml", "xml")
+    assert len(recs) == 1 and recs[0]["patient"] == "Ana Lima"
+    assert recs[0]["dados"]["OD"]["K2"] == 45.61
+
+
+@pytest.mark.parametrize("raw,esperado", [
+    ("AL OD", ("AL", "OD")), ("od_al", ("AL", "OD")), ("Axial Length (R)", ("AL", "OD")),
+    ("K1 [D]", ("K1", None)), ("Steep K (L)", ("K2", "OS")), ("Nome", (None, None)),
+])
+def test_field_and_eye(raw, esperado):
+    assert bc._field_and_eye(raw) == esperado
+
+
+def test_extract_document_reads_structured_export_from_spool(monkeypatch, tmp_path):
+    monkeypatch.setattr(bc, "SPOOL_DIR", str(tmp_path))
+    shutil.copy(os.path.join(FIXTURES, "iolmaster_por_olho.csv"), bc.spool_path("abc", "csv"))
+    ext = bc.extract_document("abc", "csv")
+    assert ext["patient"] == "Maria Silva" and len(ext["records"]) == 2
+    assert ext["stats"]["error"] is None and not ext["from_history"]
+
+
+def test_extract_document_reports_parse_errors(monkeypatch, tmp_path):
+    monkeypatch.setattr(bc, "SPOOL_DIR", str(tmp_path))
+    with open(bc.spool_path("ruim", "xml"), "w") as f:
+        f.write("<Export><Patient>")
+    ext = bc.extract_document("ruim", "xml")
+    assert ext["records"] == [] and ext["stats"]["error"].startswith("ParseError")
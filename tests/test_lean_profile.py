@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+import barrett_core as bc
+
+
+class FakeDriver:
+    def __init__(self, service=None, options=None):
+        self.service, self.options = service, options
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def launched(monkeypatch, tmp_path):
+    seen = {}
+
+    def fake(name):
+        def build(service=None, options=None):
+            if seen.get("fail"):
+                raise RuntimeError("navegador não abriu")
+            seen[name] = FakeDriver(service, options)
+            return seen[name]
+        return build
+
+    monkeypatch.setattr(bc.webdriver, "Firefox", fake("Firefox"))
+    monkeypatch.setattr(bc.webdriver, "Chrome", fake("Chrome"))
+    monkeypatch.setattr(bc, "_pinned_binaries", lambda name: {"driver_path": "/opt/driver"})
+    monkeypatch.setattr(bc.tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(bc.os.path, "isdir", lambda p, _isdir=os.path.isdir: p != "/dev/shm" and _isdir(p))
+    return seen
+
+
+def test_lean_firefox_blocks_images_fonts_and_foreign_hosts(launched):
+    driver = bc.build_firefox(True, lean=True)
+    opts = driver.options
+    prefs = opts.preferences
+    assert opts.page_load_strategy == "eager"
+    assert prefs["permissions.default.image"] == 2 and prefs["gfx.downloadable_fonts.enabled"] is False
+    pac = prefs["network.proxy.autoconfig_url"]
+    assert all(f"dnsDomainIs(h, '{h}')" in pac for h in bc.CALC_HOSTS) and "PROXY 127.0.0.1:9" in pac
+    assert os.path.isdir(driver._barrett_profile_dir)
+    bc._quit_driver(driver)
+    assert not os.path.exists(driver._barrett_profile_dir)     # perfil temporário sai junto
+
+
+def test_lean_chrome_maps_everything_but_the_calculator_to_notfound(launched):
+    driver = bc.build_chrome(True, lean=True)
+    args = driver.options.arguments
+    assert "--blink-settings=imagesEnabled=false" in args
+    rules = next(a for a in args if a.startswith("--host-resolver-rules="))
+    assert "MAP * ~NOTFOUND" in rules and all(f"EXCLUDE {h}" in rules for h in bc.CALC_HOSTS)
+    assert driver.options.experimental_options["prefs"]["profile.managed_default_content_settings.images"] == 2
+    bc._quit_driver(driver)
+
+
+def test_default_profile_is_untouched(launched):
+    driver = bc.build_chrome(True)
+    assert driver._barrett_profile_dir is None
+    assert not any(a.startswith(("--user-data-dir", "--host-resolver-rules")) for a in driver.options.arguments)
+
+
+def test_failed_launch_removes_the_lean_profile(launched, tmp_path):
+    launched["fail"] = True
+    with pytest.raises(RuntimeError):
+        bc.build_firefox(True, lean=True)
+    assert not [d for d in os.listdir(tmp_path) if d.startswith("barrett-profile-")]
@@ -0,0 +1,115 @@
+import io
+import os
+
+import pytest
+
+pytest.importorskip("pypdfium2")
+from PIL import Image  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app_barret.py")
+
+
+def _pdf(paginas=1):
+    ims = [Image.new("RGB", (200, 280), "white") for _ in range(paginas)]
+    buf = io.BytesIO()
+    ims[0].save(buf, format="PDF", save_all=True, append_images=ims[1:])
+    return buf.getvalue()
+
+
+@pytest.fixture
+def ocr_calls(monkeypatch, tmp_path):
+    import pytesseract
+
+    calls = []
+
+    def fake_image_to_data(im, lang=None, config="", output_type=None):
+        calls.append(config)
+        return {"text": ["AL:", "23.45"], "left": [1, 40], "top": [1, 1], "width": [30, 40],
+                "height": [10, 10], "conf": [95, 95], "block_num": [1, 1], "par_num": [1, 1],
+                "line_num": [1, 1]}
+
+    monkeypatch.setattr(pytesseract, "image_to_data", fake_image_to_data)
+    monkeypatch.setenv("BARRETT_OCR_STORE", str(tmp_path / "ocr"))
+    return calls
+
+
+def _run(sha):
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.session_state["pdf_bytes"] = _pdf()
+    at.session_state["pdf_name"] = "t.pdf"
+    at.session_state["pdf_sha"] = sha
+    at.run()
+    return at
+
+
+def _stored(tmp_path):
+    d = tmp_path / "ocr"
+    return sorted(os.listdir(d)) if d.is_dir() else []
+
+
+def test_region_passes_are_stored_and_reused(ocr_calls, tmp_path):
+    at = _run("doc-a")
+    assert ocr_calls and any("--psm 6" in c for c in ocr_calls)
+    primeira = len(ocr_calls)
+    assert len(_stored(tmp_path)) == primeira
+    at.run()
+    assert len(ocr_calls) == primeira           # rerun: passadas da sessão
+    _run("doc-a")
+    assert len(ocr_calls) == primeira           # nova sessão: passadas do disco
+
+
+def test_store_is_bounded_by_size(ocr_calls, tmp_path, monkeypatch):
+    monkeypatch.setenv("BARRETT_OCR_STORE_MB", "0.0005")   # ~500 bytes: cabe uma passada só
+    _run("doc-b")
+    _run("doc-c")
+    assert len(_stored(tmp_path)) <= 1
+
+
+def test_disk_store_can_be_disabled(ocr_calls, tmp_path, monkeypatch):
+    monkeypatch.setenv("BARRETT_OCR_STORE_DAYS", "0")
+    at = _run("doc-d")
+    assert ocr_calls
+    assert _stored(tmp_path) == []
+    n = len(ocr_calls)
+    at.run()
+    assert len(ocr_calls) == n
+
+
+def test_debug_branch_renders_with_preview_and_halves(ocr_calls):
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.session_state["pdf_bytes"] = _pdf()
+    at.session_state["pdf_name"] = "t.pdf"
+    at.session_state["pdf_sha"] = "doc-e"
+    at.run()
+    next(c for c in at.sidebar.checkbox if c.label.startswith("Mostrar OCR bruto")).check().run()
+    assert not at.exception
+    assert not [w for w in at.warning if "prévia" in w.value]
+    legendas = [img.proto.imgs[0].caption for img in at.get("imgs")]
+    assert "Metade esquerda pré-processada (OD)" in legendas
+    assert "Metade direita pré-processada (OS)" in legendas
+    assert "Prévia da 1ª página do PDF" in legendas
+    linhas = [t.value for t in at.text if t.value.startswith("Memória:")]
+    assert linhas and "pico em renderização+OCR" in linhas[0]
+
+
+def test_form_edits_reuse_the_session_extraction(ocr_calls, monkeypatch):
+    import pypdfium2
+
+    renders = []
+    real = pypdfium2.PdfDocument
+
+    def contando(*a, **kw):
+        renders.append(1)
+        return real(*a, **kw)
+
+    monkeypatch.setattr(pypdfium2, "PdfDocument", contando)
+    at = _run("doc-f")
+    assert len(renders) == 1
+    n = len(ocr_calls)
+    next(w for w in at.number_input if w.label == "AL (OD, mm)").set_value(25.0).run()
+    assert not at.exception
+    assert len(renders) == 1 and len(ocr_calls) == n    # sem renderização nem OCR
+    assert at.session_state["bio_vals"]["OD"]["AL"] == 25.0
+    next(s for s in at.sidebar.slider if s.label.startswith("DPI")).set_value(360).run()
+    assert len(renders) == 2                            # parâmetro de extração mudou: renderiza de novo
@@ -0,0 +1,45 @@
+import ast
+import os
+import re
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app_barret.py")
+
+
+def _funcs(*names):
+    # app_barret.py é um script Streamlit (executa a UI ao importar): compila só as funções puras,
+    # num mesmo namespace para que chamem umas às outras
+    with open(APP, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    defs = [n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name in names]
+    ns = {"re": re}
+    exec(compile(ast.Module(body=defs, type_ignores=[]), APP, "exec"), ns)
+    return [ns[n] for n in names]
+
+
+words_to_text, _region_text, ocr_top_header_get_text, extrair_patient_name_do_header = _funcs(
+    "words_to_text", "_region_text", "ocr_top_header_get_text", "extrair_patient_name_do_header")
+
+
+def _w(texto, bloco, par, linha):
+    return [texto, 0, 0, 10, 10, 96.0, bloco, par, linha]
+
+
+def test_words_to_text_breaks_on_block_paragraph_and_line():
+    words = [_w("Comp.", 1, 1, 1), _w("AL:", 1, 1, 1), _w("23.45", 1, 1, 1),
+             _w("MV:", 1, 1, 2), _w("43.10", 1, 1, 2),
+             _w("ACD:", 2, 1, 1), _w("3.10", 2, 1, 1)]
+    assert words_to_text(words) == "Comp. AL: 23.45\nMV: 43.10\nACD: 3.10"
+
+
+def test_words_to_text_same_line_number_in_new_paragraph_is_a_new_line():
+    assert words_to_text([_w("a", 1, 1, 1), _w("b", 1, 2, 1)]) == "a\nb"
+    assert words_to_text([]) == ""
+
+
+def test_header_text_uses_the_header_pass_and_tolerates_missing_ocr():
+    recs = {"header": {"words": [_w("Report", 1, 1, 1), _w("Date", 1, 1, 1), _w("MARIA", 1, 2, 1),
+                                 _w("SILVA", 1, 2, 1)]}}
+    texto = ocr_top_header_get_text(recs.get)
+    assert texto == "Report Date\nMARIA SILVA"
+    assert extrair_patient_name_do_header(texto) == "MARIA SILVA"
+    assert ocr_top_header_get_text(lambda region: None) == ""
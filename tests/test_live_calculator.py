@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+import barrett_core as bc
+
+
+class Field:
+    tag_name = "input"
+
+    def __init__(self, page, elem_id):
+        self.page, self.id = page, elem_id
+
+    def clear(self):
+        self.page.values[self.id] = ""
+
+    def send_keys(self, value):
+        self.page.values[self.id] += value
+        self.page.sent.append(self.id)
+
+    def get_attribute(self, name):
+        return self.page.values.get(self.id, "")
+
+    def is_displayed(self):
+        return True
+
+
+class Page:
+    """Formulário da calculadora já carregado (com as constantes da LIO escolhida)."""
+
+    def __init__(self):
+        self.values = {"MainContent_Aconstant": "118.99", "MainContent_LensFactor": "1.88"}
+        self.sent = []
+
+    def find_element(self, by, elem_id):
+        return Field(self, elem_id)
+
+    def find_elements(self, by, elem_id):
+        return [Field(self, elem_id)]
+
+
+def _inputs(**over):
+    base = {"doctor": "Luis", "patient": "Maria", "iol": "Alcon SN60WF", "const_tipo": "A-constant",
+            "a_constant": "", "lens_factor": "",
+            "OD": {"AL": 23.4, "K1": 43.1, "K2": 44.0, "ACD": 3.1},
+            "OS": {"AL": 23.6, "K1": 43.3, "K2": 44.2, "ACD": 3.2}}
+    return {**base, **over}
+
+
+def test_first_fill_sends_every_field_and_reads_lens_constants():
+    page = Page()
+    defaults = bc._fill_calculator(page, _inputs())
+    assert page.sent == [elem_id for _, _, elem_id in bc.CALC_FORM_IDS]
+    assert defaults == {"a_constant": "118.99", "lens_factor": "1.88"}
+
+
+def test_live_page_only_resends_changed_fields():
+    page = Page()
+    prev = _inputs()
+    defaults = bc._fill_calculator(page, prev)
+    page.sent.clear()
+    changed = bc._copy_inputs(prev)
+    changed["OD"]["AL"] = 24.0
+    bc._fill_calculator(page, changed, prev, defaults)
+    assert page.sent == ["MainContent_Axlength"]
+
+
+def test_manual_constant_is_undone_when_the_type_switches():
+    page = Page()
+    prev = _inputs()
+    defaults = bc._fill_calculator(page, prev)
+    manual = _inputs(a_constant="119.2")
+    page.sent.clear()
+    bc._fill_calculator(page, manual, prev, defaults)
+    assert page.sent == ["MainContent_Aconstant"] and page.values["MainContent_Aconstant"] == "119.2"
+    page.sent.clear()
+    bc._fill_calculator(page, _inputs(a_constant="119.2", const_tipo="Lens Factor"), manual, defaults)
+    assert page.sent == ["MainContent_Aconstant"] and page.values["MainContent_Aconstant"] == "118.99"
+
+
+def test_removing_the_lens_needs_a_fresh_page():
+    page = Page()
+    prev = _inputs()
+    defaults = bc._fill_calculator(page, prev)
+    with pytest.raises(RuntimeError):
+        bc._fill_calculator(page, _inputs(iol=bc.IOL_PLACEHOLDER["label"]), prev, defaults)
+
+
+@pytest.fixture
+def live(monkeypatch):
+    reg = {"lock": threading.Lock(), "items": {}}
+    closed = []
+    monkeypatch.setattr(bc, "live_calculators", lambda: reg)
+    monkeypatch.setattr(bc, "_live_close", closed.append)
+    monkeypatch.setattr(bc, "breaker_success", lambda: None)
+    monkeypatch.setattr(bc, "calc_cache_put", lambda inputs, tables, browser: None)
+    monkeypatch.setattr(bc, "_submit_and_fetch", lambda driver: ({"OD": [], "OS": []}, 1.0))
+    page = Page()
+    prev = _inputs()
+    reg["items"]["s1"] = {"driver": page, "browser": "Firefox", "inputs": prev, "opts": ("Firefox", True, False),
+                          "defaults": bc._fill_calculator(page, prev), "lock": threading.Lock(),
+                          "last_used": 0.0, "runs": 0}
+    page.sent.clear()
+    return reg, page, closed
+
+
+def test_live_run_reuses_the_session_page(live):
+    reg, page, closed = live
+    got = bc._live_run("s1", _inputs(patient="Maria S."), ("Firefox", True, False))
+    assert got == ({"OD": [], "OS": []}, "Firefox · ao vivo")
+    assert page.sent == ["MainContent_PatientName"] and reg["items"]["s1"]["runs"] == 1 and not closed
+
+
+def test_live_run_with_other_browser_options_falls_back_and_closes(live):
+    reg, page, closed = live
+    assert bc._live_run("s1", _inputs(), ("Chrome", True, False)) is None
+    assert "s1" not in reg["items"] and len(closed) == 1 and page.sent == []
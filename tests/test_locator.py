@@ -0,0 +1,56 @@
+from PIL import Image
+
+import barrett_core as bc
+
+BIOMETRY = "OD Comp. AL 23.45 mm ACD 3.10 mm K1 43.10 K2 44.20 OS AL 23.50 mm"
+
+
+class FakeRender:
+    def __init__(self, n_pages):
+        self.n_pages = n_pages
+        self.calls = []
+
+    def __call__(self, first_page=1, last_page=None, dpi=200):
+        self.calls.append((first_page, last_page))
+        last = min(last_page or self.n_pages, self.n_pages)
+        # o número da página vai no tamanho da miniatura, para o OCR falso saber qual é
+        return [Image.new("L", (10 + p, 10)) for p in range(first_page, last + 1)]
+
+
+def _setup(monkeypatch, text_pages, ocr_by_page):
+    monkeypatch.setattr(bc, "_pdf_text_pages", lambda path: text_pages)
+    monkeypatch.setattr(bc, "ocr_text", lambda im, psm="6", report=None: ocr_by_page.get(im.size[0] - 10, ""))
+
+
+def test_scanned_biometry_behind_text_cover_is_ranked(monkeypatch):
+    _setup(monkeypatch, ["Relatório OD OS espessura em mm", ""], {2: BIOMETRY})
+    render = FakeRender(2)
+    ranked, texts, text_pages = bc.locate_biometry_pages("x.pdf", render=render)
+    assert ranked[0] == 2
+    assert render.calls == [(2, 2)]
+    assert text_pages == {1}
+
+
+def test_confident_text_layer_skips_thumbnail_ocr(monkeypatch):
+    _setup(monkeypatch, ["capa", BIOMETRY, ""], {})
+    render = FakeRender(3)
+    ranked, _, _ = bc.locate_biometry_pages("x.pdf", render=render)
+    assert ranked == [2, 1]
+    assert render.calls == []
+
+
+def test_fallback_pages_fill_the_ranking(monkeypatch):
+    _setup(monkeypatch, ["nada", "nada", "nada", BIOMETRY], {})
+    ranked, _, _ = bc.locate_biometry_pages("x.pdf", render=FakeRender(4))
+    assert ranked == [4, 1]
+    _setup(monkeypatch, ["nada", "nada"], {})
+    ranked, _, _ = bc.locate_biometry_pages("x.pdf", render=FakeRender(2))
+    assert ranked == [1, 2]
+
+
+def test_without_pdftotext_all_pages_get_thumbnails(monkeypatch):
+    _setup(monkeypatch, [], {3: BIOMETRY})
+    render = FakeRender(3)
+    ranked, _, text_pages = bc.locate_biometry_pages("x.pdf", render=render)
+    assert render.calls == [(1, bc.LOCATOR_MAX_PAGES)]
+    assert ranked[0] == 3 and text_pages == set()
@@ -0,0 +1,44 @@
+import pytesseract
+from PIL import Image
+
+import barrett_core as bc
+
+OSD = "Page number: 0\nOrientation in degrees: 270\nRotate: 90\nOrientation confidence: {conf}\nScript: Latin\n"
+GOT = {"OD": {"AL": 23.45, "ACD": 3.1, "K1": 43.1, "K2": 44.2}}
+
+
+def test_parse_osd():
+    assert bc.parse_osd(OSD.format(conf="7.53")) == (90, 7.53)
+    assert bc.parse_osd("lixo") == (0, 0.0)
+
+
+def test_low_confidence_rotation_is_ignored(monkeypatch):
+    page = Image.new("L", (300, 400), 255)
+    monkeypatch.setattr(pytesseract, "image_to_osd", lambda im, config="": OSD.format(conf="0.81"))
+    assert bc.estimate_orientation_skew(page)["rotate"] == 0
+    monkeypatch.setattr(pytesseract, "image_to_osd", lambda im, config="": OSD.format(conf="9.10"))
+    assert bc.estimate_orientation_skew(page)["rotate"] == 90
+
+
+def test_wrong_rotation_falls_back_to_page_as_rendered(monkeypatch):
+    seen = []
+
+    def fake_halves(page, psms=("6", "11"), binarize=True, scale=1.8, info=None, memo=None):
+        seen.append(page.size)
+        return GOT if page.size == (100, 200) else {}   # só a página em pé tem biometria
+
+    monkeypatch.setattr(bc, "locate_biometry_pages", lambda path, render=None: ([1], {}, set()))
+    monkeypatch.setattr(bc, "strategy_plan", lambda template: [bc.DEFAULT_STRATEGIES[0]])
+    monkeypatch.setattr(bc, "strategy_record", lambda *a, **k: None)
+    monkeypatch.setattr(bc, "extract_embedded_scan", lambda path, page_no: None)
+    monkeypatch.setattr(bc, "estimate_orientation_skew",
+                        lambda page: {"rotate": 90, "skew": 0.0, "osd_conf": 3.0, "ms": 1.0})
+    monkeypatch.setattr(bc, "ocr_top_header_get_text", lambda page, top_ratio=0.22: "")
+    monkeypatch.setattr(bc, "extrair_biometria_dupla_por_metades", fake_halves)
+
+    stats = {"attempts": 0, "gate": None, "embedded": False, "render_ms": 0.0}
+    page, got, _ = bc._extract_with("x.pdf", stats, lambda first, last, dpi=200: [Image.new("L", (100, 200))])
+    assert got == GOT
+    assert page.size == (100, 200)
+    assert seen == [(200, 100), (100, 200)]
+    assert stats["gate"]["rotate"] == 0
@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("pypdfium2")
+from PIL import Image  # noqa: E402
+
+import barrett_core as bc  # noqa: E402
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "laudo.pdf"
+    ims = [Image.new("RGB", (144, 72), "white"), Image.new("RGB", (72, 144), "black")]
+    ims[0].save(path, format="PDF", save_all=True, append_images=ims[1:], resolution=72)
+    return str(path)
+
+
+@pytest.fixture
+def no_pdftoppm(monkeypatch):
+    monkeypatch.setattr(bc, "convert_from_path", lambda *a, **kw: pytest.fail("caiu para o pdftoppm"))
+
+
+def test_pdfium_renders_grayscale_pages_in_process(pdf, no_pdftoppm):
+    with bc.open_pdf_raster(pdf, "pdfium") as render:
+        assert render.backend == "pdfium"
+        pages = render(dpi=144)
+        assert [p.mode for p in pages] == ["L", "L"]
+        assert pages[0].size == (288, 144) and pages[1].size == (144, 288)
+        assert len(render(first_page=2, last_page=2, dpi=72)) == 1
+
+
+def test_document_is_opened_once_for_every_render(pdf, no_pdftoppm, monkeypatch):
+    opened = []
+    real = bc.pdfium.PdfDocument
+
+    def contando(*a, **kw):
+        opened.append(1)
+        return real(*a, **kw)
+
+    monkeypatch.setattr(bc.pdfium, "PdfDocument", contando)
+    with bc.open_pdf_raster(pdf, "pdfium") as render:
+        render(dpi=72)
+        render(first_page=1, last_page=1, dpi=200)
+    assert opened == [1]
+
+
+def test_unreadable_pdf_falls_back_to_pdftoppm(tmp_path, monkeypatch):
+    bad = tmp_path / "ruim.pdf"
+    bad.write_bytes(b"nao sou pdf")
+    calls = []
+    monkeypatch.setattr(bc, "convert_from_path", lambda path, **kw: calls.append(kw) or ["pagina"])
+    with bc.open_pdf_raster(str(bad), "pdfium") as render:
+        assert render.backend == "pdftoppm"
+        assert render(dpi=100) == ["pagina"]
+    assert calls[0]["grayscale"] and calls[0]["dpi"] == 100
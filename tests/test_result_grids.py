@@ -0,0 +1,29 @@
+import barrett_core as bc
+
+
+class GridDriver:
+    def __init__(self, grids):
+        self.grids, self.scripts = grids, []
+
+    def execute_script(self, js):
+        self.scripts.append(js)
+        return self.grids
+
+
+def test_rows_are_typed_and_short_rows_skipped():
+    rows = bc.parse_grid_rows([["21,5", "SN60WF", "−0.35"], ["22.0", "SN60WF*", "+0.02"], ["sem", "dados"]])
+    assert rows == [
+        {"IOL Power": 21.5, "Optic": "SN60WF", "Refraction": -0.35},
+        {"IOL Power": 22.0, "Optic": "SN60WF*", "Refraction": 0.02},
+    ]
+
+
+def test_both_grids_come_from_a_single_script_call():
+    driver = GridDriver({"OD": [["20.0", "A", "0.10"]], "OS": []})
+    tables = bc.fetch_result_tables(driver)
+    assert driver.scripts == [bc._GRIDS_JS]
+    assert tables == {"OD": [{"IOL Power": 20.0, "Optic": "A", "Refraction": 0.1}], "OS": []}
+
+
+def test_missing_grids_give_empty_tables():
+    assert bc.fetch_result_tables(GridDriver(None)) == {"OD": [], "OS": []}
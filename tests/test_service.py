@@ -0,0 +1,23 @@
+import pytest
+
+from barrett_service import BadRequest, browser_from, calc_inputs_from
+
+
+def test_browser_from_accepts_known_choices():
+    assert browser_from({}) is None
+    assert browser_from({"browser": ""}) is None
+    for name in ("auto", "Firefox", "Chrome"):
+        assert browser_from({"browser": name}) == name
+
+
+def test_browser_from_rejects_unknown():
+    with pytest.raises(BadRequest):
+        browser_from({"browser": "Safari"})
+
+
+def test_calc_inputs_from_requires_complete_biometry():
+    eye = {"AL": "23,5", "K1": 43, "K2": 44, "ACD": 3.1}
+    inputs = calc_inputs_from({"OD": eye, "OS": eye})
+    assert inputs["OD"]["AL"] == 23.5
+    with pytest.raises(BadRequest):
+        calc_inputs_from({"OD": eye, "OS": {"AL": 23}})
@@ -0,0 +1,46 @@
+import math
+
+import numpy as np
+
+from barrett_core import rank_lenses, solve_target, tables_to_arrays
+
+
+def _rows(*pairs):
+    return [{"IOL Power": p, "Optic": "SN60WF", "Refraction": r} for p, r in pairs]
+
+
+def test_bracketed_target_interpolates():
+    power, refr = tables_to_arrays([{"OD": _rows((20.0, 0.35), (20.5, 0.0), (21.0, -0.35))}], "OD")
+    sol = solve_target(power, refr, -0.175)
+    assert sol["nearest_power"][0] in (20.5, 21.0)
+    assert math.isclose(sol["interp_power"][0], 20.75)
+
+
+def test_unbracketed_target_gives_nearest_and_nan_interp():
+    power, refr = tables_to_arrays([{"OD": _rows((20.0, 0.35), (20.5, 0.0))}], "OD")
+    sol = solve_target(power, refr, -2.0)
+    assert sol["nearest_power"][0] == 20.5
+    assert math.isclose(sol["nearest_err"][0], 2.0)
+    assert np.isnan(sol["interp_power"][0])
+
+
+def test_empty_grid():
+    power, refr = tables_to_arrays([{"OD": []}, {"OD": []}], "OD")
+    sol = solve_target(power, refr, 0.0)
+    assert np.isnan(sol["interp_power"]).all()
+    assert np.isnan(sol["nearest_err"]).all()
+
+
+def test_single_row_grid():
+    power, refr = tables_to_arrays([{"OS": _rows((21.0, -0.1))}], "OS")
+    sol = solve_target(power, refr, 0.0)
+    assert sol["nearest_power"][0] == 21.0
+    assert np.isnan(sol["interp_power"][0])
+
+
+def test_rank_lenses_with_short_os_grid():
+    full = {"OD": _rows((20.0, 0.35), (20.5, 0.0), (21.0, -0.35)), "OS": []}
+    other = {"OD": _rows((19.5, 0.3), (20.0, -0.05)), "OS": _rows((20.0, 0.0))}
+    ranking = rank_lenses([full, other], ["A", "B"], 0.0, 0.0)
+    assert [r["Lente"] for r in ranking] == ["B", "A"]
+    assert math.isinf(ranking[1]["Erro total (D)"])
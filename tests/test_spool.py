@@ -0,0 +1,70 @@
+import io
+import os
+import time
+
+import pytest
+
+import barrett_core as bc
+
+
+@pytest.fixture
+def reg(monkeypatch, tmp_path):
+    state = {"lock": bc.threading.Lock(), "refs": {}, "session_doc": {}, "last_seen": {}}
+    monkeypatch.setattr(bc, "SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(bc, "spool_registry", lambda: state)
+    return state
+
+
+def test_put_is_content_addressed_and_written_once(reg):
+    h1 = bc.spool_put(io.BytesIO(b"%PDF-1 a"), "s1")
+    mtime = os.path.getmtime(bc.spool_path(h1))
+    h2 = bc.spool_put(io.BytesIO(b"%PDF-1 a"), "s2")
+    assert h1 == h2 and os.path.getmtime(bc.spool_path(h1)) == mtime
+    assert reg["refs"][h1] == {"s1", "s2"}
+    assert not [f for f in os.listdir(bc.SPOOL_DIR) if f.endswith(".tmp")]
+
+
+def test_switching_document_moves_the_reference(reg):
+    a = bc.spool_put(io.BytesIO(b"a"), "s1")
+    b = bc.spool_put(io.BytesIO(b"b"), "s1")
+    assert reg["refs"][a] == set() and reg["refs"][b] == {"s1"}
+
+
+def test_over_limit_evicts_unreferenced_oldest_first(reg, monkeypatch):
+    monkeypatch.setattr(bc, "SPOOL_MAX_MB", 1.5)
+    mb = b"x" * (1024 * 1024)
+    old = bc.spool_put(io.BytesIO(mb + b"1"), "s1")
+    os.utime(bc.spool_path(old), (time.time() - 60, time.time() - 60))
+    bc.spool_release("s1")
+    kept = bc.spool_put(io.BytesIO(mb + b"2"), "s2")
+    assert not os.path.exists(bc.spool_path(old))
+    assert os.path.exists(bc.spool_path(kept))
+
+
+def test_referenced_file_survives_the_limit_until_released(reg, monkeypatch):
+    monkeypatch.setattr(bc, "SPOOL_MAX_MB", 0.5)
+    h = bc.spool_put(io.BytesIO(b"y" * (1024 * 1024)), "s1")
+    assert os.path.exists(bc.spool_path(h))
+    bc.spool_release("s1")
+    bc.spool_put(io.BytesIO(b"z"), "s2")
+    assert not os.path.exists(bc.spool_path(h))
+
+
+def test_idle_sessions_are_released(reg, monkeypatch):
+    h = bc.spool_put(io.BytesIO(b"w"), "s1")
+    reg["last_seen"]["s1"] = time.time() - bc.SPOOL_IDLE_S - 1
+    os.utime(bc.spool_path(h), (time.time() - bc.SPOOL_IDLE_S - 1,) * 2)
+    bc.spool_put(io.BytesIO(b"v"), "s2")
+    assert "s1" not in reg["session_doc"]
+    assert not os.path.exists(bc.spool_path(h))
+
+
+def test_structured_exports_keep_their_own_extension(reg, monkeypatch):
+    monkeypatch.setattr(bc, "SPOOL_MAX_MB", 0.0)
+    h = bc.spool_put(io.BytesIO(b"AL;K1\n23.4;43.1\n"), "s1", "csv")
+    assert os.listdir(bc.SPOOL_DIR) == [f"{h}.csv"]          # nunca "<hash>.pdf" para o pdfium
+    bc.spool_put(io.BytesIO(b"<Export/>"), "s2", "xml")
+    assert os.path.exists(bc.spool_path(h, "csv"))            # referenciado: sobrevive ao limite
+    bc.spool_release("s1")
+    bc.spool_put(io.BytesIO(b"outro"), "s3")
+    assert not os.path.exists(bc.spool_path(h, "csv"))
@@ -0,0 +1,71 @@
+import io
+import time
+
+import pytest
+from PIL import Image
+
+import barrett_core as bc
+
+EYE = "Comp. AL: 23.45 mm MV: 43.10 / 44.20 D ACD: 3.10 mm"
+FEATS = {"pages": 3, "producer": "iolmaster", "size": [595, 842]}
+
+
+def test_fingerprint_ignores_thumbnail_ocr(monkeypatch):
+    templates = []
+    monkeypatch.setattr(bc, "pdf_layout_features", lambda path, page_no: dict(FEATS))
+    monkeypatch.setattr(bc, "strategy_plan", lambda template: templates.append(template) or [])
+    for ruido in ("IOLMaster 700 ACD", "lOLMaste r AC0"):
+        monkeypatch.setattr(bc, "locate_biometry_pages", lambda path, render=None: ([1], {1: ruido}, set()))
+        bc._extract_with("x.pdf", {"attempts": 0, "gate": None}, render=None)
+    assert templates[0] == templates[1]
+    assert bc.template_fingerprint(FEATS, 1, "IOLMaster ACD") != templates[0]   # camada de texto conta
+
+
+def test_pdf_layout_features(tmp_path):
+    pytest.importorskip("pypdfium2")
+    buf = io.BytesIO()
+    Image.new("RGB", (200, 300), "white").save(buf, format="PDF", save_all=True,
+                                               append_images=[Image.new("RGB", (200, 300))])
+    path = tmp_path / "laudo.pdf"
+    path.write_bytes(buf.getvalue())
+    feats = bc.pdf_layout_features(str(path), 1)
+    assert feats["pages"] == 2
+    assert feats["size"] == [200, 300]   # PIL grava a 72 dpi: 1 px = 1 ponto
+
+
+def test_repeated_psm_is_not_ocred_twice(monkeypatch):
+    calls = []
+    monkeypatch.setattr(bc, "preprocess_for_ocr", lambda page, binarize=True, scale=1.8, box=None: page)
+    monkeypatch.setattr(bc, "ocr_text", lambda im, psm="6", report=None: calls.append(psm) or (EYE if psm == "11" else ""))
+    memo = {}
+    page = Image.new("L", (40, 20))
+    assert bc.extrair_biometria_dupla_por_metades(page, psms=("6",), memo=memo) == {}
+    assert bc.extrair_biometria_dupla_por_metades(page, psms=("6", "11"), memo=memo)
+    assert calls == ["6", "11", "6", "11"]   # 2º passo: só o PSM 11 de cada olho é novo
+
+
+def test_render_cost_is_charged_to_every_strategy_at_that_dpi(monkeypatch):
+    first, second = ({"dpi": 400, "psms": p, "binarize": True, "layout": "metades"} for p in (("6",), ("11",)))
+    template = "t-render-cost"
+
+    def render(first_page, last_page, dpi=200):
+        time.sleep(0.05)
+        return [Image.new("L", (40, 20))]
+
+    monkeypatch.setattr(bc, "locate_biometry_pages", lambda path, render=None: ([1], {}, set()))
+    monkeypatch.setattr(bc, "template_fingerprint", lambda *a: template)
+    monkeypatch.setattr(bc, "strategy_plan", lambda t: [first, second])
+    monkeypatch.setattr(bc, "extract_embedded_scan", lambda path, page_no: None)
+    monkeypatch.setattr(bc, "estimate_orientation_skew", lambda page: {"rotate": 0, "skew": 0.0, "ms": 0.0})
+    monkeypatch.setattr(bc, "ocr_top_header_get_text", lambda page, top_ratio=0.22: "")
+    monkeypatch.setattr(bc, "extrair_biometria_dupla_por_metades",
+                        lambda page, psms, **kw: {"OD": {}, "OS": {}} if psms == ("11",) else {})
+    stats = {"attempts": 0, "gate": None, "embedded": False, "render_ms": 0.0}
+    bc._extract_with("x.pdf", stats, render)
+    with bc._history_conn() as conn:
+        rows = conn.execute("SELECT psms, successes, render_s, ocr_s FROM strategies WHERE template = ?",
+                            (template,)).fetchall()
+    by_psm = {r["psms"]: r for r in rows}
+    assert by_psm["6"]["successes"] == 0 and by_psm["11"]["successes"] == 1
+    assert by_psm["6"]["render_s"] >= 0.05 and by_psm["11"]["render_s"] >= 0.05
+    assert by_psm["11"]["ocr_s"] < 0.05